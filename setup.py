@@ -3,7 +3,7 @@ from pathlib import Path
 if __name__ == "__main__":
     import setuptools
     setuptools.setup(
-        packages=["utilitas"],
+        packages=["utilitas", "utilitas.management", "utilitas.management.commands"],
         # long_description=Path(__file__).parent / "READEME.md".read_text()
         long_description_content_type="text/markdown"
     )
\ No newline at end of file
@@ -0,0 +1,143 @@
+from django.core.exceptions import BadRequest
+from django.db.models import Avg, Count, Max, Min, Sum
+
+from utilitas.filters import UNORDERED_FIELD_TYPES, resolve_field
+from utilitas.schema import get_schema
+
+AGGREGATE_FUNCTIONS = {
+    "count": Count,
+    "sum": Sum,
+    "avg": Avg,
+    "min": Min,
+    "max": Max,
+}
+NUMERIC_FIELD_TYPES = {
+    "AutoField",
+    "BigAutoField",
+    "SmallAutoField",
+    "IntegerField",
+    "BigIntegerField",
+    "SmallIntegerField",
+    "PositiveIntegerField",
+    "PositiveBigIntegerField",
+    "PositiveSmallIntegerField",
+    "FloatField",
+    "DecimalField",
+    "DurationField",
+}
+MAX_GROUP_BY = 10
+MAX_AGGREGATES = 20
+
+
+# A validated aggregation: the lookups to group by, the annotations computing the
+# aggregates and the ordering of the groups.
+class Aggregation:
+    def __init__(self, group_by, annotations, ordering):
+        self.group_by = group_by
+        self.annotations = annotations
+        self.ordering = ordering
+
+    # a list of rows with the group_by values and the aggregates, or a single row
+    # for the whole queryset when there is nothing to group by
+    def apply(self, queryset, limit=None):
+        if not self.group_by:
+            return [queryset.aggregate(**self.annotations)]
+        queryset = (
+            queryset.values(*self.group_by)
+            .annotate(**self.annotations)
+            .order_by(*self.ordering)
+        )
+        if limit is not None:
+            queryset = queryset[:limit]
+        return list(queryset)
+
+
+def _internal_type(field):
+    if field.is_relation:
+        target = getattr(field, "target_field", None) or field.related_model._meta.pk
+        return target.get_internal_type()
+    return field.get_internal_type()
+
+
+def compile_aggregate(model, aggregate, index: int):
+    if not isinstance(aggregate, dict):
+        raise BadRequest({index: "Each aggregate must be an object."})
+    function = aggregate.get("function")
+    if function not in AGGREGATE_FUNCTIONS:
+        raise BadRequest(
+            {index: {"function": f"Must be one of {list(AGGREGATE_FUNCTIONS)}."}}
+        )
+
+    field_name = aggregate.get("field_name")
+    if field_name is None:
+        if function != "count":
+            raise BadRequest({index: {"field_name": "This field is required."}})
+        field_name = "pk"
+    if not isinstance(field_name, str) or not field_name:
+        raise BadRequest({index: {"field_name": "Must be a field name."}})
+
+    field = resolve_field(model, field_name)
+    if field is not None:
+        internal_type = _internal_type(field)
+        if function in ("sum", "avg") and (
+            field.is_relation or internal_type not in NUMERIC_FIELD_TYPES
+        ):
+            raise BadRequest(
+                f"'{function}' can only be used on numeric fields, not on {field.name} ({internal_type})."
+            )
+        if function in ("min", "max") and internal_type in UNORDERED_FIELD_TYPES:
+            raise BadRequest(
+                f"'{function}' can't be used on {field.name} ({internal_type})."
+            )
+
+    alias = aggregate.get("alias") or (
+        "count" if field_name == "pk" else f"{field_name}__{function}"
+    )
+    if not isinstance(alias, str) or not alias.replace("__", "_").isidentifier():
+        raise BadRequest({index: {"alias": "Must be a valid identifier."}})
+    if alias in get_schema(model).fields:
+        raise BadRequest({index: {"alias": f"{alias} conflicts with a field name."}})
+
+    if function == "count":
+        expression = Count(field_name, distinct=bool(aggregate.get("distinct", False)))
+    else:
+        expression = AGGREGATE_FUNCTIONS[function](field_name)
+    return alias, expression
+
+
+# Validates `group_by` (field names, following relations with "__") and `aggregates`
+# ({"function", "field_name", "alias", "distinct"} objects) against the model's fields.
+# `order_by` may name group_by fields and aggregate aliases, and defaults to group_by.
+def compile_aggregation(model, group_by=None, aggregates=None, order_by=None):
+    group_by = group_by or []
+    aggregates = aggregates or [{"function": "count"}]
+    if not isinstance(group_by, list) or not all(
+        isinstance(i, str) and i for i in group_by
+    ):
+        raise BadRequest("'group_by' must be a list of field names.")
+    if not isinstance(aggregates, list):
+        raise BadRequest("'aggregates' must be a list.")
+    if len(group_by) > MAX_GROUP_BY or len(aggregates) > MAX_AGGREGATES:
+        raise BadRequest(
+            f"Aggregations are limited to {MAX_GROUP_BY} group_by fields and {MAX_AGGREGATES} aggregates."
+        )
+
+    for i in group_by:
+        resolve_field(model, i)
+
+    annotations = {}
+    for index, aggregate in enumerate(aggregates):
+        alias, expression = compile_aggregate(model, aggregate, index)
+        if alias in annotations or alias in group_by:
+            raise BadRequest({index: {"alias": f"{alias} is used more than once."}})
+        annotations[alias] = expression
+
+    ordering = order_by if order_by is not None else list(group_by)
+    if not isinstance(ordering, list) or not all(
+        isinstance(i, str) and i.lstrip("-") in (*group_by, *annotations)
+        for i in ordering
+    ):
+        raise BadRequest(
+            "'order_by' may only name group_by fields and aggregate aliases."
+        )
+    return Aggregation(group_by, annotations, ordering)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class UtilitasConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "utilitas"
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from utilitas import checks  # registers the system checks
+        from utilitas.schema import build_schemas
+        from utilitas.search import install_search_indexes_after_migrate
+
+        build_schemas()
+        post_migrate.connect(
+            install_search_indexes_after_migrate,
+            dispatch_uid="utilitas.install_search_indexes",
+        )
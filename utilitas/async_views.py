@@ -0,0 +1,317 @@
+import asyncio
+import csv
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import BadRequest
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+from rest_framework.views import Request, status
+
+from utilitas.compiled import CompiledSerializer
+from utilitas.views import BaseDetailsView, BaseListView, BaseSearchView, Echo
+
+
+# Async counterparts of the utilitas views, for projects served over ASGI.
+# Reads use Django's async ORM: the count and the page of a list are fetched concurrently,
+# csv files are streamed with aiterator(). Writes run the regular synchronous handlers in a
+# worker thread, since transaction.atomic() only exists on the synchronous side.
+class AsyncViewMixin:
+    # tells Django's as_view() to return a coroutine function
+    view_is_async = True
+
+    # same as APIView.dispatch, awaiting the handler
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.ainitial(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(
+                    self, request.method.lower(), self.http_method_not_allowed
+                )
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    # authentication, permissions and throttles may query the database, they are checked in
+    # a worker thread when the view has any
+    async def ainitial(self, request, *args, **kwargs):
+        if (
+            self.authentication_classes
+            or self.permission_classes
+            or self.throttle_classes
+        ):
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+        else:
+            self.initial(request, *args, **kwargs)
+
+    # serializers may query the database (method fields, relations that weren't prefetched),
+    # which can't be done from the event loop
+    async def aget_serialized_data(self, serializer):
+        if isinstance(serializer, CompiledSerializer):
+            return serializer.data
+        return await sync_to_async(lambda: serializer.data)()
+
+    # async variant of `get_queryset`, returns the serialized page
+    async def aget_queryset(
+        self,
+        request: Request,
+        filter_params=None,
+        exclude_params=None,
+        fields=None,
+        sorts=None,
+        expand=None,
+    ):
+        if fields is None:
+            fields = []
+
+        if sorts is None:
+            sorts = []
+
+        if expand is None:
+            expand = []
+
+        queryset = self.prepare_queryset(
+            request, filter_params, exclude_params, fields, sorts, expand
+        )
+
+        reader = self.get_compiled_reader(fields, expand)
+        if reader is not None:
+            rows = await self.apaginate_queryset(
+                queryset.values_list(*reader.columns), request
+            )
+            return CompiledSerializer(reader, rows)
+
+        paginated_data = await self.apaginate_queryset(queryset, request)
+        serialized_data = self.get_serializer(
+            paginated_data,
+            many=True,
+            fields=fields,
+            expand=expand,
+            context={"model": self.model},
+        )
+        await self.aget_serialized_data(serialized_data)
+        return serialized_data
+
+    # async variant of `send_cached_response`, `build_response` is a coroutine function
+    async def asend_cached_response(
+        self, request: Request, build_response, expand=None, body=None
+    ):
+        if not self.cache_responses:
+            return await build_response()
+
+        key, etag, response = await sync_to_async(self.get_cached_response)(
+            request, expand, body
+        )
+        if response is None:
+            response = await build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            await sync_to_async(self.cache_response)(key, response)
+        response["ETag"] = etag
+        return response
+
+    # same as BaseView.send_csv, with rows streamed from an async generator so that ASGI
+    # servers don't have to consume a synchronous iterator. Chunks are read from the
+    # server-side cursor in a worker thread (aiterator() runs values_list() queries from the
+    # event loop on some Django versions).
+    def send_csv(self, request: Request, data: QuerySet, fields):
+        if len(fields) == 0:
+            fields = data.model.get_fields(data.model)
+        try:
+            self.validate_csv_fields(data.model, fields)
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
+
+        writer = csv.writer(Echo())
+        iterator = data.values_list(*fields).iterator(chunk_size=self.csv_chunk_size)
+        next_chunk = sync_to_async(lambda: list(islice(iterator, self.csv_chunk_size)))
+
+        async def rows():
+            yield writer.writerow(
+                data.model.get_user_friendly_fields(data.model, fields)
+            )
+            while True:
+                chunk = await next_chunk()
+                if not chunk:
+                    break
+                for row in chunk:
+                    yield writer.writerow(row)
+
+        return StreamingHttpResponse(
+            rows(),
+            content_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename='data.csv'"},
+        )
+
+
+class AsyncBaseListView(AsyncViewMixin, BaseListView):
+    _is_internal = True
+    name = "Async base list view"
+
+    async def get(self, request: Request):
+        self.description = self.model.__doc__
+
+        # if meta query_param is present, return metadata of the current endpoint
+        if request.GET.get("meta"):
+            return self.send_metadata(request)
+
+        try:
+            query_params = self.get_query_params(request)
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
+
+        ids = request.query_params.get(self.ids_param)
+        if ids:
+            try:
+                ids = self.decode_query_param(ids, self.ids_param)
+            except BadRequest as e:
+                return self.send_response(
+                    True, "bad_request", {"details": str(e)}, status=400
+                )
+            return await sync_to_async(self.send_multi_get)(request, ids, query_params)
+
+        if request.query_params.get("csv"):
+            return self.send_csv(
+                request,
+                self.get_queryset(request, None, None, True, **query_params),
+                fields=query_params["fields"],
+            )
+
+        async def build_response():
+            serialized_data = await self.aget_queryset(request, **query_params)
+
+            # return the serialized queryset in a standardized manner
+            return self.send_response(
+                False,
+                "success",
+                {**self.get_paginated_response(), "data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            )
+
+        return await self.asend_cached_response(
+            request, build_response, query_params["expand"]
+        )
+
+    async def post(self, request: Request):
+        return await sync_to_async(super().post)(request)
+
+    async def patch(self, request: Request):
+        return await sync_to_async(super().patch)(request)
+
+    async def delete(self, request: Request):
+        return await sync_to_async(super().delete)(request)
+
+
+class AsyncBaseDetailsView(AsyncViewMixin, BaseDetailsView):
+    _is_internal = True
+    name = "Async base details view"
+
+    async def _aget_object(self, obj_id: int, fields=None, expand=None):
+        queryset = self.project_queryset(
+            self.expand_queryset(self.model.objects.filter(pk=obj_id), expand, fields),
+            fields,
+            expand,
+        )
+        # the pk matches one row at most, no need for the ORDER BY of afirst()
+        async for obj in queryset.order_by()[:1]:
+            return obj
+        return None
+
+    async def get(self, request: Request, obj_id: int):
+        self.description = self.model.__doc__
+
+        query_params = self.get_query_params(request)
+        query_params.pop("sorts")
+        obj = await self._aget_object(obj_id, **query_params)
+        if obj is None:
+            return self._send_not_found(obj_id)
+        conditional_response = self.get_conditional_response(request, obj)
+        if conditional_response is not None:
+            return conditional_response
+        serialized_data = self.get_serializer(obj, **query_params)
+        return self.set_version_headers(
+            self.send_response(
+                False,
+                "success",
+                {"data": await self.aget_serialized_data(serialized_data)},
+                status=status.HTTP_200_OK,
+            ),
+            obj,
+        )
+
+    async def put(self, request: Request, obj_id: int):
+        return await sync_to_async(super().put)(request, obj_id)
+
+    async def delete(self, request: Request, obj_id: int):
+        return await sync_to_async(super().delete)(request, obj_id)
+
+
+class AsyncBaseSearchView(AsyncViewMixin, BaseSearchView):
+    _is_internal = True
+    name = "Async base search view"
+
+    async def post(self, request: Request):
+        try:
+            query_params = self.get_query_params(request)
+            filter_params = self.get_filter_params(request)
+            exclude_params = self.get_exclude_params(request)
+            self.get_search_query(request)
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
+
+        # aggregations are one query, run by the synchronous handler in a worker thread
+        if request.query_params.get("aggregate"):
+            return await sync_to_async(self.send_aggregation)(
+                request, filter_params, exclude_params
+            )
+
+        if request.query_params.get("csv"):
+            return self.send_csv(
+                request,
+                self.get_queryset(
+                    request, filter_params, exclude_params, True, **query_params
+                ),
+                fields=query_params["fields"],
+            )
+
+        async def build_response():
+            serialized_data = await self.aget_queryset(
+                request, filter_params, exclude_params, **query_params
+            )
+
+            # return the serialized queryset in a standardized manner
+            return self.send_response(
+                False,
+                "success",
+                {**self.get_paginated_response(), "data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            )
+
+        return await self.asend_cached_response(
+            request,
+            build_response,
+            query_params["expand"],
+            [filter_params, exclude_params, request.data],
+        )
@@ -0,0 +1,444 @@
+# Micro-benchmarks for utilitas. Self-contained: when Django isn't configured yet, an
+# in-memory SQLite database is set up for the run.
+#
+#     python -m utilitas.benchmarks
+#     python -m utilitas.benchmarks views --rows 2000
+#
+# The views benchmark also checks the number of queries of every scenario against a
+# budget, and exits with a non-zero status when one is exceeded (e.g. an N+1 came back).
+import argparse
+import base64
+import functools
+import json
+import math
+import statistics
+import sys
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+
+
+def setup():
+    if not settings.configured:
+        settings.configure(
+            SECRET_KEY="utilitas-benchmarks",
+            INSTALLED_APPS=[
+                "django.contrib.contenttypes",
+                "django.contrib.auth",
+                "rest_framework",
+                "utilitas",
+            ],
+            DATABASES={
+                "default": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": ":memory:",
+                }
+            },
+            DEFAULT_AUTO_FIELD="django.db.models.BigAutoField",
+            ALLOWED_HOSTS=["testserver"],
+            USE_TZ=True,
+            REST_FRAMEWORK={"UNAUTHENTICATED_USER": None},
+        )
+    django.setup()
+
+
+_models = {}
+
+
+# a model with `width` CharFields (plus `fields`), registered under the utilitas app
+def make_model(name: str, width: int, base=None, **fields):
+    from django.db import models
+
+    key = (name, width)
+    if key not in _models:
+        attrs = {
+            "__module__": __name__,
+            "Meta": type("Meta", (), {"app_label": "utilitas"}),
+        }
+        if base is None:
+            base = models.Model
+            # the same columns BaseModel adds
+            attrs["created_at"] = models.DateTimeField(auto_now_add=True)
+            attrs["updated_at"] = models.DateTimeField(auto_now=True)
+        for i in range(width):
+            attrs[f"field_{i}"] = models.CharField(max_length=32, default="")
+        attrs.update(fields)
+        _models[key] = type(f"{name}{width}", (base,), attrs)
+    return _models[key]
+
+
+def create_tables(*models):
+    from django.db import connection
+
+    existing = connection.introspection.table_names()
+    with connection.schema_editor() as schema_editor:
+        for i in models:
+            if i._meta.db_table not in existing:
+                schema_editor.create_model(i)
+
+
+def timed(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# instances per second for BaseModel subclasses and plain models.Model, both hydrated
+# directly with from_db (the path every queried row goes through) and through a query
+def bench_hydration(rows=10000, widths=(5, 20, 50)):
+    from django.utils import timezone
+
+    from utilitas.models import BaseModel
+
+    results = []
+    for width in widths:
+        models = {
+            "models.Model": make_model("PlainHydration", width),
+            "BaseModel": make_model("BaseHydration", width, BaseModel),
+        }
+        create_tables(*models.values())
+        for label, model in models.items():
+            now = timezone.now()
+            model.objects.bulk_create(
+                [model(created_at=now, updated_at=now) for _ in range(rows)],
+                batch_size=1000,
+            )
+            field_names = [i.attname for i in model._meta.concrete_fields]
+            values = [
+                tuple(getattr(j, i) for i in field_names) for j in model.objects.all()
+            ]
+
+            from_db = timed(
+                lambda: [model.from_db("default", field_names, i) for i in values]
+            )
+            query = timed(lambda: list(model.objects.all()))
+            results.append(
+                {
+                    "model": label,
+                    "width": width,
+                    "from_db/s": int(rows / from_db),
+                    "query/s": int(rows / query),
+                }
+            )
+    return results
+
+
+# the models of the views benchmark: Item rows (of `width` columns) belong to a Category
+# and have `fanout` Child rows each
+def make_view_models(width: int):
+    from django.db import models
+
+    from utilitas.models import BaseModel
+
+    category = make_model("BenchCategory", width, BaseModel)
+    item = make_model(
+        "BenchItem",
+        width,
+        BaseModel,
+        category=models.ForeignKey(category, models.CASCADE, related_name="items"),
+    )
+    child = make_model(
+        "BenchChild",
+        width,
+        BaseModel,
+        item=models.ForeignKey(item, models.CASCADE, related_name="children"),
+    )
+    return category, item, child
+
+
+def make_view_classes(category, item, child):
+    from utilitas.serializers import BaseModelSerializer
+    from utilitas.views import BaseDetailsView, BaseListView, BaseSearchView
+
+    def serializer_for(model, **expandable_fields):
+        meta = type(
+            "Meta",
+            (BaseModelSerializer.Meta,),
+            {
+                "model": model,
+                "fields": "__all__",
+                "expandable_fields": expandable_fields,
+            },
+        )
+        return type(
+            f"{model.__name__}Serializer", (BaseModelSerializer,), {"Meta": meta}
+        )
+
+    serializer = serializer_for(
+        item,
+        category=serializer_for(category),
+        children=(serializer_for(child), {"many": True}),
+    )
+    attrs = {"model": item, "serializer": serializer}
+    return {
+        "list": type("BenchList", (BaseListView,), attrs),
+        "details": type("BenchDetails", (BaseDetailsView,), attrs),
+        "search": type("BenchSearch", (BaseSearchView,), attrs),
+    }
+
+
+def seed(category, item, child, rows, fanout):
+    from django.utils import timezone
+
+    now = timezone.now()
+    for model in (child, item, category):
+        model.objects.all().delete()
+    # a handful of categories, so that most rows of a page share theirs
+    categories = category.objects.bulk_create(
+        [
+            category(created_at=now, updated_at=now, field_0=f"category {i}")
+            for i in range(max(1, rows // 100))
+        ]
+    )
+    items = item.objects.bulk_create(
+        [
+            item(
+                created_at=now,
+                updated_at=now,
+                category=categories[i % len(categories)],
+                **{f"field_{j}": f"value {i} {j}" for j in range(3)},
+            )
+            for i in range(rows)
+        ],
+        batch_size=500,
+    )
+    child.objects.bulk_create(
+        [
+            child(created_at=now, updated_at=now, item=i)
+            for i in items
+            for _ in range(fanout)
+        ],
+        batch_size=500,
+    )
+    return items
+
+
+def encode_param(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+# the number of statements Django splits a bulk write of `count` rows into
+def count_batches(fields, count):
+    from django.db import connection
+
+    from utilitas.views import BaseView
+
+    batch_size = min(
+        BaseView.bulk_batch_size,
+        max(connection.ops.bulk_batch_size(fields, range(count)), 1),
+    )
+    return math.ceil(count / batch_size)
+
+
+# (name, view, method, query params, body, query budget). The budgets don't depend on the
+# number of rows, a scenario going over its budget is running queries per row.
+# Bulk writes run in a transaction, BEGIN and COMMIT are counted as queries.
+def get_view_scenarios(views, items, page_size=50, bulk_size=200):
+    model = type(items[0])
+    sorts = encode_param(["id"])
+    details = functools.partial(views["details"], obj_id=items[0].pk)
+    inserted_fields = [i for i in model._meta.concrete_fields if not i.primary_key]
+    updated_fields = ["pk", "pk", "field_1", "updated_at"]
+    return [
+        ("list", views["list"], "get", {"size": page_size, "sorts": sorts}, None, 2),
+        (
+            "list fields",
+            views["list"],
+            "get",
+            {
+                "size": page_size,
+                "sorts": sorts,
+                "fields": encode_param(["id", "field_0", "category"]),
+            },
+            None,
+            2,
+        ),
+        (
+            "list expand",
+            views["list"],
+            "get",
+            {
+                "size": page_size,
+                "sorts": sorts,
+                "expand": encode_param(["category", "children"]),
+            },
+            None,
+            4,
+        ),
+        (
+            "search",
+            views["search"],
+            "post",
+            {"size": page_size, "sorts": sorts},
+            {
+                "filter_params": [
+                    {"field_name": "field_0", "operator": "icontains", "value": "1"}
+                ],
+                "exclude_params": [
+                    {"field_name": "category", "operator": "exact", "value": 0}
+                ],
+            },
+            2,
+        ),
+        ("details", details, "get", {}, None, 1),
+        (
+            "details expand",
+            details,
+            "get",
+            {"expand": encode_param(["category", "children"])},
+            None,
+            3,
+        ),
+        ("csv", views["list"], "get", {"csv": 1}, None, 1),
+        (
+            "bulk create",
+            views["list"],
+            "post",
+            {"bulk": 1},
+            {
+                "objects": [
+                    {"category": items[0].category_id, "field_0": f"bulk {i}"}
+                    for i in range(bulk_size)
+                ]
+            },
+            # the categories are fetched with one query
+            3 + count_batches(inserted_fields, bulk_size),
+        ),
+        (
+            "bulk update",
+            views["list"],
+            "patch",
+            {"bulk": 1},
+            {
+                "objects": [
+                    {"id": i.pk, "field_1": f"updated {j}"}
+                    for j, i in enumerate(items[:bulk_size])
+                ]
+            },
+            3 + count_batches(updated_fields, bulk_size),
+        ),
+    ]
+
+
+# runs a request through the view, rendering (or streaming) the whole response
+def call_view(view, method, path, params, body):
+    from rest_framework.test import APIRequestFactory
+
+    factory = APIRequestFactory()
+    if method == "get":
+        request = factory.get(path, params)
+    else:
+        query = "&".join(f"{i}={j}" for i, j in params.items())
+        request = getattr(factory, method)(f"{path}?{query}", body, format="json")
+    response = view(request)
+    if response.streaming:
+        content = b"".join(response.streaming_content)
+    else:
+        content = response.render().content
+    if response.status_code >= 400:
+        raise RuntimeError(
+            f"{method.upper()} {path} {response.status_code}: {content[:200]}"
+        )
+    return content
+
+
+# latency, throughput, peak memory and query count of the list, search, details, csv and
+# bulk endpoints, for every width and fan-out
+def bench_views(rows=10000, widths=(5, 20), fanouts=(1, 5), repeat=20):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    results = []
+    for width in widths:
+        category, item, child = make_view_models(width)
+        create_tables(category, item, child)
+        views = {
+            i: j.as_view() for i, j in make_view_classes(category, item, child).items()
+        }
+
+        for fanout in fanouts:
+            items = seed(category, item, child, rows, fanout)
+            for name, view, method, params, body, budget in get_view_scenarios(
+                views, items
+            ):
+
+                def run():
+                    return call_view(view, method, "/bench/", params, body)
+
+                with CaptureQueriesContext(connection) as queries:
+                    run()
+
+                tracemalloc.start()
+                run()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - start)
+
+                results.append(
+                    {
+                        "scenario": name,
+                        "width": width,
+                        "fanout": fanout,
+                        "ms": round(statistics.median(timings) * 1000, 2),
+                        "req/s": int(repeat / sum(timings)),
+                        "peak KiB": peak // 1024,
+                        "queries": len(queries),
+                        "budget": budget,
+                    }
+                )
+    return results
+
+
+def get_budget_failures(results):
+    return [i for i in results if "budget" in i and i["queries"] > i["budget"]]
+
+
+def print_table(results):
+    columns = list(results[0])
+    widths = [max(len(str(i)), *(len(str(j[i])) for j in results)) for i in columns]
+    print("  ".join(i.ljust(j) for i, j in zip(columns, widths)))
+    for row in results:
+        print("  ".join(str(row[i]).ljust(j) for i, j in zip(columns, widths)))
+
+
+BENCHMARKS = {
+    "hydration": bench_hydration,
+    "views": bench_views,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="utilitas benchmarks")
+    parser.add_argument("benchmarks", nargs="*", choices=[[], *BENCHMARKS], default=[])
+    parser.add_argument("--rows", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    setup()
+    failures = []
+    for name in args.benchmarks or BENCHMARKS:
+        print(f"== {name}")
+        results = BENCHMARKS[name](rows=args.rows)
+        print_table(results)
+        failures.extend(get_budget_failures(results))
+
+    for i in failures:
+        print(
+            f"query budget exceeded: {i['scenario']} (width {i['width']}, fanout {i['fanout']}) "
+            f"ran {i['queries']} queries, the budget is {i['budget']}",
+            file=sys.stderr,
+        )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
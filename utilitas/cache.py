@@ -0,0 +1,170 @@
+import hashlib
+import json
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.utils.module_loading import import_string
+
+VERSION_KEY_PREFIX = "utilitas:version:"
+RESPONSE_KEY_PREFIX = "utilitas:response:"
+
+
+# Response caches store pickled bytes, so a cached payload can't be mutated by whoever
+# reads it. Besides the entries, a backend keeps one version counter per model: bumping
+# the version of a model makes every cached response built from it unreachable.
+class BaseResponseCache:
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value: bytes, timeout=None):
+        raise NotImplementedError
+
+    def get_version(self, label: str) -> int:
+        raise NotImplementedError
+
+    def bump_version(self, label: str) -> int:
+        raise NotImplementedError
+
+
+# an in-process LRU cache, bounded by number of entries and by total size in bytes
+class LRUCache(BaseResponseCache):
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        # versions are kept apart from the entries so they are never evicted. They start
+        # from the time the cache was created: ETags are derived from them, and one issued
+        # before a restart must not match responses built after it.
+        self._versions = {}
+        self._epoch = time.time_ns()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value: bytes, timeout=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = (value, expires_at)
+            self.size += len(value)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._delete(next(iter(self._entries)))
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def get_version(self, label: str) -> int:
+        return self._versions.get(label, self._epoch)
+
+    def bump_version(self, label: str) -> int:
+        with self._lock:
+            self._versions[label] = self._versions.get(label, self._epoch) + 1
+            return self._versions[label]
+
+
+# uses one of the caches of the CACHES setting, so entries and versions are shared
+# between processes
+class DjangoCache(BaseResponseCache):
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value: bytes, timeout=None):
+        self.cache.set(key, value, timeout)
+
+    def get_version(self, label: str) -> int:
+        key = VERSION_KEY_PREFIX + label
+        version = self.cache.get(key)
+        if version is None:
+            # a version that was evicted must not start over from a number that was
+            # already used, or stale responses could come back
+            self.cache.add(key, time.time_ns(), None)
+            version = self.cache.get(key, 0)
+        return version
+
+    def bump_version(self, label: str) -> int:
+        key = VERSION_KEY_PREFIX + label
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, time.time_ns(), None)
+            return self.cache.incr(key)
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+# The cache used for responses and model versions. Configured with the
+# UTILITAS_RESPONSE_CACHE setting, e.g.
+#   UTILITAS_RESPONSE_CACHE = {"BACKEND": "utilitas.cache.DjangoCache", "OPTIONS": {"alias": "default"}}
+# and an in-process LRUCache when not set.
+def get_response_cache() -> BaseResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                config = getattr(settings, "UTILITAS_RESPONSE_CACHE", {})
+                backend = import_string(
+                    config.get("BACKEND", "utilitas.cache.LRUCache")
+                )
+                _response_cache = backend(**config.get("OPTIONS", {}))
+    return _response_cache
+
+
+def get_model_version(model) -> int:
+    return get_response_cache().get_version(model._meta.label)
+
+
+# Called after a write to `model`'s table. Inside a transaction, the version is bumped
+# again on commit: a response cached by a read in between holds the rows as they were
+# before the write, and must not be reachable once the write is visible.
+def bump_model_version(model, using=None) -> int:
+    cache = get_response_cache()
+    label = model._meta.label
+    if using is None:
+        using = router.db_for_write(model)
+    if connections[using].in_atomic_block:
+        transaction.on_commit(lambda: cache.bump_version(label), using=using)
+    return cache.bump_version(label)
+
+
+def make_response_key(*parts) -> str:
+    digest = hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return RESPONSE_KEY_PREFIX + digest
+
+
+def dump_response(data, status: int) -> bytes:
+    return pickle.dumps((data, status), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_response(value: bytes):
+    return pickle.loads(value)
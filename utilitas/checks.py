@@ -0,0 +1,99 @@
+from django.apps import apps
+from django.core import checks
+
+
+def get_base_models(app_configs=None):
+    from utilitas.models import BaseModel
+
+    if app_configs is None:
+        models = apps.get_models()
+    else:
+        models = [j for i in app_configs for j in i.get_models()]
+    return [i for i in models if issubclass(i, BaseModel)]
+
+
+# chosen_one_fields must be boolean fields of the model
+@checks.register(checks.Tags.models)
+def check_chosen_one_fields(app_configs=None, **kwargs):
+    errors = []
+    for model in get_base_models(app_configs):
+        fields = {i.name: i for i in model._meta.get_fields()}
+        for name in model.chosen_one_fields:
+            field = fields.get(name)
+            if field is None:
+                errors.append(
+                    checks.Error(
+                        f"'{name}' in chosen_one_fields is not present in {model.__name__}'s fields.",
+                        obj=model,
+                        id="utilitas.E001",
+                    )
+                )
+            elif field.get_internal_type() not in ("BooleanField", "NullBooleanField"):
+                errors.append(
+                    checks.Error(
+                        f"'{name}' in chosen_one_fields must be a BooleanField.",
+                        obj=model,
+                        id="utilitas.E002",
+                    )
+                )
+    return errors
+
+
+# searchable_fields must be text columns of the model
+@checks.register(checks.Tags.models)
+def check_searchable_fields(app_configs=None, **kwargs):
+    from utilitas.search import SEARCHABLE_FIELD_TYPES
+
+    errors = []
+    for model in get_base_models(app_configs):
+        fields = {i.name: i for i in model._meta.get_fields()}
+        for name in model.searchable_fields:
+            field = fields.get(name)
+            if field is None:
+                errors.append(
+                    checks.Error(
+                        f"'{name}' in searchable_fields is not present in {model.__name__}'s fields.",
+                        obj=model,
+                        id="utilitas.E003",
+                    )
+                )
+            elif (
+                not field.concrete
+                or field.get_internal_type() not in SEARCHABLE_FIELD_TYPES
+            ):
+                errors.append(
+                    checks.Error(
+                        f"'{name}' in searchable_fields must be one of {sorted(SEARCHABLE_FIELD_TYPES)}.",
+                        obj=model,
+                        id="utilitas.E004",
+                    )
+                )
+    return errors
+
+
+# the default ordering sorts every list and search page that isn't sorted by the client,
+# it needs an index to not sort whole tables
+@checks.register(checks.Tags.models)
+def check_ordering_indexes(app_configs=None, **kwargs):
+    from utilitas.indexes import get_declared_indexes, get_default_ordering, is_indexed
+
+    warnings = []
+    for model in get_base_models(app_configs):
+        fields = []
+        for i in get_default_ordering(model):
+            name = i.lstrip("-")
+            if name == "pk":
+                name = model._meta.pk.name
+            if "__" in name:
+                break
+            fields.append(name)
+        if fields and not is_indexed(fields, get_declared_indexes(model)):
+            warnings.append(
+                checks.Warning(
+                    f"The ordering of {model.__name__} ({', '.join(fields)}) isn't served by an index.",
+                    hint="Add an index on these fields to Meta.indexes, or run the index_advisor command.",
+                    obj=model,
+                    id="utilitas.W001",
+                )
+            )
+    return warnings
@@ -0,0 +1,112 @@
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.utils.serializer_helpers import ReturnList
+
+from utilitas.schema import get_schema
+from utilitas.serializers import BaseModelSerializer
+
+# serializer fields whose to_representation returns the database values of these model
+# fields as they are
+IDENTITY_FIELDS = {
+    serializers.CharField: {"CharField", "TextField", "SlugField", "EmailField"},
+    serializers.IntegerField: {
+        "AutoField",
+        "BigAutoField",
+        "SmallAutoField",
+        "IntegerField",
+        "BigIntegerField",
+        "SmallIntegerField",
+        "PositiveIntegerField",
+        "PositiveBigIntegerField",
+        "PositiveSmallIntegerField",
+    },
+    serializers.BooleanField: {"BooleanField"},
+}
+UNSUPPORTED_FIELDS = (
+    serializers.SerializerMethodField,
+    serializers.HiddenField,
+    ManyRelatedField,
+    serializers.BaseSerializer,
+)
+
+
+# A read-only serializer generated for a (serializer class, fields, expand) combination.
+# It turns `values_list(*columns)` tuples into the same dicts the serializer would produce,
+# without building model instances or bound fields for every row.
+class CompiledReader:
+    def __init__(self, columns, row_to_dict):
+        self.columns = columns
+        self.row_to_dict = row_to_dict
+
+    def serialize(self, rows):
+        row_to_dict = self.row_to_dict
+        return ReturnList([row_to_dict(i) for i in rows], serializer=None)
+
+
+# mimics the `.data` of a serializer, so callers can use either
+class CompiledSerializer:
+    def __init__(self, reader: CompiledReader, rows):
+        self.data = reader.serialize(rows)
+
+
+def compile_reader(serializer_class, model, fields=(), expand=()):
+    # nested serializers and custom representations need the regular path
+    if expand:
+        return None
+    if not issubclass(serializer_class, BaseModelSerializer):
+        return None
+    if serializer_class.to_representation is not BaseModelSerializer.to_representation:
+        return None
+
+    serializer = serializer_class(fields=list(fields), context={"model": model})
+    schema = get_schema(model)
+
+    keys = []
+    columns = []
+    converters = {}
+    nullable = []
+    for field in serializer._readable_fields:
+        if isinstance(field, UNSUPPORTED_FIELDS) or "." in field.source:
+            return None
+        model_field = schema.fields.get(field.source)
+        if model_field is None or field.source not in schema.projectable_fields:
+            return None
+
+        index = len(columns)
+        keys.append(field.field_name)
+        columns.append(model_field.attname)
+        nullable.append(model_field.null)
+        if isinstance(field, PrimaryKeyRelatedField):
+            # the foreign key column already holds the pk
+            if field.pk_field is not None:
+                converters[index] = field.pk_field.to_representation
+        elif model_field.get_internal_type() not in IDENTITY_FIELDS.get(
+            type(field), ()
+        ):
+            converters[index] = field.to_representation
+
+    items = []
+    for index, key in enumerate(keys):
+        value = f"row[{index}]"
+        if index in converters:
+            value = f"c{index}({value})"
+            if nullable[index]:
+                value = f"None if row[{index}] is None else {value}"
+        items.append(f"{key!r}: {value}")
+
+    namespace = {f"c{i}": j for i, j in converters.items()}
+    exec(f"def row_to_dict(row):\n    return {{{', '.join(items)}}}", namespace)
+    return CompiledReader(columns, namespace["row_to_dict"])
+
+
+# Cached per (serializer class, fields, expand). None when the serializer can't be compiled.
+# `fields` and `expand` come from clients, the cache is bounded like the filter plans'.
+def get_compiled_reader(serializer_class, model, fields=(), expand=()):
+    return _get_compiled_reader(serializer_class, model, tuple(fields), tuple(expand))
+
+
+@lru_cache(maxsize=1024)
+def _get_compiled_reader(serializer_class, model, fields: tuple, expand: tuple):
+    return compile_reader(serializer_class, model, fields, expand)
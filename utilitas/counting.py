@@ -0,0 +1,186 @@
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import DatabaseError, connections
+from django.db.models import Count, Window
+
+
+# A count strategy decides how the total number of rows of a paginated queryset is found.
+# `count` returns a (count, strategy_name) tuple, where the name is the strategy that actually
+# produced the number (strategies fall back to an exact count when they can't do better).
+class CountStrategy:
+    name = ""
+    # set on strategies that take the count from the page query (see `count_from_page`)
+    counts_in_page = False
+
+    def __init__(self, view=None):
+        self.view = view
+
+    def count(self, queryset):
+        raise NotImplementedError
+
+    # async variant of `count`, used by the async views
+    async def acount(self, queryset):
+        return await sync_to_async(self.count)(queryset)
+
+    # hook for strategies that compute the count inside the page query itself
+    def annotate(self, queryset):
+        return queryset
+
+    # called with the rows of the fetched page. Returning None means the count isn't known
+    # from the page and `count` will be called when the number is needed.
+    def count_from_page(self, rows):
+        return None
+
+
+class ExactCount(CountStrategy):
+    name = "exact"
+
+    def count(self, queryset):
+        return queryset.count(), ExactCount.name
+
+    async def acount(self, queryset):
+        return await queryset.acount(), ExactCount.name
+
+
+# exact counts, cached for `count_cache_ttl` seconds per filter set
+class CachedCount(ExactCount):
+    name = "cached"
+    cache_alias = "default"
+    key_prefix = "utilitas:count:"
+
+    def get_cache_key(self, queryset):
+        sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+        digest = hashlib.sha1(
+            json.dumps([queryset.model._meta.label, sql, params], default=str).encode()
+        ).hexdigest()
+        return self.key_prefix + digest
+
+    def count(self, queryset):
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(queryset)
+        count = cache.get(key)
+        if count is None:
+            count, _ = super().count(queryset)
+            cache.set(key, count, getattr(self.view, "count_cache_ttl", 60))
+        return count, self.name
+
+    async def acount(self, queryset):
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(queryset)
+        count = await cache.aget(key)
+        if count is None:
+            count, _ = await super().acount(queryset)
+            await cache.aset(key, count, getattr(self.view, "count_cache_ttl", 60))
+        return count, self.name
+
+
+# row estimates from the database planner's statistics. Falls back to an exact count
+# when the backend (or the shape of the query) doesn't provide an estimate.
+class EstimatedCount(ExactCount):
+    name = "estimated"
+
+    def count(self, queryset):
+        connection = connections[queryset.db]
+        estimator = getattr(self, f"estimate_{connection.vendor}", None)
+        estimate = None
+        if estimator is not None:
+            try:
+                estimate = estimator(queryset, connection)
+            except DatabaseError:
+                estimate = None
+        if estimate is None:
+            return super().count(queryset)
+        return estimate, self.name
+
+    # the estimators use cursors, so they run in a worker thread like CountStrategy.acount
+    async def acount(self, queryset):
+        return await sync_to_async(self.count)(queryset)
+
+    # sqlite only keeps table-level statistics (sqlite_stat1, filled by ANALYZE)
+    @staticmethod
+    def estimate_sqlite(queryset, connection):
+        if queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return int(row[0].split()[0])
+
+    @staticmethod
+    def estimate_postgresql(queryset, connection):
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                # reltuples is -1 for tables that were never analyzed
+                if row is None or row[0] < 0:
+                    return None
+                return int(row[0])
+
+            sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+# COUNT(*) OVER () is added to the page query, so the total comes back with the rows
+class WindowCount(ExactCount):
+    name = "window"
+    annotation = "utilitas_total_count"
+    counts_in_page = True
+
+    def annotate(self, queryset):
+        return queryset.annotate(**{self.annotation: Window(Count("pk"))})
+
+    def count_from_page(self, rows):
+        # an empty page doesn't carry the count, `count` falls back to an exact count
+        if not rows:
+            return None
+        # values_list() rows get the annotation appended as their last item
+        if isinstance(rows[0], tuple):
+            return rows[0][-1], self.name
+        return getattr(rows[0], self.annotation), self.name
+
+
+# no count at all, clients only get to know whether there is a next page
+class SkipCount(CountStrategy):
+    name = "skip"
+
+    def count(self, queryset):
+        return None, self.name
+
+    async def acount(self, queryset):
+        return None, self.name
+
+    def count_from_page(self, rows):
+        return None, self.name
+
+
+COUNT_STRATEGIES = {
+    i.name: i for i in [ExactCount, CachedCount, EstimatedCount, WindowCount, SkipCount]
+}
+
+
+def get_count_strategy(strategy, view=None) -> CountStrategy:
+    if isinstance(strategy, CountStrategy):
+        return strategy
+    if isinstance(strategy, str):
+        if strategy not in COUNT_STRATEGIES:
+            raise ValueError(
+                f"Unknown count strategy '{strategy}'. Choices are {list(COUNT_STRATEGIES)}"
+            )
+        strategy = COUNT_STRATEGIES[strategy]
+    return strategy(view)
@@ -0,0 +1,143 @@
+from django.core.exceptions import BadRequest
+from django.db.models import ManyToManyField, ManyToManyRel, ManyToOneRel, Prefetch
+
+from utilitas.schema import get_schema
+
+# deepest `expand` path that is resolved, e.g. 3 allows "category.parent.parent"
+MAX_EXPAND_DEPTH = 3
+
+
+# One relation of an `expand` parameter: the model it leads to, how it's reached from its
+# parent (`field`) and the relations expanded from it.
+class ExpandNode:
+    def __init__(self, model, field=None):
+        self.model = model
+        self.field = field
+        self.children = {}
+
+    # to-one relations are JOINed, to-many ones are prefetched. Generic foreign keys don't
+    # have a model to JOIN and are prefetched too.
+    @property
+    def is_to_one(self) -> bool:
+        return self.model is not None and (
+            self.field.many_to_one or self.field.one_to_one
+        )
+
+    def walk(self):
+        for child in self.children.values():
+            yield child
+            yield from child.walk()
+
+
+# The relation graph of `expand` for `model`: {"category.parent", "reviews"} becomes
+# category -> parent and reviews. Names that aren't relations of their model are client
+# mistakes and quietly ignored, with the path below them; paths deeper than `max_depth`
+# are refused.
+def build_expand_tree(model, expand, max_depth=MAX_EXPAND_DEPTH) -> ExpandNode:
+    root = ExpandNode(model)
+    for path in expand or []:
+        if not isinstance(path, str):
+            raise BadRequest(f"{path} is not a valid expand path.")
+        names = path.split(".")
+        if len(names) > max_depth:
+            raise BadRequest(f"'{path}' expands more than {max_depth} relations.")
+        node = root
+        for name in names:
+            if node.model is None:
+                break
+            schema = get_schema(node.model)
+            if name not in schema.prefetchable_fields:
+                break
+            if name not in node.children:
+                node.children[name] = ExpandNode(
+                    schema.related_models[name], schema.fields[name]
+                )
+            node = node.children[name]
+    return root
+
+
+# The `fields` of the objects under `path`, as flex fields passes them to the nested
+# serializer: "reviews.stars" is the "stars" field of the expanded reviews.
+def get_nested_fields(fields, path: str):
+    prefix = f"{path}."
+    return [i[len(prefix) :] for i in fields or [] if i.startswith(prefix)]
+
+
+# The columns to load for the objects of a prefetched relation, limited to their nested
+# `fields`. Besides those, it needs the pk, the foreign key matching the objects to the
+# rows they were prefetched for, and the foreign keys of the relations JOINed from them.
+# None means every column, when no fields were asked for or one of them isn't a column.
+def get_nested_projection(node: ExpandNode, fields):
+    if not fields or not isinstance(
+        node.field, (ManyToOneRel, ManyToManyRel, ManyToManyField)
+    ):
+        return None
+    schema = get_schema(node.model)
+    names = [i.split(".")[0] for i in fields]
+    if not schema.filterable_fields.issuperset(names):
+        return None
+
+    columns = {schema.pk_name}
+    if isinstance(node.field, ManyToOneRel):
+        columns.add(node.field.field.name)
+    for i in [*names, *node.children]:
+        if i in schema.projectable_fields:
+            columns.add(i)
+    return columns
+
+
+# (select_related lookups, prefetch_related lookups) loading the relations under `node`,
+# `prefix` being the path of `node` from the queryset's model
+def get_related_lookups(node: ExpandNode, fields=None, prefix=""):
+    select, prefetch = [], []
+    for name, child in node.children.items():
+        path = f"{prefix}{name}"
+        lookup = path.replace(".", "__")
+        if child.is_to_one:
+            select.append(lookup)
+            child_select, child_prefetch = get_related_lookups(
+                child, fields, f"{path}."
+            )
+            select.extend(child_select)
+            prefetch.extend(child_prefetch)
+        elif child.model is None:
+            prefetch.append(lookup)
+        else:
+            prefetch.append(
+                Prefetch(
+                    lookup,
+                    queryset=get_prefetch_queryset(
+                        child, get_nested_fields(fields, path)
+                    ),
+                )
+            )
+    return select, prefetch
+
+
+# the queryset of a to-many relation, with the relations expanded from it loaded as well
+def get_prefetch_queryset(node: ExpandNode, fields=None):
+    queryset = node.model._default_manager.all()
+    select, prefetch = get_related_lookups(node, fields)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    projection = get_nested_projection(node, fields)
+    if projection is not None:
+        queryset = queryset.only(*projection)
+    return queryset
+
+
+# Loads every relation of `expand` with `queryset`: the to-one hops from the queryset's
+# model (and from prefetched objects) in the same query through JOINs, and each to-many
+# hop in one more query. The number of queries depends on `expand`, never on the number
+# of rows.
+def resolve_expand(queryset, expand, fields=None, max_depth=MAX_EXPAND_DEPTH):
+    select, prefetch = get_related_lookups(
+        build_expand_tree(queryset.model, expand, max_depth), fields
+    )
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
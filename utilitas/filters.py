@@ -0,0 +1,316 @@
+from functools import lru_cache
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+from utilitas.schema import get_schema
+
+# operators that compare text, the value is passed to the database as is
+TEXT_OPERATORS = {"iexact", "icontains"}
+TEXT_FIELD_TYPES = {
+    "CharField",
+    "TextField",
+    "EmailField",
+    "SlugField",
+    "URLField",
+    "UUIDField",
+    "GenericIPAddressField",
+    "FilePathField",
+    "FileField",
+    "ImageField",
+}
+# operators that need an ordered type
+RANGE_OPERATORS = {"lt", "gt", "lte", "gte"}
+UNORDERED_FIELD_TYPES = {"BooleanField", "NullBooleanField", "JSONField"}
+
+MAX_VALUE_LENGTH = 256
+# limits of filter expressions: nesting of and/or/not groups, and number of clauses
+MAX_FILTER_DEPTH = 8
+MAX_FILTER_CLAUSES = 100
+FILTER_GROUPS = ("and", "or", "not")
+
+TRUE_VALUES = {True, 1, "1", "true", "True", "yes"}
+FALSE_VALUES = {False, 0, "0", "false", "False", "no"}
+
+
+def _as_bool(value):
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValidationError(f"'{value}' is not a boolean.")
+
+
+def _as_text(value):
+    return value if isinstance(value, str) else str(value)
+
+
+def _is_scalar(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+# Runs a converter, reporting the values it chokes on (a list given to a DateTimeField,
+# a string too long for an int) as validation errors.
+def _convert_value(convert, value):
+    try:
+        return convert(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError(f"'{value}' is not a valid value.")
+
+
+# A compiled filter plan: everything about a filter shape (which fields, which operators)
+# is checked once, what's left to do per request is coercing the values.
+class FilterPlan:
+    def __init__(self, shape, lookups, converters):
+        self.shape = shape
+        self.lookups = lookups
+        self.converters = converters
+
+    # the values coerced to the python types of their fields
+    def convert(self, values) -> list:
+        converted = []
+        errors = {}
+        for i, (convert, value) in enumerate(zip(self.converters, values)):
+            try:
+                converted.append(_convert_value(convert, value))
+            except ValidationError as e:
+                errors[i] = {"value": e.messages}
+        if errors:
+            raise BadRequest(errors)
+        return converted
+
+    def apply(self, values) -> dict:
+        return dict(zip(self.lookups, self.convert(values)))
+
+
+# Follows a `field_name` like "category__name" through the model's relations and returns
+# the field it ends on. Whatever comes after a non-relational field is treated as a
+# transform (e.g. "created_at__year"), which returns a None field.
+def resolve_field(model, field_name: str):
+    parts = field_name.split("__")
+    field = None
+    for i, part in enumerate(parts):
+        schema = get_schema(model)
+        if part == "pk":
+            part = schema.pk_name
+        if part not in schema.fields:
+            if (
+                field is not None
+                and not field.is_relation
+                and field.get_transform(part)
+            ):
+                return None
+            raise BadRequest(
+                f'Cannot resolve field name "{field_name}". Choices are {schema.field_names}'
+            )
+        field = schema.fields[part]
+        if field.is_relation and i < len(parts) - 1:
+            model = field.related_model
+    return field
+
+
+def get_converter(field, operator: str):
+    if field is None:
+        return lambda value: value
+
+    if field.is_relation:
+        # comparing a relation compares the pk of the related object
+        target = getattr(field, "target_field", None) or field.related_model._meta.pk
+        to_python = target.to_python
+        internal_type = target.get_internal_type()
+    else:
+        to_python = field.to_python
+        internal_type = field.get_internal_type()
+
+    if operator == "isnull":
+        return _as_bool
+    if operator in TEXT_OPERATORS:
+        if internal_type not in TEXT_FIELD_TYPES:
+            raise BadRequest(
+                f"'{operator}' can only be used on text fields, not on {field.name} ({internal_type})."
+            )
+        return _as_text
+    if operator in RANGE_OPERATORS and internal_type in UNORDERED_FIELD_TYPES:
+        raise BadRequest(
+            f"'{operator}' can't be used on {field.name} ({internal_type})."
+        )
+
+    if internal_type in ("BooleanField", "NullBooleanField"):
+        to_python = _as_bool
+
+    if operator == "in":
+
+        def convert(value):
+            if isinstance(value, str):
+                value = value.split(",")
+            if not isinstance(value, list):
+                raise ValidationError("'in' needs a list or a comma-separated string.")
+            return [to_python(i) for i in value]
+
+        return convert
+
+    return to_python
+
+
+@lru_cache(maxsize=1024)
+def get_filter_plan(model, shape: tuple) -> FilterPlan:
+    lookups = []
+    converters = []
+    for field_name, operator in shape:
+        if operator not in model.valid_operators:
+            raise BadRequest(
+                f"{operator} is not in valid operators of {model.__name__}. "
+                f"Valid operators: {model.valid_operators}"
+            )
+        field = resolve_field(model, field_name)
+        lookups.append(field_name + "__" + operator)
+        converters.append(get_converter(field, operator))
+    return FilterPlan(shape, lookups, converters)
+
+
+# Validates a list of {"field_name", "operator", "value"} clauses against the model's fields
+# and turns them into a dict of ORM lookups with values of the fields' python types.
+# Plans are cached by filter shape, so repeated searches only pay for the value coercion.
+def compile_filters(model, clauses) -> dict:
+    plan, values = _get_clauses_plan(model, clauses)
+    if plan is None:
+        return {}
+    return plan.apply(values)
+
+
+# Same validation as compile_filters, the clauses are returned as (field_name, operator,
+# value) tuples, with their default operator and their coerced value.
+def validate_filters(model, clauses) -> list:
+    plan, values = _get_clauses_plan(model, clauses)
+    if plan is None:
+        return []
+    return [(*i, j) for i, j in zip(plan.shape, plan.convert(values))]
+
+
+def _get_clauses_plan(model, clauses):
+    if not clauses:
+        return None, []
+    if not isinstance(clauses, list):
+        raise BadRequest("Filter params must be a list.")
+
+    if len(clauses) > MAX_FILTER_CLAUSES:
+        raise BadRequest(f"Filters are limited to {MAX_FILTER_CLAUSES} clauses.")
+
+    shape = []
+    values = []
+    for i, clause in enumerate(clauses):
+        field_name, operator, value = _parse_clause(i, clause)
+        shape.append((field_name, operator))
+        values.append(value)
+
+    return get_filter_plan(model, tuple(shape)), values
+
+
+def _parse_clause(key, clause):
+    if not isinstance(clause, dict):
+        raise BadRequest({key: "Each filter param must be an object."})
+    field_name = clause.get("field_name")
+    operator = clause.get("operator", "exact")
+    if not isinstance(field_name, str) or not field_name:
+        raise BadRequest({key: {"field_name": "This field is required."}})
+    if not isinstance(operator, str):
+        raise BadRequest({key: {"operator": "Must be a string."}})
+    if "value" not in clause:
+        raise BadRequest({key: {"value": "This field is required."}})
+    value = clause["value"]
+    # values are strings, numbers or booleans, and lists of them for 'in'
+    items = value if operator == "in" and isinstance(value, list) else [value]
+    if not all(_is_scalar(i) for i in items):
+        raise BadRequest(
+            {key: {"value": "Must be a string, a number, a boolean or null."}}
+        )
+    if isinstance(value, str) and len(value) > MAX_VALUE_LENGTH:
+        raise BadRequest(
+            {
+                key: {
+                    "value": f"Ensure this field has no more than {MAX_VALUE_LENGTH} characters."
+                }
+            }
+        )
+    return field_name, operator, value
+
+
+# Compiles a filter expression into a single Q. An expression is either a clause
+# ({"field_name", "operator", "value"}) or a group of expressions:
+#   {"and": [...]}, {"or": [...]} or {"not": {...}}
+# Errors are reported with the path of the faulty expression, e.g. "filter_params.or.1".
+def compile_filter_expression(model, expression, name="filter_params") -> Q:
+    clauses = 0
+
+    def compile_node(node, path, depth):
+        nonlocal clauses
+        if depth > MAX_FILTER_DEPTH:
+            raise BadRequest(
+                f"Filter expressions are limited to {MAX_FILTER_DEPTH} levels of nesting."
+            )
+        if not isinstance(node, dict):
+            raise BadRequest({path: "Each filter expression must be an object."})
+
+        groups = [i for i in FILTER_GROUPS if i in node]
+        if not groups:
+            clauses += 1
+            if clauses > MAX_FILTER_CLAUSES:
+                raise BadRequest(f"Filters are limited to {MAX_FILTER_CLAUSES} clauses.")
+            field_name, operator, value = _parse_clause(path, node)
+            plan = get_filter_plan(model, ((field_name, operator),))
+            try:
+                value = _convert_value(plan.converters[0], value)
+            except ValidationError as e:
+                raise BadRequest({path: {"value": e.messages}})
+            return Q(**{plan.lookups[0]: value})
+
+        if len(node) != 1:
+            raise BadRequest(
+                {path: f"A filter group must have exactly one of {list(FILTER_GROUPS)}."}
+            )
+        group = groups[0]
+        if group == "not":
+            return ~compile_node(node["not"], f"{path}.not", depth + 1)
+
+        children = node[group]
+        if not isinstance(children, list) or not children:
+            raise BadRequest({path: f"'{group}' must be a non-empty list."})
+        q = None
+        for i, child in enumerate(children):
+            child = compile_node(child, f"{path}.{group}.{i}", depth + 1)
+            if q is None:
+                q = child
+            elif group == "and":
+                q &= child
+            else:
+                q |= child
+        return q
+
+    return compile_node(expression, name, 1)
+
+
+# `filter_params` and `exclude_params` of a request's body: a list of clauses that are
+# ANDed (a dict of lookups), or a filter expression (a Q)
+def compile_filter_params(model, params, name="filter_params"):
+    if isinstance(params, dict) and params:
+        return compile_filter_expression(model, params, name)
+    return compile_filters(model, params)
+
+
+def as_q(params) -> Q:
+    if isinstance(params, Q):
+        return params
+    return Q(**(params or {}))
+
+
+# the lookups of compiled filter params, e.g. ["title__icontains", "pages__gt"]
+def get_lookups(params):
+    if not isinstance(params, Q):
+        return list(params or {})
+    lookups = []
+    for i in params.children:
+        if isinstance(i, Q):
+            lookups.extend(get_lookups(i))
+        else:
+            lookups.append(i[0])
+    return lookups
@@ -0,0 +1,85 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+
+# Parsers of streamed import bodies. They read the body line by line and yield
+# (line, data, error) tuples, where `line` is the line number of the row in the body and
+# either `data` (a dict) or `error` is None.
+def parse_ndjson(lines):
+    for line, raw in enumerate(lines, 1):
+        if not raw.strip():
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError as e:
+            yield line, None, {"non_field_errors": [f"Invalid JSON: {e}"]}
+            continue
+        if not isinstance(data, dict):
+            yield line, None, {"non_field_errors": ["Each line must be a JSON object."]}
+            continue
+        yield line, data, None
+
+
+# The first row holds the field names. Empty cells are left out of the row, so the
+# model's defaults apply to them.
+def parse_csv(lines):
+    reader = csv.reader(codecs.iterdecode(lines, "utf-8-sig"))
+    try:
+        header = next(reader, None)
+        if header is None:
+            return
+        for row in reader:
+            if not row:
+                continue
+            if len(row) > len(header):
+                yield reader.line_num, None, {
+                    "non_field_errors": [
+                        f"Expected at most {len(header)} columns, got {len(row)}."
+                    ]
+                }
+                continue
+            yield reader.line_num, {i: j for i, j in zip(header, row) if j != ""}, None
+    except (csv.Error, UnicodeDecodeError) as e:
+        # the rest of the body can't be read
+        yield reader.line_num + 1, None, {"non_field_errors": [f"Invalid CSV: {e}"]}
+
+
+IMPORT_PARSERS = {
+    "application/x-ndjson": parse_ndjson,
+    "application/jsonl": parse_ndjson,
+    "text/csv": parse_csv,
+}
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# accepted and rejected rows of an import. Only the first `max_errors` errors are kept.
+class ImportReport:
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = []
+        self.rolled_back = False
+
+    def reject(self, line: int, errors):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    def as_dict(self) -> dict:
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "rolled_back": self.rolled_back,
+            "errors": sorted(self.errors, key=lambda i: i["line"]),
+        }
@@ -0,0 +1,525 @@
+import ast
+import datetime
+import decimal
+import json
+import os
+import re
+import sys
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, models, transaction
+
+from utilitas.filters import UNORDERED_FIELD_TYPES
+from utilitas.schema import get_schema
+
+# lookups an index can seek on (the columns go first in a composite index), and lookups
+# it can range-scan (after the sort columns)
+EQUALITY_OPERATORS = {"exact", "iexact", "in", "isnull"}
+RANGE_OPERATORS = {"lt", "gt", "lte", "gte", "range"}
+# field types a btree index can't serve
+UNINDEXABLE_FIELD_TYPES = {*UNORDERED_FIELD_TYPES - {"BooleanField"}, "BinaryField"}
+# field types left out of suggested indexes: btrees on unbounded text are big and slow to
+# write, and booleans split a table in two halves an index rarely narrows down
+UNSUGGESTED_FIELD_TYPES = {"TextField", "BooleanField", "NullBooleanField"}
+# shapes indexes are suggested for: the ones seen in request logs and the default
+# ordering. Shapes made up from every exposed field are only reported, an index per
+# filterable column would mostly slow down writes.
+SUGGESTED_SOURCES = {"logs", "ordering"}
+MAX_INDEX_COLUMNS = 4
+# the page size of the EXPLAINed queries
+PAGE_SIZE = 50
+
+SAMPLE_VALUES = {
+    "BooleanField": True,
+    "CharField": "",
+    "TextField": "",
+    "EmailField": "",
+    "SlugField": "",
+    "URLField": "",
+    "FilePathField": "",
+    "GenericIPAddressField": "127.0.0.1",
+    "UUIDField": uuid.UUID(int=0),
+    "DecimalField": decimal.Decimal(0),
+    "FloatField": 0.0,
+    "DurationField": datetime.timedelta(0),
+    "DateField": datetime.date(2000, 1, 1),
+    "TimeField": datetime.time(0),
+}
+
+# plan lines telling that a query reads the whole table, or sorts rows the index didn't
+# give in order
+SEQUENTIAL_SCAN_RE = {
+    "sqlite": re.compile(r"\bSCAN (?!.*\bUSING\b)", re.MULTILINE),
+    "postgresql": re.compile(r"\bSeq Scan on\b"),
+    "mysql": re.compile(r"'type': 'ALL'|\bALL\b"),
+}
+FILESORT_RE = {
+    "sqlite": re.compile(r"USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY"),
+    "postgresql": re.compile(r"(?:^|->)\s*Sort\s+\(", re.MULTILINE),
+    "mysql": re.compile(r"Using filesort"),
+}
+
+
+# A filter/sort combination the views run against a model: the lookups of
+# `filter_params` (e.g. "category__exact") and the `sorts` (e.g. "-created_at").
+# `count` is the number of times it was seen in the request logs, `source` where the
+# shape comes from ("logs", "ordering" or "fields").
+class QueryShape:
+    def __init__(self, model, filters=(), sorts=(), count=0, source="fields"):
+        self.model = model
+        self.filters = tuple(filters)
+        self.sorts = tuple(sorts)
+        self.count = count
+        self.source = source
+
+    def __str__(self):
+        filters = ", ".join(self.filters) or "-"
+        sorts = ", ".join(self.sorts) or "default ordering"
+        return f"filter {filters}, sort {sorts}"
+
+    # the local columns of the shape, as the (equality, sort, range) columns of an index
+    def get_columns(self):
+        schema = get_schema(self.model)
+        equality, sort, range_ = [], [], []
+        for lookup in self.filters:
+            *path, operator = lookup.split("__")
+            column = _get_column(schema, path)
+            if column is None:
+                continue
+            if operator in EQUALITY_OPERATORS:
+                equality.append(column)
+            elif operator in RANGE_OPERATORS:
+                range_.append(column)
+        for i in self.sorts or get_default_ordering(self.model):
+            column = _get_column(schema, i.lstrip("-").split("__"))
+            if column is None:
+                # an ordering an index can't serve stops the index there
+                break
+            sort.append(column)
+        return equality, sort, range_
+
+
+# A suggested index, with the shapes it would serve
+class IndexSuggestion:
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self.shapes = []
+
+    @property
+    def count(self):
+        return sum(i.count for i in self.shapes)
+
+    def get_index(self):
+        index = models.Index(fields=list(self.fields))
+        index.set_name_with_model(self.model)
+        return index
+
+
+# The EXPLAIN of a shape, with what's wrong with it
+class ShapeReport:
+    def __init__(self, shape, plan, sequential_scan, filesort):
+        self.shape = shape
+        self.plan = plan
+        self.sequential_scan = sequential_scan
+        self.filesort = filesort
+
+    @property
+    def problems(self):
+        return [
+            i
+            for i, j in [
+                ("sequential scan", self.sequential_scan),
+                ("filesort", self.filesort),
+            ]
+            if j
+        ]
+
+
+def _get_column(schema, path):
+    if not path:
+        return None
+    name = schema.pk_name if path[0] == "pk" else path[0]
+    field = schema.fields.get(name)
+    if field is None or not field.concrete or field.many_to_many:
+        return None
+    if len(path) > 1 and not (
+        field.many_to_one and path[1] in ("pk", field.target_field.name)
+    ):
+        # lookups across a relation are served by the related table's indexes
+        return None
+    if schema.field_types.get(name) in UNINDEXABLE_FIELD_TYPES:
+        return None
+    return field.name
+
+
+def get_default_ordering(model):
+    return [i for i in model._meta.ordering if isinstance(i, str) and i != "?"]
+
+
+# The field lists of the indexes the model declares: its pk, unique and db_index fields,
+# Meta.indexes, unique_together and unconditional unique constraints
+def get_declared_indexes(model):
+    opts = model._meta
+    indexes = []
+    for field in opts.concrete_fields:
+        if field.primary_key or field.unique or field.db_index:
+            indexes.append((field.name,))
+    for index in opts.indexes:
+        if index.fields and not index.condition:
+            indexes.append(tuple(i.lstrip("-") for i in index.fields))
+    for fields in opts.unique_together:
+        indexes.append(tuple(fields))
+    for constraint in opts.constraints:
+        fields = getattr(constraint, "fields", None)
+        if (
+            isinstance(constraint, models.UniqueConstraint)
+            and fields
+            and constraint.condition is None
+        ):
+            indexes.append(tuple(fields))
+    return indexes
+
+
+# The column lists of the indexes that exist in the database
+def get_database_indexes(model, using="default"):
+    connection = connections[using]
+    opts = model._meta
+    columns = {i.column: i.name for i in opts.concrete_fields}
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, opts.db_table)
+    indexes = []
+    for i in constraints.values():
+        if not (i["index"] or i["unique"] or i["primary_key"]) or not i["columns"]:
+            continue
+        if any(j not in columns for j in i["columns"]):
+            continue
+        indexes.append(tuple(columns[j] for j in i["columns"]))
+    return indexes
+
+
+def is_indexed(fields, indexes) -> bool:
+    fields = tuple(fields)
+    return any(i[: len(fields)] == fields for i in indexes)
+
+
+# The fields the views expose: every column can be filtered on, sortable ones can be
+# sorted on, and the default ordering sorts every unsorted page
+def get_access_paths(model):
+    schema = get_schema(model)
+    filterable = [i for i in schema.field_names if _get_column(schema, [i])]
+    sortable = [
+        i
+        for i in filterable
+        if i in schema.sortable_fields
+        and schema.field_types.get(i) not in UNORDERED_FIELD_TYPES
+    ]
+    return {
+        "filter_params": filterable,
+        "sorts": sortable,
+        "ordering": get_default_ordering(model),
+    }
+
+
+# One shape per exposed field: filtering on it with the default ordering, and sorting on it
+def get_field_shapes(model):
+    paths = get_access_paths(model)
+    pk_name = model._meta.pk.name
+    shapes = [QueryShape(model, source="ordering")]
+    for i in paths["filter_params"]:
+        if i != pk_name:
+            shapes.append(QueryShape(model, [f"{i}__exact"]))
+    for i in paths["sorts"]:
+        if i != pk_name:
+            shapes.append(QueryShape(model, sorts=[i]))
+    return shapes
+
+
+# Counts the shapes logged by views with `log_query_shapes` (one JSON object per line,
+# possibly after a log prefix). Shapes of other models, or seen less than `min_count`
+# times, are left out.
+def read_logged_shapes(lines, models_by_label, min_count=1):
+    counter = Counter()
+    for line in lines:
+        start = line.find("{")
+        if start == -1:
+            continue
+        try:
+            record = json.loads(line[start:])
+            key = (
+                record["model"],
+                tuple(sorted(record.get("filters") or [])),
+                tuple(record.get("sorts") or []),
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            continue
+        if key[0] in models_by_label:
+            counter[key] += 1
+    return [
+        QueryShape(models_by_label[label], filters, sorts, count, "logs")
+        for (label, filters, sorts), count in counter.most_common()
+        if count >= min_count
+    ]
+
+
+def _sample_value(field):
+    if field.is_relation:
+        field = field.target_field
+    internal_type = field.get_internal_type()
+    if internal_type == "DateTimeField":
+        return datetime.datetime(
+            2000, 1, 1, tzinfo=datetime.timezone.utc if settings.USE_TZ else None
+        )
+    if internal_type in SAMPLE_VALUES:
+        return SAMPLE_VALUES[internal_type]
+    if "Integer" in internal_type or "AutoField" in internal_type:
+        return 0
+    return None
+
+
+# the page query of a shape, as prepare_queryset() builds it
+def get_shape_queryset(shape: QueryShape, using="default"):
+    filters = {}
+    for lookup in shape.filters:
+        *path, operator = lookup.split("__")
+        field = shape.model._meta.get_field(path[0])
+        value = True if operator == "isnull" else _sample_value(field)
+        if value is None:
+            continue
+        filters[lookup] = [value] if operator == "in" else value
+    queryset = shape.model.objects.using(using).filter(**filters)
+    if shape.sorts:
+        queryset = queryset.order_by(*shape.sorts)
+    return queryset[:PAGE_SIZE]
+
+
+# EXPLAINs the page query of a shape. On PostgreSQL, sequential scans and sorts are
+# disabled for the query, so that the planner picks any usable index even on small tables.
+def explain_shape(shape: QueryShape, using="default") -> ShapeReport:
+    connection = connections[using]
+    queryset = get_shape_queryset(shape, using)
+    with transaction.atomic(using=using):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("SET LOCAL enable_sort = off")
+        plan = queryset.explain()
+    sequential_scan = SEQUENTIAL_SCAN_RE.get(connection.vendor)
+    filesort = FILESORT_RE.get(connection.vendor)
+    return ShapeReport(
+        shape,
+        plan,
+        # without filters, reading the table in the order of the sort stops at the page
+        bool(shape.filters and sequential_scan and sequential_scan.search(plan)),
+        bool(filesort and filesort.search(plan)),
+    )
+
+
+# The index serving a shape: equality columns, then sort columns, then one range column.
+# Text and boolean columns are left out.
+def suggest_index_fields(shape: QueryShape, pk_name: str):
+    field_types = get_schema(shape.model).field_types
+    equality, sort, range_ = shape.get_columns()
+    fields = []
+    for i in [*equality, *sort, *range_[:1]]:
+        if i not in fields and field_types.get(i) not in UNSUGGESTED_FIELD_TYPES:
+            fields.append(i)
+    # the pk is unique, nothing after it narrows anything down
+    if pk_name in fields:
+        fields = fields[: fields.index(pk_name) + 1]
+    if fields == [pk_name]:
+        return []
+    return fields[:MAX_INDEX_COLUMNS]
+
+
+# EXPLAINs the shapes and suggests an index for each logged shape or default ordering
+# that scans or sorts the table and isn't served by an index of the database. Returns
+# (reports, suggestions), the suggestions most used first.
+def advise(shapes, using="default"):
+    reports = []
+    suggestions = {}
+    indexes = {}
+    for shape in shapes:
+        report = explain_shape(shape, using)
+        reports.append(report)
+        if not report.problems or shape.source not in SUGGESTED_SOURCES:
+            continue
+        model = shape.model
+        if model not in indexes:
+            indexes[model] = get_database_indexes(model, using)
+        fields = suggest_index_fields(shape, model._meta.pk.name)
+        if not fields or is_indexed(fields, indexes[model]):
+            continue
+        suggestion = suggestions.setdefault(
+            (model, tuple(fields)), IndexSuggestion(model, fields)
+        )
+        suggestion.shapes.append(shape)
+
+    # an index whose columns start with another suggestion's serves it as well
+    merged = []
+    for suggestion in sorted(
+        suggestions.values(), key=lambda i: len(i.fields), reverse=True
+    ):
+        wider = next(
+            (
+                i
+                for i in merged
+                if i.model is suggestion.model
+                and i.fields[: len(suggestion.fields)] == suggestion.fields
+            ),
+            None,
+        )
+        if wider is None:
+            merged.append(suggestion)
+        else:
+            wider.shapes.extend(suggestion.shapes)
+    merged.sort(key=lambda i: i.count, reverse=True)
+    return reports, merged
+
+
+def _format_index(index):
+    fields = ", ".join(f'"{i}"' for i in index.fields)
+    return f'models.Index(fields=[{fields}], name="{index.name}")'
+
+
+# Adds `indexes` to the Meta.indexes of the model class `class_name` in `source`, the
+# source of its module. Returns the new source, or None when it can't be done safely: the
+# class, its Meta or a `from django.db import models` is missing, or Meta.indexes isn't
+# a list literal. Indexes whose name is already in the list are left out.
+def add_meta_indexes(source: str, class_name: str, indexes):
+    tree = ast.parse(source)
+    if not any(
+        isinstance(i, ast.ImportFrom)
+        and i.module == "django.db"
+        and any(j.name == "models" and j.asname is None for j in i.names)
+        for i in tree.body
+    ):
+        return None
+    model = next(
+        (i for i in tree.body if isinstance(i, ast.ClassDef) and i.name == class_name),
+        None,
+    )
+    meta = model and next(
+        (i for i in model.body if isinstance(i, ast.ClassDef) and i.name == "Meta"),
+        None,
+    )
+    # the positions of the nodes' ends are needed, python < 3.8 doesn't have them
+    if meta is None or not hasattr(meta, "end_lineno"):
+        return None
+
+    lines = source.splitlines(keepends=True)
+    assignment = next(
+        (
+            i
+            for i in meta.body
+            if isinstance(i, ast.Assign)
+            and [getattr(j, "id", None) for j in i.targets] == ["indexes"]
+        ),
+        None,
+    )
+    if assignment is None:
+        entries = [_format_index(i) for i in indexes]
+        last = meta.body[-1]
+        indent = " " * last.col_offset
+        added = [f"{indent}indexes = [\n"]
+        added += [f"{indent}    {i},\n" for i in entries]
+        added.append(f"{indent}]\n")
+        return "".join(lines[: last.end_lineno] + added + lines[last.end_lineno :])
+
+    value = assignment.value
+    if not isinstance(value, ast.List):
+        return None
+    declared = "".join(lines[value.lineno - 1 : value.end_lineno])
+    entries = [_format_index(i) for i in indexes if f'"{i.name}"' not in declared]
+    if not entries:
+        return source
+    indent = " " * assignment.col_offset
+    if value.lineno == value.end_lineno:
+        # a list on one line is rewritten one index per line
+        entries = [ast.get_source_segment(source, i) for i in value.elts] + entries
+        items = "".join(f"{indent}    {i},\n" for i in entries)
+        lines[value.lineno - 1] = lines[value.lineno - 1].replace(
+            ast.get_source_segment(source, value), f"[\n{items}{indent}]", 1
+        )
+        return "".join(lines)
+
+    # a multi-line list gets the indexes before its closing bracket. The offsets of the
+    # nodes count bytes.
+    if value.elts:
+        last = value.elts[-1]
+        line = lines[last.end_lineno - 1].encode()
+        end = last.end_col_offset
+        if not line[end:].lstrip().startswith(b","):
+            lines[last.end_lineno - 1] = (line[:end] + b"," + line[end:]).decode()
+        item_line = lines[last.lineno - 1]
+        item_indent = item_line[: len(item_line) - len(item_line.lstrip())]
+    else:
+        item_indent = indent + "    "
+    closing = value.end_lineno - 1
+    lines[closing:closing] = [f"{item_indent}{i},\n" for i in entries]
+    return "".join(lines)
+
+
+# Writes one migration per app adding the suggested indexes, and adds them to the models'
+# Meta.indexes, or makemigrations would remove them again. Models whose source can't be
+# updated (see add_meta_indexes) get neither. Returns the written paths, the apps that were
+# skipped because they don't have migrations, and the skipped models.
+def write_migrations(suggestions, name="utilitas_indexes"):
+    from django.db import migrations
+    from django.db.migrations.autodetector import MigrationAutodetector
+    from django.db.migrations.loader import MigrationLoader
+    from django.db.migrations.writer import MigrationWriter
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    by_app = {}
+    for i in suggestions:
+        by_app.setdefault(i.model._meta.app_label, {}).setdefault(i.model, []).append(
+            i.get_index()
+        )
+
+    paths, skipped_apps, skipped_models = [], [], []
+    sources, originals = {}, {}
+    for app_label, by_model in by_app.items():
+        leaves = loader.graph.leaf_nodes(app_label)
+        if not leaves:
+            skipped_apps.append(app_label)
+            continue
+
+        operations = []
+        for model, indexes in by_model.items():
+            path = getattr(sys.modules.get(model.__module__), "__file__", None)
+            source = None
+            if path:
+                if path not in sources:
+                    with open(path, encoding="utf-8") as f:
+                        sources[path] = originals[path] = f.read()
+                source = add_meta_indexes(sources[path], model.__name__, indexes)
+            if source is None:
+                skipped_models.append(model)
+                continue
+            sources[path] = source
+            operations += [
+                migrations.AddIndex(model._meta.model_name, i) for i in indexes
+            ]
+        if not operations:
+            continue
+
+        number = (MigrationAutodetector.parse_number(leaves[-1][1]) or 0) + 1
+        migration = migrations.Migration(f"{number:04d}_{name}", app_label)
+        migration.dependencies = leaves
+        migration.operations = operations
+        writer = MigrationWriter(migration)
+        os.makedirs(os.path.dirname(writer.path), exist_ok=True)
+        with open(writer.path, "w", encoding="utf-8") as f:
+            f.write(writer.as_string())
+        paths.append(writer.path)
+
+    for path, source in sources.items():
+        if source == originals[path]:
+            continue
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(source)
+        paths.append(path)
+    return paths, skipped_apps, skipped_models
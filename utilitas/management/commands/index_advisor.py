@@ -0,0 +1,157 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from utilitas.checks import get_base_models
+from utilitas.indexes import (
+    advise,
+    get_access_paths,
+    get_database_indexes,
+    get_field_shapes,
+    read_logged_shapes,
+    write_migrations,
+)
+
+
+# Checks that the database has indexes for the ways the utilitas views query the models:
+# filters and sorts on every exposed field (or the shapes seen in the request logs of views
+# with `log_query_shapes`) are EXPLAINed, and the ones scanning or sorting whole tables
+# get an index suggestion.
+class Command(BaseCommand):
+    help = "Reports filters and sorts of utilitas views that the database's indexes don't serve, and suggests indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "labels",
+            nargs="*",
+            metavar="app_label[.ModelName]",
+            help="Models to check, every utilitas model by default.",
+        )
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--log",
+            action="append",
+            default=[],
+            help='Log file of the "utilitas.shapes" logger. The shapes it holds are '
+            "checked instead of one shape per field. Can be repeated.",
+        )
+        parser.add_argument(
+            "--min-count",
+            type=int,
+            default=1,
+            help="Ignore logged shapes seen fewer times than this.",
+        )
+        parser.add_argument(
+            "--emit-migration",
+            action="store_true",
+            help="Write a migration adding the suggested indexes to each app, and add "
+            "them to the models' Meta.indexes.",
+        )
+
+    def get_models(self, labels):
+        if not labels:
+            return [i for i in get_base_models() if i._meta.managed]
+        models = []
+        for label in labels:
+            try:
+                if "." in label:
+                    models.append(apps.get_model(label))
+                else:
+                    models.extend(get_base_models([apps.get_app_config(label)]))
+            except LookupError as e:
+                raise CommandError(str(e))
+        return models
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        models = self.get_models(options["labels"])
+
+        if options["log"]:
+            shapes = []
+            models_by_label = {i._meta.label: i for i in models}
+            for path in options["log"]:
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        shapes.extend(
+                            read_logged_shapes(f, models_by_label, options["min_count"])
+                        )
+                except OSError as e:
+                    raise CommandError(str(e))
+        else:
+            shapes = [j for i in models for j in get_field_shapes(i)]
+
+        reports, suggestions = advise(shapes, using)
+
+        for model in models:
+            paths = get_access_paths(model)
+            self.stdout.write(self.style.MIGRATE_HEADING(model._meta.label))
+            self.stdout.write(f"  filter_params: {', '.join(paths['filter_params'])}")
+            self.stdout.write(f"  sorts: {', '.join(paths['sorts'])}")
+            self.stdout.write(f"  ordering: {', '.join(paths['ordering']) or '-'}")
+            indexes = get_database_indexes(model, using)
+            self.stdout.write(
+                f"  indexes: {', '.join('(' + ', '.join(i) + ')' for i in indexes) or '-'}"
+            )
+            for report in reports:
+                if report.shape.model is not model:
+                    continue
+                if report.problems:
+                    count = (
+                        f", seen in {report.shape.count} requests"
+                        if report.shape.source == "logs"
+                        else ""
+                    )
+                    self.stdout.write(
+                        self.style.WARNING(
+                            f"  {' and '.join(report.problems)}: {report.shape}{count}"
+                        )
+                    )
+                if options["verbosity"] > 1:
+                    self.stdout.write(
+                        "    " + report.plan.replace("\n", "\n    "),
+                        self.style.SQL_KEYWORD,
+                    )
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS("No indexes to suggest."))
+            if not options["log"]:
+                self.stdout.write(
+                    "Only the default orderings were checked for suggestions, "
+                    "pass request logs with --log to get indexes for the filters and sorts clients use."
+                )
+            return
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Suggested indexes"))
+        for suggestion in suggestions:
+            index = suggestion.get_index()
+            self.stdout.write(
+                f"  {suggestion.model._meta.label}: "
+                f'models.Index(fields={list(index.fields)}, name="{index.name}")'
+            )
+            for shape in suggestion.shapes:
+                count = (
+                    f", seen in {shape.count} requests"
+                    if shape.source == "logs"
+                    else ""
+                )
+                self.stdout.write(f"    serves {shape}{count}")
+
+        if options["emit_migration"]:
+            paths, skipped_apps, skipped_models = write_migrations(suggestions)
+            for path in paths:
+                self.stdout.write(self.style.SUCCESS(f"Wrote {path}"))
+            for app_label in skipped_apps:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"{app_label} doesn't have migrations, no migration was written for it."
+                    )
+                )
+            for model in skipped_models:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"The Meta.indexes of {model._meta.label} couldn't be updated, "
+                        "no migration was written for it. It needs a Meta class, without "
+                        "indexes or with a list of them, in a module doing "
+                        "`from django.db import models`."
+                    )
+                )
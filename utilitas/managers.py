@@ -1,5 +1,42 @@
-from django.db import models
+from django.db import models, transaction
 
+from utilitas.cache import bump_model_version
 
-class CustomManager(models.Manager):
-    pass
\ No newline at end of file
+
+class BaseQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # setting a chosen_one field to True is only allowed on a single row, and clears it
+        # on every other row in the same transaction
+        chosen = [
+            i
+            for i in getattr(self.model, "chosen_one_fields", [])
+            if kwargs.get(i) is True
+        ]
+        if not chosen:
+            count = super().update(**kwargs)
+        else:
+            with transaction.atomic(using=self.db):
+                pks = list(self.values_list("pk", flat=True)[:2])
+                if len(pks) > 1:
+                    raise ValueError(
+                        f"Only one row of {self.model.__name__} can have {chosen} set to True."
+                    )
+                # nothing takes the fields over, the row holding them keeps them
+                if not pks:
+                    return 0
+                for i in chosen:
+                    self.model._base_manager.using(self.db).filter(**{i: True}).exclude(
+                        pk__in=pks
+                    ).update(**{i: False})
+                count = super().update(**kwargs)
+        bump_model_version(self.model, self.db)
+        return count
+
+    def delete(self):
+        ret = super().delete()
+        bump_model_version(self.model, self.db)
+        return ret
+
+
+class CustomManager(models.Manager.from_queryset(BaseQuerySet)):
+    pass
@@ -1,5 +1,7 @@
 from rest_framework.metadata import BaseMetadata
 
+from utilitas.schema import get_schema
+
 
 class CustomMetadata(BaseMetadata):
     def determine_metadata(self, request, view):
@@ -9,19 +11,8 @@ class CustomMetadata(BaseMetadata):
                 "message": "no metadata in this endpoint.",
             }
 
-        fields = []
-        for i in view.model._meta.get_fields():
-            if hasattr(i, "help_text"):
-                fields.append(
-                    {
-                        "name": i.name,
-                        "type": i.get_internal_type(),
-                        "description": getattr(i, "help_text"),
-                    }
-                )
-
         return {
             "name": view.get_view_name(),
             "description": view.model.__doc__,
-            "fields": fields,
+            "fields": get_schema(view.model).metadata_fields,
         }
\ No newline at end of file
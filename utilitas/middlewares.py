@@ -1,7 +1,14 @@
+import heapq
+import json
 import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
 
 from django.conf import settings
-from django.db import connection
+from django.db import connection, connections
 
 
 class QueryLoggerMiddleware:
@@ -16,3 +23,145 @@ class QueryLoggerMiddleware:
             for i, j in enumerate(connection.queries):
                 self.logger.info(f"{i}:{float(j['time'])*1000}ms| {j['sql']}")
         return response
+
+
+# Collects the queries of one request through connection.execute_wrapper
+class QueryRecorder:
+    # strings and numbers are replaced so that queries differing only by their
+    # parameters end up with the same shape
+    literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    placeholder_lists = re.compile(r"%s(?:\s*,\s*%s)+")
+
+    def __init__(self, slow_queries=5):
+        self.slow_queries = slow_queries
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[self.get_shape(sql)] += 1
+        if len(self.slowest) < self.slow_queries:
+            heapq.heappush(self.slowest, (duration, self.count, sql))
+        elif duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, self.count, sql))
+
+    def get_shape(self, sql):
+        return self.placeholder_lists.sub("%s, ...", self.literals.sub("%s", sql))
+
+    # shapes that ran at least `threshold` times, most likely N+1 queries
+    def get_repeated_shapes(self, threshold):
+        return [
+            {"sql": i, "count": j}
+            for i, j in self.shapes.most_common()
+            if j >= threshold
+        ]
+
+    def get_slowest(self):
+        return [
+            {"sql": sql, "ms": round(duration * 1000, 3)}
+            for duration, _, sql in sorted(self.slowest, reverse=True)
+        ]
+
+
+# Always-on query instrumentation. For a sample of the requests it records the number of
+# queries, the total database time, the slowest statements and the query shapes repeated
+# often enough to be N+1 queries. Results are sent in a Server-Timing header and logged as
+# structured records when a threshold is crossed. Configured with, e.g.
+#
+#     UTILITAS_QUERY_INSTRUMENTATION = {
+#         "SAMPLE_RATE": 0.1,
+#         "LOG_THRESHOLD_MS": 200,
+#         "ENDPOINTS": {"/api/reports/": {"LOG_THRESHOLD_MS": 2000}},
+#     }
+#
+# Queries run while a streaming response is consumed (csv exports) are not recorded.
+class QueryInstrumentationMiddleware:
+    defaults = {
+        # share of the requests that are instrumented
+        "SAMPLE_RATE": 1.0,
+        # number of slowest statements that are reported
+        "SLOW_QUERIES": 5,
+        # a query shape running this many times in a request is reported as an N+1
+        "N_PLUS_ONE_THRESHOLD": 5,
+        # requests with more queries or more database time than this are logged
+        "LOG_THRESHOLD_QUERIES": 50,
+        "LOG_THRESHOLD_MS": 500,
+        "SERVER_TIMING": True,
+        "LOGGER": "utilitas.queries",
+        # overrides of the settings above per path prefix
+        "ENDPOINTS": {},
+    }
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.config = {
+            **self.defaults,
+            **getattr(settings, "UTILITAS_QUERY_INSTRUMENTATION", {}),
+        }
+        self.logger = logging.getLogger(self.config["LOGGER"])
+        # longest prefixes first, so the most specific one wins
+        self.endpoints = sorted(
+            self.config["ENDPOINTS"].items(), key=lambda i: len(i[0]), reverse=True
+        )
+
+    def get_config(self, path):
+        for prefix, overrides in self.endpoints:
+            if path.startswith(prefix):
+                return {**self.config, **overrides}
+        return self.config
+
+    def __call__(self, request):
+        config = self.get_config(request.path)
+        if random.random() >= config["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        recorder = QueryRecorder(config["SLOW_QUERIES"])
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        self.report(request, response, recorder, config)
+        return response
+
+    def report(self, request, response, recorder, config):
+        duration_ms = round(recorder.duration * 1000, 3)
+        if config["SERVER_TIMING"]:
+            timing = f'db;dur={duration_ms};desc="{recorder.count} queries"'
+            if response.has_header("Server-Timing"):
+                timing = response["Server-Timing"] + ", " + timing
+            response["Server-Timing"] = timing
+
+        repeated = recorder.get_repeated_shapes(config["N_PLUS_ONE_THRESHOLD"])
+        if not (
+            repeated
+            or recorder.count >= config["LOG_THRESHOLD_QUERIES"]
+            or duration_ms >= config["LOG_THRESHOLD_MS"]
+        ):
+            return
+
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": getattr(request.resolver_match, "view_name", None),
+            "status": response.status_code,
+            "queries": recorder.count,
+            "db_ms": duration_ms,
+            "slowest": recorder.get_slowest(),
+            "n_plus_one": repeated,
+        }
+        self.logger.log(
+            logging.WARNING if repeated else logging.INFO,
+            json.dumps(record),
+            extra={"query_instrumentation": record},
+        )
@@ -1,19 +1,29 @@
-from django.db import models
+from django.db import models, router, transaction
 from typing import Collection
+
+from utilitas.cache import bump_model_version
+from utilitas.managers import CustomManager
+from utilitas.schema import get_schema
 RELATION_FIELDS = ["ForeignKey", "OneToOneField"]
 
+
+# A partial unique constraint that makes the database guarantee that only one row holds
+# a chosen_one field. Optional, add it to the model's Meta.constraints:
+#     constraints = [chosen_one_constraint("is_default", "book")]
+def chosen_one_constraint(field: str, model_name: str) -> models.UniqueConstraint:
+    return models.UniqueConstraint(
+        fields=[field],
+        condition=models.Q(**{field: True}),
+        name=f"{model_name}_chosen_one_{field}",
+    )
+
+
 class BaseModel(models.Model):
     valid_operators = ["exact", "iexact", "in", "lt", "gt", "lte", "gte", "icontains","isnull"]
 
-    def __init__(self, *args, **kwargs):
-        chosen_set = set(self.chosen_one_fields)
-        field_set = set([i.name for i in self._meta.get_fields()])
-        if not chosen_set.issubset(field_set):
-            raise AttributeError(
-                str(chosen_set.difference(field_set))
-                + f" are not present in {self.__class__.__name__}'s fields"
-            )
-        super().__init__(*args, **kwargs)
+    # There is no __init__ override on purpose: every row Django hydrates from a query goes
+    # through it. chosen_one_fields are checked once per class by a system check instead
+    # (see utilitas.checks).
 
     # model fields
     created_at = models.DateTimeField(auto_now_add=True)
@@ -22,6 +32,11 @@ class BaseModel(models.Model):
     # only one row can be True throughout the entire table.
     chosen_one_fields = []
 
+    # text fields indexed for full-text search by BaseSearchView's `search` (see utilitas.search)
+    searchable_fields = []
+
+    objects = CustomManager()
+
     # alias for the field names
     user_friendly_fields = {
 
@@ -41,26 +56,59 @@ class BaseModel(models.Model):
     # get the field of the model
     def get_fields(self, include_foreign_fields=False):
         if not include_foreign_fields:
-            # TODO: clean this up
-            return [i.name for i in self._meta.get_fields() if isinstance(i, (models.CharField, models.TextField, models.BigAutoField, models.DateField, models.DateTimeField, models.BooleanField))]
-        return [i.name for i in self._meta.get_fields()]
+            return list(get_schema(self).plain_fields)
+        return list(get_schema(self).field_names)
+
 
+    # Makes sure that at most one of `objs` holds each chosen_one field (the last one wins),
+    # then clears the field on every other row with a single UPDATE per field.
+    # Has to run in the same transaction as the write of `objs`.
+    @classmethod
+    def release_chosen_one_fields(cls, objs, fields=None, using=None):
+        for i in cls.chosen_one_fields if fields is None else fields:
+            holders = [j for j in objs if getattr(j, i)]
+            if not holders:
+                continue
+            for j in holders[:-1]:
+                setattr(j, i, False)
+            queryset = cls._base_manager.db_manager(using).filter(**{i: True})
+            if holders[-1].pk is not None:
+                queryset = queryset.exclude(pk=holders[-1].pk)
+            queryset.update(**{i: False})
 
     def save(self, *args, **kwargs):
-        for i in self.chosen_one_fields:
-            if getattr(self, i):
-                try:
-                    obj = self.__class__.objects.get(**{i: True})
-                    if obj != self:
-                        setattr(obj, i, False)
-                        obj.save()
-                except self.__class__.DoesNotExist:
-                    pass
-        return super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        chosen = [
+            i
+            for i in self.chosen_one_fields
+            if getattr(self, i) and (update_fields is None or i in update_fields)
+        ]
+        if not chosen:
+            ret = super().save(*args, **kwargs)
+        else:
+            using = kwargs.get("using") or router.db_for_write(
+                self.__class__, instance=self
+            )
+            with transaction.atomic(using=using):
+                self.release_chosen_one_fields([self], chosen, using)
+                ret = super().save(*args, **kwargs)
+        bump_model_version(self.__class__, self._state.db)
+        return ret
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get("using") or router.db_for_write(
+            self.__class__, instance=self
+        )
+        ret = super().delete(*args, **kwargs)
+        bump_model_version(self.__class__, using)
+        return ret
 
     class Meta:
         abstract = True
         ordering = ["id"]
 
-    def get_filterable_fields(self) -> set:
-        return set([i.name for i in self._meta.get_fields()])
\ No newline at end of file
+    def get_filterable_fields(self) -> frozenset:
+        return get_schema(self).filterable_fields
+
+    def get_sortable_fields(self) -> frozenset:
+        return get_schema(self).sortable_fields
\ No newline at end of file
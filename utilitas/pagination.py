@@ -1,6 +1,126 @@
+import asyncio
+import base64
+import datetime
+import decimal
+import json
 import math
+import uuid
 
+from django.core.paginator import (
+    EmptyPage,
+    InvalidPage,
+    Page,
+    PageNotAnInteger,
+    Paginator,
+)
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from utilitas.counting import get_count_strategy
+
+
+class CountedPage(Page):
+    # set when the page was fetched with an extra probe row instead of being checked
+    # against the total count
+    has_more = None
+
+    def has_next(self):
+        if self.has_more is None:
+            return super().has_next()
+        return self.has_more
+
+    def next_page_number(self):
+        if self.has_more is None:
+            return super().next_page_number()
+        return self.number + 1
+
+    def previous_page_number(self):
+        if self.has_more is None:
+            return super().previous_page_number()
+        return self.number - 1
+
+
+# a Paginator whose count comes from a count strategy (see utilitas.counting).
+# Only exact counts are trusted to validate page numbers, every other strategy fetches
+# one extra row to find out whether there is a next page.
+class CountedPaginator(Paginator):
+    def __init__(self, object_list, per_page, strategy, **kwargs):
+        self.strategy = strategy
+        self.count_strategy = strategy.name
+        super().__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        count, self.count_strategy = self.strategy.count(self.object_list)
+        return count
+
+    @cached_property
+    def num_pages(self):
+        if self.count is None:
+            return None
+        return super().num_pages
+
+    def page(self, number):
+        if self.strategy.name == "exact":
+            return super().page(number)
+
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+
+        bottom = (number - 1) * self.per_page
+        queryset = self.strategy.annotate(self.object_list)
+        rows = list(queryset[bottom : bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage("That page contains no results")
+
+        counted = self.strategy.count_from_page(rows[: self.per_page])
+        if counted is not None:
+            self.__dict__["count"], self.count_strategy = counted
+
+        page = CountedPage(rows[: self.per_page], number, self)
+        page.has_more = len(rows) > self.per_page
+        return page
+
+    # async variant of `page`. The count is resolved here, concurrently with the page
+    # query, so that nothing has to query the database synchronously afterwards.
+    async def apage(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger("That page number is not an integer")
+        if number < 1:
+            raise EmptyPage("That page number is less than 1")
+
+        bottom = (number - 1) * self.per_page
+        queryset = self.strategy.annotate(self.object_list)
+        page_query = queryset[bottom : bottom + self.per_page + 1]
+
+        async def fetch():
+            return [i async for i in page_query]
+
+        if self.strategy.counts_in_page:
+            rows = await fetch()
+            counted = self.strategy.count_from_page(rows[: self.per_page])
+            if counted is None:
+                counted = await self.strategy.acount(self.object_list)
+        else:
+            rows, counted = await asyncio.gather(
+                fetch(), self.strategy.acount(self.object_list)
+            )
+        if not rows and number > 1:
+            raise EmptyPage("That page contains no results")
+
+        self.__dict__["count"], self.count_strategy = counted
+        page = CountedPage(rows[: self.per_page], number, self)
+        page.has_more = len(rows) > self.per_page
+        return page
 
 
 class CustomPagination(PageNumberPagination):
@@ -8,26 +128,278 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = "size"
     page_size = 10
 
+    # "page" paginates with page numbers (OFFSET), "cursor" paginates with an opaque
+    # keyset cursor so that every page costs the same no matter how deep it is.
+    pagination_mode = "page"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Invalid cursor"
+
+    # how the "count" of the response is found: "exact", "cached", "estimated",
+    # "window", "skip" or a utilitas.counting.CountStrategy
+    count_strategy = "exact"
+    # seconds a count stays cached with the "cached" strategy
+    count_cache_ttl = 60
+    # page size used when the client asks for everything with size=-1
+    unbounded_page_size = 2**31
+
     def get_page_size(self, request):
         if int(request.query_params.get(self.page_size_query_param, 0)) == -1:
-            p_size = self.model.objects.count()
-            if p_size != 0:
-                return self.model.objects.count()
+            return self.unbounded_page_size
         return super().get_page_size(request)
 
+    def get_count_strategy(self):
+        return get_count_strategy(self.count_strategy, self)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.pagination_mode == "cursor":
+            return self.paginate_queryset_by_cursor(queryset, request)
+
+        paginator = CountedPaginator(
+            queryset, self.get_page_size(request), self.get_count_strategy()
+        )
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        return list(self.page)
+
+    # async variant of `paginate_queryset`, for the async views
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.pagination_mode == "cursor":
+            return await self.apaginate_queryset_by_cursor(queryset, request)
+
+        paginator = CountedPaginator(
+            queryset, self.get_page_size(request), self.get_count_strategy()
+        )
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = await paginator.apage(page_number)
+        except InvalidPage as exc:
+            raise NotFound(
+                self.invalid_page_message.format(
+                    page_number=page_number, message=str(exc)
+                )
+            )
+        return list(self.page)
+
+    # keyset pagination: the cursor holds the values of the ordering columns (the active
+    # sorts plus the pk as a tie-breaker) of the row the page starts after, which is turned
+    # into a seek predicate instead of an OFFSET.
+    def paginate_queryset_by_cursor(self, queryset, request):
+        queryset, page_size, ordering, values, reverse = self.get_cursor_page_query(
+            queryset, request
+        )
+        # fetching an extra row tells us whether there is another page in that direction
+        rows = list(queryset[: page_size + 1])
+        return self.set_cursor_page(rows, page_size, ordering, values, reverse)
+
+    async def apaginate_queryset_by_cursor(self, queryset, request):
+        queryset, page_size, ordering, values, reverse = self.get_cursor_page_query(
+            queryset, request
+        )
+        page_query = queryset[: page_size + 1]
+
+        async def fetch():
+            return [i async for i in page_query]
+
+        rows, (self.cursor_count, self.cursor_count_strategy) = await asyncio.gather(
+            fetch(), self.get_count_strategy().acount(self.cursor_queryset.order_by())
+        )
+        return self.set_cursor_page(rows, page_size, ordering, values, reverse)
+
+    # the page query of a cursor, ordered and filtered by the seek predicate, along with the
+    # page size, the ordering and the decoded cursor
+    def get_cursor_page_query(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self.get_cursor_ordering(queryset)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        values, reverse = None, False
+        if cursor:
+            values, reverse = self.decode_cursor(cursor, ordering)
+
+        self.cursor_queryset = queryset
+        self.cursor_count = None
+        self.cursor_count_strategy = None
+        queryset = queryset.order_by(
+            *[self._order_expression(i, desc != reverse) for i, desc in ordering]
+        )
+        if values is not None:
+            queryset = queryset.filter(self._seek_predicate(ordering, values, reverse))
+        return queryset, page_size, ordering, values, reverse
+
+    # sets the links of a fetched cursor page (of up to page_size + 1 rows)
+    def set_cursor_page(self, rows, page_size, ordering, values, reverse):
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        if rows:
+            first, last = self._row_values(rows[0], ordering), self._row_values(
+                rows[-1], ordering
+            )
+        else:
+            # an empty page: point both ways back at where we came from
+            first = last = values
+
+        if reverse:
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        self.cursor_links = {
+            "next": (
+                self.encode_cursor(last, False)
+                if has_next and last is not None
+                else None
+            ),
+            "previous": (
+                self.encode_cursor(first, True)
+                if has_previous and first is not None
+                else None
+            ),
+        }
+        self.page = rows
+        return rows
+
+    # returns a list of (field, descending) tuples. The pk is always the last column so that
+    # every cursor points at exactly one row.
+    def get_cursor_ordering(self, queryset):
+        opts = queryset.model._meta
+        names = list(queryset.query.order_by) or list(opts.ordering)
+        ordering = []
+        for name in names:
+            if not isinstance(name, str):
+                raise NotFound(
+                    "Cursor pagination only supports ordering by field names."
+                )
+            desc = name.startswith("-")
+            name = name.lstrip("-")
+            field = opts.pk if name == "pk" else opts.get_field(name)
+            ordering.append((field, desc))
+        if opts.pk not in [i for i, _ in ordering]:
+            ordering.append((opts.pk, False))
+        return ordering
+
+    # NULLs are ordered as the smallest value so that the seek predicate stays well defined
+    @staticmethod
+    def _order_expression(field, desc):
+        if not field.null:
+            return ("-" if desc else "") + field.attname
+        if desc:
+            return F(field.attname).desc(nulls_last=True)
+        return F(field.attname).asc(nulls_first=True)
+
+    @staticmethod
+    def _seek_predicate(ordering, values, reverse):
+        predicate = Q()
+        equal = Q()
+        for (field, desc), value in zip(ordering, values):
+            name = field.attname
+            if desc == reverse:
+                # the next rows hold bigger values in this column
+                after = (
+                    Q(**{f"{name}__isnull": False})
+                    if value is None
+                    else Q(**{f"{name}__gt": value})
+                )
+            else:
+                # the next rows hold smaller values in this column
+                if value is None:
+                    after = Q(pk__in=[])
+                else:
+                    after = Q(**{f"{name}__lt": value})
+                    if field.null:
+                        after |= Q(**{f"{name}__isnull": True})
+            predicate |= equal & after
+            equal &= (
+                Q(**{f"{name}__isnull": True}) if value is None else Q(**{name: value})
+            )
+        return predicate
+
+    @staticmethod
+    def _row_values(obj, ordering):
+        return [getattr(obj, field.attname) for field, _ in ordering]
+
+    def encode_cursor(self, values, reverse):
+        token = json.dumps({"v": [self._encode_value(i) for i in values], "r": reverse})
+        cursor = base64.urlsafe_b64encode(token.encode()).decode().rstrip("=")
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, cursor, ordering):
+        try:
+            token = json.loads(
+                base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            )
+            values = token["v"]
+            if len(values) != len(ordering):
+                raise ValueError("cursor does not match the current sorts")
+            values = [
+                None if value is None else field.to_python(value)
+                for (field, _), value in zip(ordering, values)
+            ]
+            return values, bool(token.get("r", False))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (decimal.Decimal, uuid.UUID)):
+            return str(value)
+        return value
+
+    # returns a (count, strategy_name) tuple. The count is None with the "skip" strategy.
+    def get_count(self):
+        if self.pagination_mode == "cursor":
+            # the page query of a cursor is filtered by the seek predicate, so the count can
+            # never come from the page itself
+            if self.cursor_count_strategy is None:
+                self.cursor_count, self.cursor_count_strategy = (
+                    self.get_count_strategy().count(self.cursor_queryset.order_by())
+                )
+            return self.cursor_count, self.cursor_count_strategy
+        paginator = self.page.paginator
+        return paginator.count, paginator.count_strategy
+
     def get_count_per_page(self):
         return len(list(self.page))
 
+    # returns a (total_pages, strategy_name) tuple, named after the strategy of the count
     def get_total_pages(self):
-        return math.ceil(self.page.paginator.count / self.get_page_size(self.request))
+        count, strategy = self.get_count()
+        if count is None:
+            return None, strategy
+        return math.ceil(count / self.get_page_size(self.request)), strategy
 
     def get_paginated_response(self, *args, **kwargs):
-        return {
-            "links": {
+        if self.pagination_mode == "cursor":
+            links = self.cursor_links
+        else:
+            links = {
                 "next": self.get_next_link(),
                 "previous": self.get_previous_link(),
-            },
-            "count": self.page.paginator.count,
+            }
+        count, count_strategy = self.get_count()
+        total_pages, _ = self.get_total_pages()
+        return {
+            "links": links,
+            "count": count,
             "count_per_page": self.get_count_per_page(),
-            "total_pages": self.get_total_pages(),
-        }
\ No newline at end of file
+            "total_pages": total_pages,
+            "has_next": links["next"] is not None,
+            "count_strategy": count_strategy,
+        }
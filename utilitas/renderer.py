@@ -1,11 +1,69 @@
+import re
+
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Encodes with orjson, producing the same bytes as DRF's stdlib json encoding
+# (compact separators, unicode output, datetimes as ISO 8601 with a Z for UTC).
+# Returns None for payloads it can't encode identically, so the stdlib encoder is used.
+class OrjsonEncoder:
+    # python writes exponents as e+16 / e-07, orjson as e16 / e-7
+    exponent = re.compile(rb"[:,\[]-?\d+(?:\.\d+)?e[-+]?\d+(?=[,\]}])")
+
+    def __init__(self):
+        self.options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        # Decimals, lazy strings, querysets... are converted like DRF does
+        self.default = JSONEncoder().default
+
+    def __call__(self, data):
+        try:
+            ret = orjson.dumps(data, default=self.default, option=self.options)
+        except TypeError:
+            return None
+        if self.exponent.search(ret):
+            return None
+        # DRF escapes these to keep the output a strict subset of javascript
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
+
+
+def get_fast_encoder():
+    if orjson is None:
+        return None
+    return OrjsonEncoder()
+
 
 class CustomRenderer(JSONRenderer):
+    # a callable turning the response data into bytes (or None to fall back to the stdlib
+    # encoder). Uses orjson when it is installed, set to None to always use the stdlib.
+    fast_encoder = get_fast_encoder()
+
     def render(self, data, accepted_media_type=None, renderer_context=None, **kwargs):
 
         if "message" not in data.keys():
             data["message"] = ""
 
+        if self.can_encode_fast(accepted_media_type, renderer_context):
+            ret = self.fast_encoder(data)
+            if ret is not None:
+                return ret
+
         return super(CustomRenderer, self).render(
             data, accepted_media_type, renderer_context
-        )
\ No newline at end of file
+        )
+
+    # the fast encoder only produces compact, non-indented, unicode output
+    def can_encode_fast(self, accepted_media_type, renderer_context):
+        return (
+            self.fast_encoder is not None
+            and self.compact
+            and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
@@ -0,0 +1,101 @@
+from django.apps import apps
+from django.db import models
+
+# field classes that are returned by BaseModel.get_fields() (and exported in csv files)
+# when no fields are asked for
+PLAIN_FIELD_TYPES = (
+    models.CharField,
+    models.TextField,
+    models.BigAutoField,
+    models.DateField,
+    models.DateTimeField,
+    models.BooleanField,
+)
+
+
+# Everything utilitas needs to know about a model's fields, computed once per model class
+# instead of walking `_meta.get_fields()` on every request.
+class ModelSchema:
+    def __init__(self, model):
+        opts = model._meta
+        self.model = model
+        self.pk_name = opts.pk.name
+        self.fields = {i.name: i for i in opts.get_fields()}
+        self.field_names = list(self.fields)
+
+        # every field (including reverse relations) can be used in filters
+        self.filterable_fields = frozenset(self.fields)
+        # to-many relations would duplicate rows in the results, so they can't be sorted on
+        self.sortable_fields = frozenset(
+            i.name
+            for i in self.fields.values()
+            if not (i.many_to_many or i.one_to_many)
+        )
+        # the fields that are actual columns of the model's table
+        self.projectable_fields = frozenset(
+            i.name for i in self.fields.values() if i.concrete and not i.many_to_many
+        )
+        self.prefetchable_fields = frozenset(
+            i.name for i in self.fields.values() if i.is_relation
+        )
+        self.plain_fields = [
+            i.name for i in self.fields.values() if isinstance(i, PLAIN_FIELD_TYPES)
+        ]
+
+        self.field_types = {
+            i.name: i.get_internal_type()
+            for i in self.fields.values()
+            if hasattr(i, "get_internal_type")
+        }
+        self.relation_kinds = {
+            i.name: self.get_relation_kind(i)
+            for i in self.fields.values()
+            if i.is_relation
+        }
+        self.related_models = {
+            i.name: i.related_model for i in self.fields.values() if i.is_relation
+        }
+
+        # the field list of CustomMetadata (reverse relations don't have help texts)
+        self.metadata_fields = [
+            {
+                "name": i.name,
+                "type": i.get_internal_type(),
+                "description": getattr(i, "help_text"),
+            }
+            for i in self.fields.values()
+            if hasattr(i, "help_text")
+        ]
+
+    @staticmethod
+    def get_relation_kind(field):
+        for i in ["one_to_one", "many_to_one", "one_to_many", "many_to_many"]:
+            if getattr(field, i):
+                return i
+        return None
+
+
+_schemas = {}
+
+
+# accepts a model class or an instance of it
+def get_schema(model) -> ModelSchema:
+    if not isinstance(model, type):
+        model = model.__class__
+    schema = _schemas.get(model)
+    if schema is None:
+        schema = ModelSchema(model)
+        # reverse relations are only known once every model is loaded,
+        # a schema built before that can't be kept.
+        if apps.models_ready:
+            _schemas[model] = schema
+    return schema
+
+
+# called when the app registry is ready (see UtilitasConfig.ready)
+def build_schemas():
+    from utilitas.models import BaseModel
+
+    for model in apps.get_models():
+        if issubclass(model, BaseModel):
+            _schemas[model] = ModelSchema(model)
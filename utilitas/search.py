@@ -0,0 +1,286 @@
+import re
+import threading
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# field types that can be declared in a model's `searchable_fields`
+SEARCHABLE_FIELD_TYPES = {
+    "CharField",
+    "TextField",
+    "EmailField",
+    "SlugField",
+    "URLField",
+}
+# the backend used for each database vendor when UTILITAS_SEARCH doesn't set one
+SEARCH_BACKENDS = {
+    "sqlite": "utilitas.search.SQLiteSearchBackend",
+    "postgresql": "utilitas.search.PostgresSearchBackend",
+}
+DEFAULT_SEARCH_BACKEND = "utilitas.search.LikeSearchBackend"
+# the annotation holding the relevance of a row when results are ranked
+RANK_ALIAS = "search_rank"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# Full-text search over the `searchable_fields` of a model. A backend narrows a queryset
+# down to the rows matching a query and, when asked to rank, orders them by relevance
+# (best first, then by pk). Backends that keep an index of their own create it in
+# `install` and fill it in `rebuild`.
+class BaseSearchBackend:
+    # whether `search(..., rank=True)` orders by relevance
+    supports_ranking = False
+
+    def search(self, queryset, query: str, rank=False):
+        raise NotImplementedError
+
+    def install(self, model, using="default") -> bool:
+        return False
+
+    def rebuild(self, model, using="default"):
+        pass
+
+
+# LIKE '%term%' on every searchable field, every term of the query has to match one of
+# them. Needs no index, and scans the table: the fallback for databases without a
+# full-text backend.
+class LikeSearchBackend(BaseSearchBackend):
+    def search(self, queryset, query: str, rank=False):
+        fields = queryset.model.searchable_fields
+        terms = _TERM_RE.findall(query)
+        if not terms:
+            return queryset.none()
+        return queryset.filter(
+            reduce(
+                and_,
+                (
+                    reduce(or_, (Q(**{f"{i}__icontains": term}) for i in fields))
+                    for term in terms
+                ),
+            )
+        )
+
+
+# An external content FTS5 table (`<table>_fts`) indexing the searchable columns of the
+# model's table. Triggers on the model's table keep it in sync with every write, whether
+# it comes from save(), bulk_create(), update(), delete() or raw SQL.
+class SQLiteSearchBackend(BaseSearchBackend):
+    supports_ranking = True
+
+    def __init__(self, tokenize="unicode61 remove_diacritics 2"):
+        self.tokenize = tokenize
+
+    @staticmethod
+    def get_table_name(model) -> str:
+        return f"{model._meta.db_table}_fts"
+
+    @staticmethod
+    def get_columns(model):
+        return [model._meta.get_field(i).column for i in model.searchable_fields]
+
+    # every term of the query has to match, terms are quoted so that FTS5's query syntax
+    # (AND, OR, NEAR, column filters...) never gets in the way of user input
+    @staticmethod
+    def build_match(query: str):
+        terms = _TERM_RE.findall(query)
+        return " ".join(f'"{i}"' for i in terms) or None
+
+    def search(self, queryset, query: str, rank=False):
+        match = self.build_match(query)
+        if match is None:
+            return queryset.none()
+        model = queryset.model
+        table = self.get_table_name(model)
+        if not rank:
+            return queryset.filter(
+                pk__in=RawSQL(
+                    f'SELECT rowid FROM "{table}" WHERE "{table}" MATCH %s', [match]
+                )
+            )
+        # the bm25 rank (lower is better) of each matching row, looked up in the index by rowid
+        return (
+            queryset.filter(
+                pk__in=RawSQL(
+                    f'SELECT rowid FROM "{table}" WHERE "{table}" MATCH %s', [match]
+                )
+            )
+            .annotate(
+                **{
+                    RANK_ALIAS: RawSQL(
+                        f'SELECT rank FROM "{table}" WHERE "{table}" MATCH %s '
+                        f'AND rowid = "{model._meta.db_table}"."{model._meta.pk.column}"',
+                        [match],
+                    )
+                }
+            )
+            .order_by(RANK_ALIAS, "pk")
+        )
+
+    # (Re)creates the index and its triggers when they are missing or index other columns,
+    # e.g. after `searchable_fields` changed or a migration rebuilt the model's table.
+    # Returns whether anything was created.
+    def install(self, model, using="default") -> bool:
+        connection = connections[using]
+        table = self.get_table_name(model)
+        content = model._meta.db_table
+        pk = model._meta.pk.column
+        columns = self.get_columns(model)
+        triggers = [f"{table}_ai", f"{table}_ad", f"{table}_au"]
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA table_info("{table}")')
+            installed = [i[1] for i in cursor.fetchall()]
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s",
+                [content],
+            )
+            installed_triggers = {i[0] for i in cursor.fetchall()}
+            if installed == columns and installed_triggers.issuperset(triggers):
+                return False
+
+            for i in triggers:
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{i}"')
+            cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+
+            names = ", ".join(f'"{i}"' for i in columns)
+            new = ", ".join(f'new."{i}"' for i in columns)
+            old = ", ".join(f'old."{i}"' for i in columns)
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE "{table}" USING fts5({names}, '
+                f"content='{content}', content_rowid='{pk}', tokenize='{self.tokenize}')"
+            )
+            insert = (
+                f'INSERT INTO "{table}"(rowid, {names}) VALUES (new."{pk}", {new});'
+            )
+            delete = (
+                f'INSERT INTO "{table}"("{table}", rowid, {names}) '
+                f"VALUES ('delete', old.\"{pk}\", {old});"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{triggers[0]}" AFTER INSERT ON "{content}" BEGIN {insert} END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{triggers[1]}" AFTER DELETE ON "{content}" BEGIN {delete} END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{triggers[2]}" AFTER UPDATE OF "{pk}", {names} '
+                f'ON "{content}" BEGIN {delete} {insert} END'
+            )
+        self.rebuild(model, using)
+        return True
+
+    def rebuild(self, model, using="default"):
+        table = self.get_table_name(model)
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'INSERT INTO "{table}"("{table}") VALUES (\'rebuild\')')
+
+
+# to_tsvector/websearch_to_tsquery over the searchable fields, ranked with ts_rank.
+# Postgres keeps the index itself: add `search_index()` to the model's Meta.indexes, the
+# GIN index is used as long as the backend's `config` matches the index's.
+class PostgresSearchBackend(BaseSearchBackend):
+    supports_ranking = True
+
+    def __init__(self, config="english"):
+        self.config = config
+
+    def get_vector(self, model):
+        from django.contrib.postgres.search import SearchVector
+
+        return SearchVector(*model.searchable_fields, config=self.config)
+
+    def search(self, queryset, query: str, rank=False):
+        from django.contrib.postgres.search import SearchQuery, SearchRank
+
+        vector = self.get_vector(queryset.model)
+        search_query = SearchQuery(query, search_type="websearch", config=self.config)
+        queryset = queryset.alias(search_vector=vector).filter(
+            search_vector=search_query
+        )
+        if not rank:
+            return queryset
+        return queryset.annotate(
+            **{RANK_ALIAS: SearchRank(vector, search_query)}
+        ).order_by(f"-{RANK_ALIAS}", "pk")
+
+
+# The GIN index PostgresSearchBackend searches with, for the model's Meta.indexes:
+#     indexes = [search_index("book", ["title", "body"])]
+def search_index(model_name: str, fields, config="english"):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    return GinIndex(SearchVector(*fields, config=config), name=f"{model_name}_search")
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+# FTS5 is compiled in the SQLite library or not, whatever the database. Asking a private
+# in-memory database keeps Django's connections out of it, so the backend can be picked
+# from async code too.
+def _has_fts5() -> bool:
+    import sqlite3
+
+    connection = sqlite3.connect(":memory:")
+    try:
+        options = {i[0] for i in connection.execute("PRAGMA compile_options")}
+    finally:
+        connection.close()
+    return "ENABLE_FTS5" in options
+
+
+# The backend of a database alias. Configured with the UTILITAS_SEARCH setting, e.g.
+#   UTILITAS_SEARCH = {"BACKEND": "utilitas.search.PostgresSearchBackend", "OPTIONS": {"config": "french"}}
+# and picked from the database's vendor when not set.
+def get_search_backend(using="default") -> BaseSearchBackend:
+    backend = _backends.get(using)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(using)
+            if backend is None:
+                config = getattr(settings, "UTILITAS_SEARCH", {})
+                if "BACKEND" in config:
+                    backend = import_string(config["BACKEND"])(
+                        **config.get("OPTIONS", {})
+                    )
+                else:
+                    connection = connections[using]
+                    path = SEARCH_BACKENDS.get(
+                        connection.vendor, DEFAULT_SEARCH_BACKEND
+                    )
+                    if connection.vendor == "sqlite" and not _has_fts5():
+                        path = DEFAULT_SEARCH_BACKEND
+                    backend = import_string(path)()
+                _backends[using] = backend
+    return backend
+
+
+# narrows `queryset` down to the rows matching `query`, the best matches first if `rank`
+def search(queryset, query: str, rank=False):
+    return get_search_backend(queryset.db).search(queryset, query, rank)
+
+
+# Creates the missing search indexes of the models with searchable_fields. Returns the
+# models whose index was (re)created.
+def install_search_indexes(models, using="default"):
+    backend = get_search_backend(using)
+    return [
+        i
+        for i in models
+        if i.searchable_fields and i._meta.managed and backend.install(i, using)
+    ]
+
+
+# post_migrate receiver, migrations create and rebuild the tables the indexes rely on
+def install_search_indexes_after_migrate(app_config, using="default", **kwargs):
+    from utilitas.checks import get_base_models
+
+    install_search_indexes(get_base_models([app_config]), using)
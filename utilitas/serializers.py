@@ -1,21 +1,235 @@
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
 from rest_flex_fields import FlexFieldsModelSerializer
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.serializers import raise_errors_on_nested_writes
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
+
+from utilitas.cache import bump_model_version
+from utilitas.schema import get_schema
 
 
 class BaseListSerializer(serializers.ListSerializer):
     def validate(self, attrs):
         return super().validate(attrs)
 
+    def to_internal_value(self, data):
+        self.fetch_related_objects(data)
+        return super().to_internal_value(data)
+
+    # Fetches the objects the rows point to with one query per foreign key, instead of
+    # one query per row and foreign key (see BulkPrimaryKeyRelatedField).
+    def fetch_related_objects(self, data):
+        self.related_objects = {}
+        if not isinstance(data, list):
+            return
+        for name, field in self.child.fields.items():
+            if (
+                not isinstance(field, BulkPrimaryKeyRelatedField)
+                or field.read_only
+                or field.pk_field is not None
+            ):
+                continue
+            queryset = field.get_queryset()
+            pk_field = queryset.model._meta.pk
+            values = set()
+            for i in data:
+                if isinstance(i, dict) and i.get(name) is not None:
+                    try:
+                        values.add(pk_field.to_python(i[name]))
+                    except (TypeError, ValueError, ValidationError):
+                        pass
+            if values:
+                self.related_objects[name] = queryset.in_bulk(values)
+
+    # Validates every row on its own, where is_valid() rejects the whole list when one row
+    # is invalid. Returns a (validated_data, errors) pair per row, one of them being None.
+    def validate_each(self, data):
+        self.fetch_related_objects(data)
+        results = []
+        for item in data:
+            try:
+                results.append((self.child.run_validation(item), None))
+            except serializers.ValidationError as e:
+                results.append((None, e.detail))
+        return results
+
     def create(self, validated_data):
-        objs = [self.context["view"].model(**i) for i in validated_data]
-        return self.context["view"].model.objects.bulk_create(objs)
+        view = self.context["view"]
+        model = view.model
+        options = {"batch_size": view.bulk_batch_size}
+        # upserting: rows conflicting on `unique_fields` get their `update_fields` updated
+        upsert = self.context.get("upsert")
+        if upsert:
+            options.update(
+                update_conflicts=True,
+                unique_fields=upsert["unique_fields"],
+                update_fields=upsert["update_fields"],
+            )
+        objs = [model(**i) for i in validated_data]
+        model.release_chosen_one_fields(objs)
+        queryset = model.objects.all()
+        objs = queryset.bulk_create(objs, **options)
+        bump_model_version(model, queryset.db)
+        if upsert:
+            objs = self.reload_upserted(queryset, objs, upsert["unique_fields"])
+        return objs
+
+    # Rows that hit a conflict kept the stored values of the columns that weren't updated
+    # (created_at...), which the objects don't hold: they are read again, matched on their
+    # `unique_fields`.
+    def reload_upserted(self, queryset, objs, unique_fields):
+        opts = queryset.model._meta
+        attnames = [opts.get_field(i).attname for i in unique_fields]
+
+        def get_key(obj):
+            return tuple(getattr(obj, i) for i in attnames)
+
+        stored = {}
+        batch_size = self.context["view"].bulk_batch_size
+        for start in range(0, len(objs), batch_size):
+            condition = Q()
+            for obj in objs[start : start + batch_size]:
+                condition |= Q(**{i: getattr(obj, i) for i in attnames})
+            stored.update((get_key(i), i) for i in queryset.filter(condition))
+        return [stored.get(get_key(i), i) for i in objs]
+
+    # Rows that already exist are expected when upserting, the database resolves the
+    # conflicts. Imports drop them too, and leave uniqueness to the database's constraints.
+    def drop_unique_validators(self):
+        child = self.child
+        child.validators = [
+            i for i in child.validators if not isinstance(i, UniqueTogetherValidator)
+        ]
+        for field in child.fields.values():
+            field.validators = [
+                i for i in field.validators if not isinstance(i, UniqueValidator)
+            ]
+
+
+# Hands ISO 8601 datetimes to the renderer as datetime objects (in the current timezone)
+# instead of formatting every value in python. CustomRenderer's encoders write them exactly
+# like DRF's DateTimeField does, but `serializer.data` holds datetimes instead of strings:
+# used by serializers with `native_datetimes`.
+class NativeDateTimeField(serializers.DateTimeField):
+    def to_representation(self, value):
+        output_format = getattr(self, "format", api_settings.DATETIME_FORMAT)
+        if (
+            not value
+            or output_format is None
+            or isinstance(value, str)
+            or output_format.lower() != ISO_8601
+        ):
+            return super().to_representation(value)
+        return self.enforce_timezone(value)
+
+
+# Takes related objects from the ones BaseListSerializer fetched for the whole list when
+# there are, and queries them one by one like PrimaryKeyRelatedField otherwise (single objects,
+# or values the list didn't fetch, so that invalid ones get the usual error).
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        objects = getattr(self.root, "related_objects", {}).get(self.field_name)
+        if objects is not None and not isinstance(data, bool):
+            try:
+                obj = objects.get(self.get_queryset().model._meta.pk.to_python(data))
+            except (TypeError, ValueError, ValidationError):
+                obj = None
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
 
 
 class BaseModelSerializer(FlexFieldsModelSerializer):
+    serializer_related_field = BulkPrimaryKeyRelatedField
+    # datetimes are left for the renderer to format (see NativeDateTimeField). Only for
+    # serializers whose data is rendered by CustomRenderer and nothing else.
+    native_datetimes = False
+
+    # nested (expanded) objects are serialized once per response and shared by every row
+    # pointing at them, e.g. the category of a page of products. Only their output is
+    # shared: JOINed relations still hydrate one instance per row.
+    memoize_nested = True
+
+    def build_standard_field(self, field_name, model_field):
+        field_class, field_kwargs = super().build_standard_field(field_name, model_field)
+        if self.native_datetimes and field_class is serializers.DateTimeField:
+            field_class = NativeDateTimeField
+        return field_class, field_kwargs
+
     def __init__(self, *args, **kwargs):
         # read_only_fields = kwargs.pop("read_only_fields", None)
         excluded_fields = kwargs.pop("excluded_fields", None)
         super(BaseModelSerializer, self).__init__(*args, **kwargs)
+        self._memo_fields = None
+
+    def to_representation(self, instance):
+        # top level objects are only serialized once anyway
+        if (
+            not self.memoize_nested
+            or self.parent is None
+            or self.parent is self.root
+            or instance.pk is None
+        ):
+            return super().to_representation(instance)
+
+        # the memo lives in the root serializer's context, so it lasts for one response
+        memo = self.context.setdefault("serialization_memo", {})
+        if self._memo_fields is None:
+            data = super().to_representation(instance)
+            # the fields are only known once flex fields were applied by the first call
+            self._memo_fields = tuple(
+                (name, field.__class__) for name, field in self.fields.items()
+            )
+        else:
+            data = None
+        key = (self.__class__, self._memo_fields, type(instance), instance.pk)
+        if key not in memo:
+            memo[key] = (
+                data if data is not None else super().to_representation(instance)
+            )
+        return memo[key]
+
+    # Same as ModelSerializer.update, but only the columns whose value changed are saved
+    # (with the auto_now ones), and the row isn't written at all when none did.
+    def update(self, instance, validated_data):
+        raise_errors_on_nested_writes("update", self, validated_data)
+        opts = instance._meta
+        m2m_fields = []
+        update_fields = []
+        full_save = False
+        for attr, value in validated_data.items():
+            try:
+                field = opts.get_field(attr)
+            except FieldDoesNotExist:
+                field = None
+            if field is not None and field.many_to_many:
+                m2m_fields.append((attr, value))
+                continue
+            if field is None or not field.concrete:
+                # which columns a property or a reverse relation writes is unknown
+                full_save = True
+            elif field.is_relation:
+                if getattr(instance, field.attname) != getattr(value, "pk", value):
+                    update_fields.append(attr)
+            elif getattr(instance, attr) != value:
+                update_fields.append(attr)
+            setattr(instance, attr, value)
+
+        if full_save:
+            instance.save()
+        elif update_fields:
+            update_fields.extend(
+                i.name
+                for i in opts.concrete_fields
+                if getattr(i, "auto_now", False) and i.name not in update_fields
+            )
+            instance.save(update_fields=update_fields)
+
+        for attr, value in m2m_fields:
+            getattr(instance, attr).set(value)
+        return instance
 
     class Meta:
         list_serializer_class = BaseListSerializer
@@ -32,9 +246,7 @@ class FilterParamSerializer(BaseSerializer):
 
 
     def validate(self, data, *args, **kwargs):
-        self.available_fields = [
-            i.name for i in self.context["model"]._meta.get_fields()
-         ]
+        self.available_fields = get_schema(self.context["model"]).filterable_fields
         if data["operator"] not in self.context["model"].valid_operators:
             raise serializers.ValidationError(
                 f"{data['operator']} is not in valid operators of {self.context['model'].__name__}. "
@@ -1,3 +1,1734 @@
-from django.test import TestCase
+import base64
+import datetime
+import decimal
+import json
+import unittest
+import uuid
+import warnings
+import zoneinfo
+from unittest import mock
 
-# Create your tests here.
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection, models
+from django.http import JsonResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from django.urls import path
+from django.utils.translation import gettext_lazy
+from rest_flex_fields import FlexFieldsModelSerializer
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from utilitas.async_views import (
+    AsyncBaseDetailsView,
+    AsyncBaseListView,
+    AsyncBaseSearchView,
+)
+from utilitas.benchmarks import bench_views, get_budget_failures
+from utilitas.cache import LRUCache, get_model_version
+from utilitas.checks import (
+    check_chosen_one_fields,
+    check_ordering_indexes,
+    check_searchable_fields,
+)
+from utilitas.compiled import (
+    CompiledSerializer,
+    _get_compiled_reader,
+    compile_reader,
+    get_compiled_reader,
+)
+from utilitas.counting import EstimatedCount, get_count_strategy
+from utilitas.expand import build_expand_tree
+from utilitas.filters import compile_filter_params, get_filter_plan
+from utilitas.indexes import (
+    QueryShape,
+    add_meta_indexes,
+    advise,
+    get_shape_queryset,
+    read_logged_shapes,
+    suggest_index_fields,
+)
+from utilitas.middlewares import QueryRecorder
+from utilitas.models import BaseModel
+from utilitas.renderer import CustomRenderer, get_fast_encoder
+from utilitas.schema import get_schema
+from utilitas.search import get_search_backend
+from utilitas.serializers import BaseModelSerializer
+from utilitas.views import (
+    BaseBatchView,
+    BaseDetailsView,
+    BaseListView,
+    BaseSearchView,
+)
+
+
+# The models, views and urls the tests run against. Their tables are created by
+# setUpModule, utilitas doesn't ship migrations for them.
+class Category(BaseModel):
+    name = models.CharField(max_length=50)
+    parent = models.ForeignKey(
+        "self", null=True, on_delete=models.CASCADE, related_name="children"
+    )
+
+    class Meta(BaseModel.Meta):
+        app_label = "utilitas"
+        db_table = "utilitas_test_category"
+
+
+class Tag(BaseModel):
+    label = models.CharField(max_length=50, unique=True)
+
+    class Meta(BaseModel.Meta):
+        app_label = "utilitas"
+        db_table = "utilitas_test_tag"
+
+
+class Book(BaseModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField(default="")
+    pages = models.IntegerField(default=0)
+    featured = models.BooleanField(default=False)
+    category = models.ForeignKey(
+        Category, null=True, on_delete=models.CASCADE, related_name="books"
+    )
+    chosen_one_fields = ["featured"]
+    searchable_fields = ["title", "body"]
+
+    class Meta(BaseModel.Meta):
+        app_label = "utilitas"
+        db_table = "utilitas_test_book"
+        # keeps the post_migrate search index installation away from the table
+        managed = False
+
+
+class Review(BaseModel):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="reviews")
+    stars = models.IntegerField(default=5)
+
+    class Meta(BaseModel.Meta):
+        app_label = "utilitas"
+        db_table = "utilitas_test_review"
+
+
+TEST_MODELS = [Category, Tag, Book, Review]
+
+
+class CategorySerializer(BaseModelSerializer):
+    class Meta(BaseModelSerializer.Meta):
+        model = Category
+        fields = "__all__"
+        expandable_fields = {
+            "parent": "utilitas.tests.CategorySerializer",
+            "children": ("utilitas.tests.CategorySerializer", {"many": True}),
+        }
+
+
+class TagSerializer(BaseModelSerializer):
+    class Meta(BaseModelSerializer.Meta):
+        model = Tag
+        fields = "__all__"
+
+
+class ReviewSerializer(BaseModelSerializer):
+    class Meta(BaseModelSerializer.Meta):
+        model = Review
+        fields = "__all__"
+        expandable_fields = {"book": "utilitas.tests.BookSerializer"}
+
+
+class BookSerializer(BaseModelSerializer):
+    class Meta(BaseModelSerializer.Meta):
+        model = Book
+        fields = "__all__"
+        expandable_fields = {
+            "category": CategorySerializer,
+            "reviews": (ReviewSerializer, {"many": True}),
+        }
+
+
+class BookList(BaseListView):
+    model = Book
+    serializer = BookSerializer
+
+
+class BookDetails(BaseDetailsView):
+    model = Book
+    serializer = BookSerializer
+
+
+class BookSearch(BaseSearchView):
+    model = Book
+    serializer = BookSerializer
+
+
+class TagList(BaseListView):
+    model = Tag
+    serializer = TagSerializer
+
+
+class CursorBookList(BookList):
+    pagination_mode = "cursor"
+
+
+class CachedBookList(BookList):
+    cache_responses = True
+
+
+# reads the category of every book with its own query
+def book_categories(request):
+    return JsonResponse({"data": [i.category.name for i in Book.objects.all()]})
+
+
+class CompiledBookList(BookList):
+    compiled_reads = True
+
+
+class AsyncBookList(AsyncBaseListView):
+    model = Book
+    serializer = BookSerializer
+
+
+class AsyncBookDetails(AsyncBaseDetailsView):
+    model = Book
+    serializer = BookSerializer
+
+
+class AsyncBookSearch(AsyncBaseSearchView):
+    model = Book
+    serializer = BookSerializer
+
+
+class Batch(BaseBatchView):
+    views = [BookList, BookDetails, BookSearch]
+
+
+urlpatterns = [
+    path("books/", BookList.as_view()),
+    path("books/<int:obj_id>", BookDetails.as_view()),
+    path("books/search", BookSearch.as_view()),
+    path("tags/", TagList.as_view()),
+    path("cursor-books/", CursorBookList.as_view()),
+    path("cached-books/", CachedBookList.as_view()),
+    path("book-categories/", book_categories),
+    path("compiled-books/", CompiledBookList.as_view()),
+    path("async/books/", AsyncBookList.as_view()),
+    path("async/books/<int:obj_id>", AsyncBookDetails.as_view()),
+    path("async/books/search", AsyncBookSearch.as_view()),
+    path("batch", Batch.as_view()),
+]
+
+
+def setUpModule():
+    with connection.schema_editor() as editor:
+        for model in TEST_MODELS:
+            editor.create_model(model)
+    get_search_backend().install(Book)
+
+
+def tearDownModule():
+    with connection.schema_editor() as editor:
+        for model in reversed(TEST_MODELS):
+            editor.delete_model(model)
+
+
+# stands for the app configs system checks are run for
+class AppConfigStub:
+    def __init__(self, *models):
+        self.models = models
+
+    def get_models(self):
+        return self.models
+
+
+def b64(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@override_settings(ROOT_URLCONF="utilitas.tests")
+class ViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name="root")
+        cls.categories = [
+            Category.objects.create(name=f"c{i}", parent=cls.root) for i in range(3)
+        ]
+        cls.books = []
+        for i in range(12):
+            book = Book.objects.create(
+                title=f"book {i}",
+                body="a hobbit and a dragon" if i % 4 == 0 else "",
+                pages=i * 10,
+                category=cls.categories[i % 3],
+            )
+            Review.objects.create(book=book, stars=i % 5)
+            cls.books.append(book)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def get_stream(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def search(self, body, query=""):
+        return self.client.post(f"/books/search{query}", body, format="json")
+
+
+class ListViewTests(ViewTestCase):
+    def test_page(self):
+        response = self.client.get("/books/?size=5&page=2")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 12)
+        self.assertEqual(data["total_pages"], 3)
+        self.assertEqual(
+            [i["id"] for i in data["data"]], [i.pk for i in self.books[5:10]]
+        )
+
+    def test_sorts(self):
+        response = self.client.get(f"/books/?size=3&sorts={b64(['-pages'])}")
+        self.assertEqual([i["pages"] for i in response.json()["data"]], [110, 100, 90])
+
+    def test_invalid_sorts(self):
+        response = self.client.get(f"/books/?sorts={b64(['nope'])}")
+        self.assertEqual(response.status_code, 400)
+
+    def test_unsorted_pages_keep_the_default_ordering(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", UnorderedObjectListWarning)
+            for url in ["/books/?size=5", "/async/books/?size=5"]:
+                with self.subTest(url=url):
+                    with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(
+                        any(
+                            'ORDER BY "utilitas_test_book"."id"' in i["sql"]
+                            for i in queries
+                        )
+                    )
+
+    def test_details(self):
+        response = self.client.get(f"/books/{self.books[0].pk}")
+        self.assertEqual(response.json()["data"]["title"], "book 0")
+
+
+# The benchmark scenarios create their own tables, which can't be done in a transaction
+# on SQLite
+class BenchmarkTests(TransactionTestCase):
+    def test_query_budgets(self):
+        results = bench_views(rows=60, widths=(5,), fanouts=(1, 3), repeat=1)
+        self.assertEqual(len(results), 18)
+        self.assertEqual(get_budget_failures(results), [])
+
+
+class CsvExportTests(ViewTestCase):
+    def test_csv(self):
+        response = self.client.get(
+            f"/books/?csv=1&fields={b64(['id', 'title', 'category'])}"
+        )
+        self.assertTrue(response.streaming)
+        lines = self.get_stream(response).splitlines()
+        self.assertEqual(lines[0], "id,title,category")
+        self.assertEqual(len(lines), 13)
+        # foreign keys are exported as the pk of the related row
+        self.assertEqual(lines[1], f"{self.books[0].pk},book 0,{self.categories[0].pk}")
+
+    def test_default_fields(self):
+        lines = self.get_stream(self.client.get("/books/?csv=1")).splitlines()
+        self.assertIn("title", lines[0].split(","))
+        self.assertNotIn("category", lines[0].split(","))
+
+    def test_invalid_fields(self):
+        for fields in [["nope"], ["reviews"]]:
+            with self.subTest(fields=fields):
+                response = self.client.get(f"/books/?csv=1&fields={b64(fields)}")
+                self.assertEqual(response.status_code, 400)
+
+
+class CursorPaginationTests(ViewTestCase):
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url).json()
+            ids.extend(i["id"] for i in response["data"])
+            url = response["links"]["next"]
+        return ids
+
+    def test_next_links(self):
+        self.assertEqual(self.walk("/cursor-books/?size=5"), [i.pk for i in self.books])
+        self.assertEqual(
+            self.walk(f"/cursor-books/?size=5&sorts={b64(['-pages'])}"),
+            [i.pk for i in reversed(self.books)],
+        )
+
+    def test_ties_are_broken_by_pk(self):
+        Book.objects.update(pages=1)
+        ids = self.walk(f"/cursor-books/?size=5&sorts={b64(['pages'])}")
+        self.assertEqual(ids, [i.pk for i in self.books])
+
+    def test_previous_link(self):
+        first = self.client.get("/cursor-books/?size=5").json()
+        self.assertIsNone(first["links"]["previous"])
+        second = self.client.get(first["links"]["next"]).json()
+        previous = self.client.get(second["links"]["previous"]).json()
+        self.assertEqual(previous["data"], first["data"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/cursor-books/?cursor=nope")
+        self.assertEqual(response.status_code, 404)
+
+
+class CountStrategyTests(ViewTestCase):
+    def get_page(self, strategy, url="/books/?size=5"):
+        with mock.patch.object(BookList, "count_strategy", strategy):
+            return self.client.get(url).json()
+
+    def test_strategies(self):
+        for strategy, count in [
+            ("exact", 12),
+            ("cached", 12),
+            ("window", 12),
+            ("skip", None),
+        ]:
+            with self.subTest(strategy=strategy):
+                response = self.get_page(strategy)
+                self.assertEqual(response["count"], count)
+                self.assertEqual(response["count_strategy"], strategy)
+                self.assertTrue(response["has_next"])
+                self.assertEqual(len(response["data"]), 5)
+
+    def test_window_count_without_rows(self):
+        with mock.patch.object(BookSearch, "count_strategy", "window"):
+            response = self.client.post(
+                "/books/search",
+                {"filter_params": [{"field_name": "pages", "value": 999}]},
+                format="json",
+            ).json()
+        self.assertEqual(response["count"], 0)
+        self.assertEqual(response["data"], [])
+
+    def test_skip_on_the_last_page(self):
+        response = self.get_page("skip", "/books/?size=5&page=3")
+        self.assertIsNone(response["count"])
+        self.assertFalse(response["has_next"])
+
+    def test_estimated_count(self):
+        # without statistics, the count is exact
+        response = self.get_page("estimated")
+        self.assertEqual(response["count"], 12)
+        self.assertEqual(response["count_strategy"], "exact")
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        response = self.get_page("estimated")
+        self.assertEqual(response["count"], 12)
+        self.assertEqual(response["count_strategy"], "estimated")
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            get_count_strategy("nope")
+
+
+class ProjectionTests(ViewTestCase):
+    def get_page_query(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["data"], queries.captured_queries[-1]["sql"]
+
+    def test_only_the_fields_are_selected(self):
+        data, sql = self.get_page_query(f"/books/?size=3&fields={b64(['title'])}")
+        self.assertEqual(data[0], {"title": "book 0"})
+        self.assertIn('"title"', sql)
+        self.assertNotIn('"body"', sql)
+        self.assertNotIn('"created_at"', sql)
+
+    def test_sorted_and_related_columns_are_selected(self):
+        data, sql = self.get_page_query(
+            f"/books/?size=3&fields={b64(['title', 'category'])}"
+            f"&sorts={b64(['-pages'])}"
+        )
+        self.assertEqual(
+            data[0], {"title": "book 11", "category": self.categories[2].pk}
+        )
+        self.assertIn('"category_id"', sql)
+        self.assertNotIn('"body"', sql)
+
+    def test_details(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"/books/{self.books[0].pk}?fields={b64(['title'])}"
+            )
+        self.assertEqual(response.json()["data"], {"title": "book 0"})
+        self.assertNotIn('"body"', queries.captured_queries[-1]["sql"])
+
+    def test_unknown_fields_select_every_column(self):
+        _, sql = self.get_page_query(f"/books/?size=3&fields={b64(['nope'])}")
+        self.assertIn('"body"', sql)
+
+
+class SchemaTests(TestCase):
+    def test_fields(self):
+        schema = get_schema(Book)
+        self.assertEqual(schema.pk_name, "id")
+        self.assertIn("reviews", schema.filterable_fields)
+        self.assertNotIn("reviews", schema.sortable_fields)
+        self.assertNotIn("reviews", schema.projectable_fields)
+        self.assertIn("category", schema.projectable_fields)
+        self.assertEqual(schema.prefetchable_fields, frozenset(["category", "reviews"]))
+        self.assertEqual(schema.relation_kinds["reviews"], "one_to_many")
+        self.assertIs(schema.related_models["category"], Category)
+        self.assertEqual(schema.field_types["pages"], "IntegerField")
+
+    def test_schemas_are_built_once(self):
+        self.assertIs(get_schema(Book), get_schema(Book))
+        self.assertIs(get_schema(Book()), get_schema(Book))
+
+    def test_plain_fields(self):
+        self.assertEqual(
+            Book.get_fields(Book),
+            ["id", "created_at", "updated_at", "title", "body", "featured"],
+        )
+        self.assertIn("category", Book.get_fields(Book, include_foreign_fields=True))
+
+
+class FilterTests(ViewTestCase):
+    def test_filter_params(self):
+        response = self.search(
+            {
+                "filter_params": [
+                    {"field_name": "pages", "operator": "gte", "value": "50"},
+                    {"field_name": "category", "value": self.categories[0].pk},
+                ]
+            }
+        )
+        self.assertEqual([i["pages"] for i in response.json()["data"]], [60, 90])
+
+    def test_exclude_params(self):
+        response = self.search(
+            {
+                "exclude_params": [
+                    {"field_name": "pages", "operator": "lt", "value": 100}
+                ]
+            }
+        )
+        self.assertEqual(response.json()["count"], 2)
+
+    def test_related_fields_and_transforms(self):
+        response = self.search(
+            {
+                "filter_params": [
+                    {"field_name": "category__name", "value": "c1"},
+                    {
+                        "field_name": "created_at__year",
+                        "value": self.books[0].created_at.year,
+                    },
+                    {"field_name": "pages", "operator": "in", "value": "10,40,50"},
+                ]
+            }
+        )
+        self.assertEqual([i["pages"] for i in response.json()["data"]], [10, 40])
+
+    def test_invalid_filter_params(self):
+        for clause in [
+            {"field_name": "nope", "value": 1},
+            {"field_name": "pages", "value": "x"},
+            {"field_name": "pages", "operator": "icontains", "value": "1"},
+            {"field_name": "featured", "operator": "lt", "value": True},
+            {"field_name": "pages", "operator": "nope", "value": 1},
+            {"field_name": "pages"},
+            {"value": 1},
+            {"field_name": "title", "value": "x" * 1000},
+        ]:
+            with self.subTest(clause=clause):
+                response = self.search({"filter_params": [clause]})
+                self.assertEqual(response.status_code, 400)
+
+    def test_plans_are_cached_by_shape(self):
+        shape = (("pages", "gte"), ("title", "icontains"))
+        self.assertIs(get_filter_plan(Book, shape), get_filter_plan(Book, shape))
+        self.assertEqual(
+            get_filter_plan(Book, shape).apply(["5", 3]),
+            {"pages__gte": 5, "title__icontains": "3"},
+        )
+
+    def test_compile_filter_params(self):
+        self.assertEqual(
+            compile_filter_params(Book, [{"field_name": "featured", "value": "true"}]),
+            {"featured__exact": True},
+        )
+        self.assertEqual(compile_filter_params(Book, []), {})
+
+    def test_body_params(self):
+        clauses = BookSearch().validate_body_params(
+            [{"field_name": "pages", "operator": "in", "value": "10,20"}]
+        )
+        self.assertEqual(
+            clauses, [{"field_name": "pages", "operator": "in", "value": [10, 20]}]
+        )
+        self.assertEqual(BookSearch.build_body_params(clauses), {"pages__in": [10, 20]})
+        self.assertEqual(
+            BookSearch.build_filter_params(
+                [{"field_name": "title", "operator": "in", "value": "a,b"}]
+            ),
+            {"title__in": ["a", "b"]},
+        )
+
+    def test_values_that_are_not_scalars(self):
+        for clause in [
+            {"field_name": "featured", "value": [1]},
+            {"field_name": "featured", "value": {"a": 1}},
+            {"field_name": "created_at", "operator": "gt", "value": {"a": 1}},
+            {"field_name": "created_at", "operator": "gt", "value": [1]},
+            {"field_name": "pages", "operator": "in", "value": [[1]]},
+            {"field_name": "pages", "operator": "in", "value": [{"a": 1}]},
+            {"field_name": "created_at__year", "value": {"a": 1}},
+            {"field_name": "category__name", "value": ["c1"]},
+        ]:
+            with self.subTest(clause=clause):
+                response = self.search({"filter_params": [clause]})
+                self.assertEqual(response.status_code, 400)
+                response = self.search({"filter_params": {"or": [clause]}})
+                self.assertEqual(response.status_code, 400)
+
+    def test_values_the_fields_cant_convert(self):
+        for clause in [
+            {"field_name": "created_at", "operator": "gt", "value": 10**30},
+            {"field_name": "pages", "value": 1.5},
+            {"field_name": "pages", "value": "9" * 30},
+        ]:
+            with self.subTest(clause=clause):
+                response = self.search({"filter_params": [clause]})
+                self.assertLess(response.status_code, 500)
+
+
+class ResponseCacheTests(ViewTestCase):
+    def test_etag_revalidation(self):
+        response = self.client.get("/cached-books/?size=3")
+        etag = response["ETag"]
+        response = self.client.get("/cached-books/?size=3", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.books[0].title = "changed"
+        self.books[0].save()
+        response = self.client.get("/cached-books/?size=3", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"][0]["title"], "changed")
+
+    def test_cached_responses_run_no_queries(self):
+        self.client.get("/cached-books/?size=3")
+        with self.assertNumQueries(0):
+            response = self.client.get("/cached-books/?size=3")
+        self.assertEqual(len(response.json()["data"]), 3)
+        # other query params are other responses
+        response = self.client.get("/cached-books/?size=4")
+        self.assertEqual(len(response.json()["data"]), 4)
+
+    def test_queryset_writes_invalidate(self):
+        self.client.get("/cached-books/?size=3")
+        Book.objects.filter(pk=self.books[0].pk).update(title="updated")
+        response = self.client.get("/cached-books/?size=3")
+        self.assertEqual(response.json()["data"][0]["title"], "updated")
+
+    def test_expanded_models_invalidate(self):
+        url = f"/cached-books/?size=3&expand={b64(['category'])}"
+        self.client.get(url)
+        self.categories[0].name = "renamed"
+        self.categories[0].save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()["data"][0]["category"]["name"], "renamed")
+
+    def test_writes_invalidate_again_on_commit(self):
+        before = get_model_version(Book)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Book.objects.filter(pk=self.books[0].pk).update(title="updated")
+            during = get_model_version(Book)
+        self.assertEqual(len(callbacks), 1)
+        self.assertGreater(during, before)
+        # responses cached before the commit hold the rows as they were
+        self.assertGreater(get_model_version(Book), during)
+
+    def test_lru_cache_bounds(self):
+        cache = LRUCache(max_entries=2, max_bytes=10)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        cache.get("a")
+        cache.set("c", b"1234")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"1234")
+        cache.set("d", b"12345678")
+        self.assertEqual(cache.size, 8)
+        cache.set("e", b"x" * 11)
+        self.assertIsNone(cache.get("e"))
+
+    def test_lru_versions_dont_start_over(self):
+        cache = LRUCache()
+        version = cache.get_version("utilitas.Book")
+        self.assertGreater(version, 0)
+        self.assertEqual(cache.bump_version("utilitas.Book"), version + 1)
+        # a restarted process doesn't give out the versions of the previous one
+        self.assertGreater(LRUCache().get_version("utilitas.Book"), version + 1)
+
+    def test_etags_change_after_a_restart(self):
+        etag = self.client.get("/cached-books/?size=3")["ETag"]
+        with mock.patch("utilitas.cache._response_cache", LRUCache()):
+            response = self.client.get("/cached-books/?size=3", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class BulkTests(ViewTestCase):
+    def test_bulk_create(self):
+        objects = [
+            {"title": "new 1", "category": self.categories[0].pk},
+            {"title": "new 2", "category": self.categories[1].pk},
+            {"title": "new 3", "category": self.categories[0].pk},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/books/?bulk=1", {"objects": objects}, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["data"]), 3)
+        self.assertEqual(Book.objects.filter(title__startswith="new").count(), 3)
+        # the categories of every row are fetched with one query
+        selects = [i for i in queries if "utilitas_test_category" in i["sql"]]
+        self.assertEqual(len(selects), 1)
+
+    def test_bulk_create_invalid_rows(self):
+        for objects in [
+            [{"title": "a", "category": 999999}],
+            [{"title": "a"}, {"title": "x" * 1000}],
+        ]:
+            with self.subTest(objects=objects):
+                response = self.client.post(
+                    "/books/?bulk=1", {"objects": objects}, format="json"
+                )
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(Book.objects.filter(title="a").exists())
+
+    def test_bulk_update(self):
+        objects = [
+            {"id": self.books[0].pk, "title": "x"},
+            {"id": self.books[1].pk, "pages": 999},
+        ]
+        response = self.client.patch(
+            "/books/?bulk=1", {"objects": objects}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).title, "x")
+        self.assertEqual(Book.objects.get(pk=self.books[1].pk).pages, 999)
+        # the fields that weren't sent are left as they were
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).pages, 0)
+
+    def test_bulk_update_errors(self):
+        for objects, status in [
+            ([{"id": 999999, "title": "x"}], 404),
+            ([{"title": "x"}], 400),
+            ([{"id": self.books[0].pk, "pages": "x"}], 400),
+        ]:
+            with self.subTest(objects=objects):
+                response = self.client.patch(
+                    "/books/?bulk=1", {"objects": objects}, format="json"
+                )
+                self.assertEqual(response.status_code, status)
+        self.assertEqual(Book.objects.get(pk=self.books[0].pk).title, "book 0")
+
+    def test_bulk_update_of_a_field_that_isnt_a_column(self):
+        class NotedTagSerializer(TagSerializer):
+            note = serializers.CharField(required=False)
+
+            class Meta(TagSerializer.Meta):
+                fields = ["id", "label", "note"]
+
+        tag = Tag.objects.create(label="a")
+        with mock.patch.object(TagList, "serializer", NotedTagSerializer):
+            response = self.client.patch(
+                "/tags/?bulk=1",
+                {"objects": [{"id": tag.pk, "note": "x"}]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_delete(self):
+        ids = [self.books[0].pk, self.books[1].pk]
+        response = self.client.delete("/books/?bulk=1", {"ids": ids}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Book.objects.filter(pk__in=ids).exists())
+
+        response = self.client.delete(
+            "/books/?bulk=1",
+            {
+                "filter_params": [
+                    {"field_name": "pages", "operator": "gte", "value": 100}
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Book.objects.count(), 8)
+
+    def test_bulk_delete_needs_a_selection(self):
+        response = self.client.delete("/books/?bulk=1", {}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Book.objects.count(), 12)
+
+    def test_upsert(self):
+        Tag.objects.create(label="old")
+        response = self.client.post(
+            "/tags/?bulk=1&upsert=1",
+            {
+                "unique_fields": ["label"],
+                "objects": [{"label": "old"}, {"label": "new"}],
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            sorted(Tag.objects.values_list("label", flat=True)), ["new", "old"]
+        )
+
+    def test_upsert_options(self):
+        for body in [
+            {"objects": [{"label": "a"}]},
+            {"unique_fields": ["nope"], "objects": [{"label": "a"}]},
+            {"unique_fields": ["label"], "update_fields": "x", "objects": []},
+        ]:
+            with self.subTest(body=body):
+                response = self.client.post(
+                    "/tags/?bulk=1&upsert=1", body, format="json"
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_upsert_returns_the_stored_rows(self):
+        old = Tag.objects.create(label="old")
+        Tag.objects.filter(pk=old.pk).update(
+            created_at=old.created_at - datetime.timedelta(days=1)
+        )
+        old.refresh_from_db()
+        response = self.client.post(
+            "/tags/?bulk=1&upsert=1",
+            {
+                "unique_fields": ["label"],
+                "objects": [{"label": "new"}, {"label": "old"}],
+            },
+            format="json",
+        )
+        data = response.json()["data"]
+        self.assertEqual([i["label"] for i in data], ["new", "old"])
+        self.assertEqual(data[1]["id"], old.pk)
+        self.assertEqual(data[1]["created_at"], TagSerializer(old).data["created_at"])
+        self.assertIsNotNone(data[0]["id"])
+
+
+class ChosenOneTests(ViewTestCase):
+    def get_featured(self):
+        return list(Book.objects.filter(featured=True).values_list("title", flat=True))
+
+    def test_save(self):
+        first, second = self.books[0], self.books[1]
+        first.featured = True
+        first.save()
+        second.featured = True
+        second.save()
+        self.assertEqual(self.get_featured(), ["book 1"])
+
+    def test_bulk_create(self):
+        self.books[0].featured = True
+        self.books[0].save()
+        self.client.post(
+            "/books/?bulk=1",
+            {
+                "objects": [
+                    {"title": "a", "featured": True},
+                    {"title": "b", "featured": True},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(self.get_featured(), ["b"])
+
+    def test_bulk_update(self):
+        self.books[0].featured = True
+        self.books[0].save()
+        self.client.patch(
+            "/books/?bulk=1",
+            {"objects": [{"id": self.books[1].pk, "featured": True}]},
+            format="json",
+        )
+        self.assertEqual(self.get_featured(), ["book 1"])
+
+    def test_queryset_update(self):
+        with self.assertRaises(ValueError):
+            Book.objects.all().update(featured=True)
+        Book.objects.filter(pk=self.books[2].pk).update(featured=True)
+        Book.objects.filter(pk=self.books[3].pk).update(featured=True)
+        self.assertEqual(self.get_featured(), ["book 3"])
+
+    def test_queryset_update_without_rows(self):
+        Book.objects.filter(pk=self.books[2].pk).update(featured=True)
+        self.assertEqual(Book.objects.filter(pk=999999).update(featured=True), 0)
+        self.assertEqual(self.get_featured(), ["book 2"])
+
+
+class HydrationTests(TestCase):
+    def test_rows_are_hydrated_by_django(self):
+        self.assertIs(Book.__init__, models.Model.__init__)
+        with self.assertNumQueries(0):
+            book = Book.from_db("default", ["id", "title", "featured"], (1, "a", True))
+        self.assertTrue(book.featured)
+
+    @isolate_apps("utilitas")
+    def test_chosen_one_fields_check(self):
+        class Valid(BaseModel):
+            default = models.BooleanField(default=False)
+            chosen_one_fields = ["default"]
+
+        class Missing(BaseModel):
+            chosen_one_fields = ["default"]
+
+        class NotBoolean(BaseModel):
+            default = models.IntegerField(default=0)
+            chosen_one_fields = ["default"]
+
+        errors = check_chosen_one_fields([AppConfigStub(Valid, Missing, NotBoolean)])
+        self.assertEqual(
+            [(i.id, i.obj) for i in errors],
+            [("utilitas.E001", Missing), ("utilitas.E002", NotBoolean)],
+        )
+
+
+@override_settings(
+    MIDDLEWARE=["utilitas.middlewares.QueryInstrumentationMiddleware"],
+    UTILITAS_QUERY_INSTRUMENTATION={"LOG_THRESHOLD_MS": 10000},
+)
+class QueryInstrumentationTests(ViewTestCase):
+    def test_server_timing(self):
+        response = self.client.get("/books/?size=5")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="2 queries"$')
+
+    def test_n_plus_one(self):
+        with self.assertLogs("utilitas.queries", "WARNING") as logs:
+            response = self.client.get("/book-categories/")
+        self.assertIn('desc="13 queries"', response["Server-Timing"])
+        record = logs.records[0].query_instrumentation
+        self.assertEqual(record["path"], "/book-categories/")
+        self.assertEqual(record["queries"], 13)
+        self.assertEqual(len(record["n_plus_one"]), 1)
+        self.assertEqual(record["n_plus_one"][0]["count"], 12)
+        self.assertEqual(len(record["slowest"]), 5)
+
+    def test_requests_under_the_thresholds_arent_logged(self):
+        with self.assertNoLogs("utilitas.queries"):
+            self.client.get(f"/books/?size=5&expand={b64(['category'])}")
+
+    @override_settings(
+        UTILITAS_QUERY_INSTRUMENTATION={
+            "LOG_THRESHOLD_QUERIES": 1,
+            "ENDPOINTS": {"/books/": {"LOG_THRESHOLD_QUERIES": 100}},
+        }
+    )
+    def test_endpoint_settings(self):
+        with self.assertNoLogs("utilitas.queries"):
+            self.client.get("/books/?size=5")
+        with self.assertLogs("utilitas.queries", "INFO"):
+            self.client.get("/tags/")
+
+    @override_settings(UTILITAS_QUERY_INSTRUMENTATION={"SAMPLE_RATE": 0})
+    def test_sampling(self):
+        response = self.client.get("/books/?size=5")
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_query_shapes(self):
+        recorder = QueryRecorder()
+        self.assertEqual(
+            recorder.get_shape(
+                "SELECT * FROM t WHERE a = 12 AND b = 'it''s' AND c IN (%s, %s, %s)"
+            ),
+            "SELECT * FROM t WHERE a = %s AND b = %s AND c IN (%s, ...)",
+        )
+
+
+@unittest.skipIf(get_fast_encoder() is None, "orjson isn't installed")
+class FastRendererTests(ViewTestCase):
+    def render(self, data, fast=True, media_type="application/json"):
+        renderer = CustomRenderer()
+        if not fast:
+            renderer.fast_encoder = None
+        return renderer.render(data, media_type)
+
+    def assertSameBytes(self, data):
+        self.assertEqual(self.render(dict(data)), self.render(dict(data), fast=False))
+
+    def test_same_bytes_as_the_json_renderer(self):
+        utc = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456, datetime.timezone.utc)
+        for data in [
+            {"int": 1, "big": 2**70, "bool": True, "none": None, "list": [1, [2, {}]]},
+            {"text": 'é ☃ "quoted" \\ \n \t \x00     😀'},
+            {"floats": [0.1, 1.5, -2.0, 1e15, 1e16, 1e20, 1e-7, 123456789.123]},
+            {
+                "utc": utc,
+                "offset": utc.astimezone(zoneinfo.ZoneInfo("America/Chicago")),
+                "naive": utc.replace(tzinfo=None),
+                "seconds": utc.replace(microsecond=0),
+                "date": utc.date(),
+                "time": utc.time(),
+                "duration": datetime.timedelta(days=1, seconds=5),
+            },
+            {
+                "decimal": decimal.Decimal("1.10"),
+                "uuid": uuid.UUID(int=1),
+                "lazy": gettext_lazy("lazy"),
+                "keys": {1: "int key", True: "bool key"},
+                "tuple": (1, 2),
+                "set": {1},
+            },
+        ]:
+            with self.subTest(data=data):
+                self.assertSameBytes(data)
+
+    def test_serialized_pages(self):
+        data = {"data": BookSerializer(self.books, many=True, expand=["category"]).data}
+        self.assertIsNotNone(get_fast_encoder()(dict(data)))
+        self.assertSameBytes(data)
+
+    def test_native_datetimes(self):
+        class NativeBookSerializer(BookSerializer):
+            native_datetimes = True
+
+        data = NativeBookSerializer(self.books, many=True).data
+        self.assertIsInstance(data[0]["created_at"], datetime.datetime)
+        self.assertEqual(
+            self.render({"data": data}),
+            self.render(
+                {"data": BookSerializer(self.books, many=True).data}, fast=False
+            ),
+        )
+
+    def test_indented_output_uses_the_json_renderer(self):
+        with mock.patch.object(CustomRenderer, "fast_encoder") as encoder:
+            self.render({"a": 1}, media_type="application/json; indent=2")
+        encoder.assert_not_called()
+
+
+class CompiledReadTests(ViewTestCase):
+    def compare(self, fields):
+        reader = get_compiled_reader(BookSerializer, Book, fields)
+        self.assertIsNotNone(reader)
+        books = Book.objects.order_by("pk")
+        compiled = CompiledSerializer(reader, books.values_list(*reader.columns)).data
+        self.assertEqual(compiled, BookSerializer(books, many=True, fields=fields).data)
+
+    def test_same_output_as_the_serializer(self):
+        Book.objects.create(title="no category", category=None)
+        for fields in [
+            [],
+            ["id", "title"],
+            ["category", "created_at", "featured", "pages"],
+            ["title", "nope"],
+        ]:
+            with self.subTest(fields=fields):
+                self.compare(fields)
+
+    def test_pages(self):
+        for query in [
+            "size=5",
+            f"size=5&page=2&fields={b64(['id', 'category'])}&sorts={b64(['-pages'])}",
+        ]:
+            with self.subTest(query=query):
+                with self.assertNumQueries(2):
+                    compiled = self.client.get(f"/compiled-books/?{query}").json()
+                regular = self.client.get(f"/books/?{query}").json()
+                self.assertEqual(compiled["data"], regular["data"])
+                self.assertEqual(compiled["count"], regular["count"])
+
+    def test_fallbacks(self):
+        class MethodSerializer(BookSerializer):
+            upper = serializers.SerializerMethodField()
+
+            def get_upper(self, obj):
+                return obj.title.upper()
+
+        class RepresentationSerializer(BookSerializer):
+            def to_representation(self, instance):
+                return {"id": instance.pk}
+
+        self.assertIsNone(compile_reader(BookSerializer, Book, expand=["category"]))
+        self.assertIsNone(compile_reader(MethodSerializer, Book))
+        self.assertIsNotNone(compile_reader(MethodSerializer, Book, ["id"]))
+        self.assertIsNone(compile_reader(RepresentationSerializer, Book))
+
+    def test_expand_uses_the_serializer(self):
+        url = f"/compiled-books/?size=5&expand={b64(['category'])}"
+        response = self.client.get(url).json()
+        self.assertEqual(response["data"][0]["category"]["name"], "c0")
+
+    def test_readers_cache_is_bounded(self):
+        maxsize = _get_compiled_reader.cache_info().maxsize
+        for i in range(maxsize + 10):
+            get_compiled_reader(BookSerializer, Book, ["id", f"field_{i}"])
+        self.assertEqual(_get_compiled_reader.cache_info().currsize, maxsize)
+
+
+class AsyncViewTests(ViewTestCase):
+    async def test_list(self):
+        response = await self.async_client.get("/async/books/?size=5")
+        data = response.json()
+        self.assertEqual(data["count"], 12)
+        self.assertEqual(
+            [i["id"] for i in data["data"]], [i.pk for i in self.books[:5]]
+        )
+
+    async def test_same_output_as_the_sync_views(self):
+        for query in [
+            f"size=3&fields={b64(['id', 'title'])}&sorts={b64(['-pages'])}",
+            f"size=3&expand={b64(['category.parent', 'reviews'])}",
+        ]:
+            with self.subTest(query=query):
+                response = await self.async_client.get(f"/async/books/?{query}")
+                expected = await self.async_client.get(f"/books/?{query}")
+                self.assertEqual(response.json()["data"], expected.json()["data"])
+
+    async def test_count_strategies(self):
+        for strategy in ["window", "skip", "cached", "estimated"]:
+            with self.subTest(strategy=strategy):
+                with mock.patch.object(AsyncBookList, "count_strategy", strategy):
+                    response = await self.async_client.get("/async/books/?size=5")
+                self.assertEqual(len(response.json()["data"]), 5)
+
+    async def test_estimated_count(self):
+        count = await EstimatedCount().acount(Book.objects.all())
+        self.assertEqual(count, (12, "exact"))
+
+    async def test_details(self):
+        response = await self.async_client.get(
+            f"/async/books/{self.books[0].pk}?expand={b64(['category.parent'])}"
+        )
+        self.assertEqual(response.json()["data"]["category"]["parent"]["name"], "root")
+        response = await self.async_client.get("/async/books/999999")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_search(self):
+        response = await self.async_client.post(
+            "/async/books/search",
+            {"filter_params": [{"field_name": "pages", "value": 10}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["data"][0]["id"], self.books[1].pk)
+
+    async def test_csv(self):
+        response = await self.async_client.get(
+            f"/async/books/?csv=1&fields={b64(['id'])}"
+        )
+        lines = b"".join([i async for i in response.streaming_content]).splitlines()
+        self.assertEqual(len(lines), 13)
+        response = await self.async_client.get(
+            f"/async/books/?csv=1&fields={b64(['reviews'])}"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_writes(self):
+        response = await self.async_client.post(
+            "/async/books/?bulk=1",
+            {"objects": [{"title": "async"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Book.objects.filter(title="async").aexists())
+
+
+class SerializationMemoTests(ViewTestCase):
+    def serialize(self, serializer_class=BookSerializer, **kwargs):
+        books = Book.objects.select_related("category__parent").order_by("pk")
+        to_representation = FlexFieldsModelSerializer.to_representation
+        with mock.patch.object(
+            FlexFieldsModelSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=to_representation,
+        ) as calls:
+            data = serializer_class(books, many=True, **kwargs).data
+        categories = [
+            i for i in calls.call_args_list if isinstance(i.args[1], Category)
+        ]
+        return data, len(categories)
+
+    def test_nested_objects_are_serialized_once(self):
+        data, count = self.serialize(expand=["category"])
+        self.assertEqual(count, 3)
+        self.assertIs(data[0]["category"], data[3]["category"])
+        self.assertEqual(data[1]["category"]["name"], "c1")
+
+    def test_nested_fields(self):
+        data, count = self.serialize(
+            expand=["category.parent"],
+            fields=["id", "category.name", "category.parent"],
+        )
+        # the three categories and their parent, which is serialized with all its fields
+        self.assertEqual(count, 4)
+        self.assertEqual(data[0]["category"]["name"], "c0")
+        self.assertEqual(data[0]["category"]["parent"]["name"], "root")
+        self.assertIn("created_at", data[0]["category"]["parent"])
+        self.assertNotIn("created_at", data[0]["category"])
+
+    def test_memo_is_per_response(self):
+        first, _ = self.serialize(expand=["category"])
+        second, _ = self.serialize(expand=["category"])
+        self.assertIsNot(first[0]["category"], second[0]["category"])
+
+    def test_memo_can_be_turned_off(self):
+        class UnmemoizedCategorySerializer(CategorySerializer):
+            memoize_nested = False
+
+        class UnmemoizedBookSerializer(BookSerializer):
+            class Meta(BookSerializer.Meta):
+                expandable_fields = {"category": UnmemoizedCategorySerializer}
+
+        data, count = self.serialize(UnmemoizedBookSerializer, expand=["category"])
+        self.assertEqual(count, 12)
+        self.assertEqual(data[0]["category"], data[3]["category"])
+
+
+class ImportTests(ViewTestCase):
+    def import_rows(self, body, content_type="application/x-ndjson", query=""):
+        return self.client.post(
+            f"/tags/?import=1{query}", body, content_type=content_type
+        )
+
+    def test_ndjson(self):
+        Tag.objects.create(label="taken")
+        rows = [{"label": "a"}, {"label": "taken"}, {}, {"label": "b"}, {"label": "a"}]
+        body = "\n".join(json.dumps(i) for i in rows) + "\nnot json\n\n"
+        response = self.import_rows(body)
+        self.assertEqual(response.status_code, 201)
+        report = response.json()["data"]
+        self.assertEqual(report["accepted"], 2)
+        self.assertEqual(report["rejected"], 4)
+        # each row gets its own error, the valid rows of the chunk are kept
+        self.assertEqual([i["line"] for i in report["errors"]], [2, 3, 5, 6])
+        self.assertEqual(
+            sorted(Tag.objects.values_list("label", flat=True)), ["a", "b", "taken"]
+        )
+
+    def test_chunks(self):
+        body = "\n".join(json.dumps({"label": f"t{i}"}) for i in range(25))
+        with mock.patch.object(TagList, "import_chunk_size", 10):
+            response = self.import_rows(body + '\n{"label": "t3"}')
+        report = response.json()["data"]
+        self.assertEqual(report["accepted"], 25)
+        self.assertEqual([i["line"] for i in report["errors"]], [26])
+
+    def test_atomic(self):
+        response = self.import_rows('{"label": "a"}\n{}\n', query="&atomic=1")
+        self.assertTrue(response.json()["data"]["rolled_back"])
+        self.assertFalse(Tag.objects.exists())
+
+    def test_csv(self):
+        response = self.import_rows("label\nx\ny\n\n", content_type="text/csv")
+        self.assertEqual(response.json()["data"]["accepted"], 2)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_unsupported_content_type(self):
+        response = self.import_rows("label: x", content_type="text/yaml")
+        self.assertEqual(response.status_code, 415)
+
+
+class AggregationTests(ViewTestCase):
+    def test_group_by(self):
+        response = self.search(
+            {
+                "filter_params": [
+                    {"field_name": "pages", "operator": "lt", "value": 60}
+                ],
+                "group_by": ["category"],
+                "aggregates": [
+                    {"function": "count"},
+                    {"function": "sum", "field_name": "pages", "alias": "total"},
+                ],
+                "order_by": ["category"],
+            },
+            "?aggregate=1",
+        )
+        self.assertEqual(
+            response.json()["data"],
+            [
+                {"category": self.categories[0].pk, "count": 2, "total": 30},
+                {"category": self.categories[1].pk, "count": 2, "total": 50},
+                {"category": self.categories[2].pk, "count": 2, "total": 70},
+            ],
+        )
+
+    def test_without_group_by(self):
+        response = self.search(
+            {"aggregates": [{"function": "max", "field_name": "pages"}]}, "?aggregate=1"
+        )
+        self.assertEqual(response.json()["data"], [{"pages__max": 110}])
+
+    def test_invalid_aggregation(self):
+        for body in [
+            {"aggregates": [{"function": "median"}]},
+            {"aggregates": [{"function": "sum", "field_name": "nope"}]},
+        ]:
+            with self.subTest(body=body):
+                response = self.search(body, "?aggregate=1")
+                self.assertEqual(response.status_code, 400)
+
+    async def test_async(self):
+        response = await self.async_client.post(
+            "/async/books/search?aggregate=1",
+            {"aggregates": [{"function": "count"}]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.json()["data"], [{"count": 12}])
+
+
+class DetailsViewTests(ViewTestCase):
+    def test_not_found(self):
+        response = self.client.get("/books/999999")
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional_get(self):
+        book = self.books[0]
+        response = self.client.get(f"/books/{book.pk}")
+        response = self.client.get(
+            f"/books/{book.pk}", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_put(self):
+        book = self.books[0]
+        etag = self.client.get(f"/books/{book.pk}")["ETag"]
+        response = self.client.put(
+            f"/books/{book.pk}", {"title": "first"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        # the object changed since the etag was read
+        response = self.client.put(
+            f"/books/{book.pk}", {"title": "second"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 412)
+        book.refresh_from_db()
+        self.assertEqual(book.title, "first")
+
+    def test_put_only_writes_changed_columns(self):
+        book = self.books[0]
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(f"/books/{book.pk}", {"pages": 7}, format="json")
+        updates = [i["sql"] for i in queries if i["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"pages"', updates[0])
+        self.assertNotIn('"title"', updates[0])
+
+    def test_put_without_changes(self):
+        book = self.books[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(
+                f"/books/{book.pk}", {"title": book.title}, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([i for i in queries if i["sql"].startswith("UPDATE")])
+
+    def test_delete(self):
+        book = self.books[0]
+        response = self.client.delete(f"/books/{book.pk}")
+        self.assertLess(response.status_code, 300)
+        self.assertFalse(Book.objects.filter(pk=book.pk).exists())
+
+
+class MultiGetTests(ViewTestCase):
+    def test_ids(self):
+        ids = [self.books[3].pk, self.books[1].pk, 999999]
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/books/?ids={b64(ids)}")
+        data = response.json()
+        # in the order of the ids, the ones that don't exist are reported
+        self.assertEqual([i["id"] for i in data["data"]], ids[:2])
+        self.assertEqual(data["missing"], [999999])
+
+    def test_invalid_ids(self):
+        for ids in ["nope", ["a"], {"id": 1}]:
+            with self.subTest(ids=ids):
+                response = self.client.get(f"/books/?ids={b64(ids)}")
+                self.assertEqual(response.status_code, 400)
+
+
+class FullTextSearchTests(ViewTestCase):
+    def test_search(self):
+        response = self.search({"search": "dragon hobbit"})
+        self.assertEqual(
+            sorted(i["id"] for i in response.json()["data"]),
+            [self.books[0].pk, self.books[4].pk, self.books[8].pk],
+        )
+
+    def test_search_with_filters(self):
+        response = self.search(
+            {
+                "search": "dragon",
+                "filter_params": [
+                    {"field_name": "pages", "operator": "gt", "value": 0}
+                ],
+            }
+        )
+        self.assertEqual(
+            sorted(i["id"] for i in response.json()["data"]),
+            [self.books[4].pk, self.books[8].pk],
+        )
+
+    def test_search_follows_writes(self):
+        book = self.books[1]
+        book.body = "a dragon"
+        book.save()
+        self.books[0].delete()
+        response = self.search({"search": "dragon"})
+        ids = [i["id"] for i in response.json()["data"]]
+        self.assertIn(book.pk, ids)
+        self.assertNotIn(self.books[0].pk, ids)
+
+    def test_invalid_search(self):
+        for search in ["x" * 1000, ["dragon"]]:
+            with self.subTest(search=search):
+                response = self.search({"search": search})
+                self.assertEqual(response.status_code, 400)
+
+    @isolate_apps("utilitas")
+    def test_searchable_fields_check(self):
+        class Valid(BaseModel):
+            name = models.CharField(max_length=10)
+            searchable_fields = ["name"]
+
+        class Missing(BaseModel):
+            searchable_fields = ["name"]
+
+        class NotText(BaseModel):
+            size = models.IntegerField(default=0)
+            searchable_fields = ["size"]
+
+        errors = check_searchable_fields([AppConfigStub(Valid, Missing, NotText)])
+        self.assertEqual(
+            [(i.id, i.obj) for i in errors],
+            [("utilitas.E003", Missing), ("utilitas.E004", NotText)],
+        )
+
+
+class IndexAdvisorTests(TestCase):
+    def test_suggested_columns(self):
+        shape = QueryShape(
+            Book, ["category__exact", "featured__exact", "pages__gt"], ["-created_at"]
+        )
+        self.assertEqual(
+            suggest_index_fields(shape, "id"), ["category", "created_at", "pages"]
+        )
+
+    def test_text_columns_are_not_suggested(self):
+        shape = QueryShape(Book, ["body__exact"])
+        self.assertEqual(suggest_index_fields(shape, "id"), [])
+
+    def test_read_logged_shapes(self):
+        record = json.dumps(
+            {"model": "utilitas.Book", "filters": ["pages__gt"], "sorts": []}
+        )
+        other = json.dumps({"model": "utilitas.Tag", "filters": [], "sorts": []})
+        lines = [f"INFO {record}", f"INFO {record}", "garbage", f"INFO {record[:-2]}"]
+        shapes = read_logged_shapes([*lines, other], {"utilitas.Book": Book})
+        self.assertEqual(len(shapes), 1)
+        self.assertEqual(shapes[0].count, 2)
+        self.assertEqual(shapes[0].filters, ("pages__gt",))
+
+    def test_min_count(self):
+        record = json.dumps({"model": "utilitas.Book", "filters": [], "sorts": []})
+        shapes = read_logged_shapes([record], {"utilitas.Book": Book}, min_count=2)
+        self.assertEqual(shapes, [])
+
+    def test_advise(self):
+        shapes = [
+            QueryShape(Book, ["pages__exact"], ["title"], count=3, source="logs"),
+            QueryShape(
+                Book, ["pages__exact"], ["title", "-created_at"], count=2, source="logs"
+            ),
+            # made up from the fields, reported only
+            QueryShape(Book, ["title__exact"]),
+        ]
+        reports, suggestions = advise(shapes)
+        self.assertEqual(len(reports), 3)
+        self.assertTrue(all(i.problems for i in reports))
+        # the narrower index is served by the wider one
+        self.assertEqual(
+            [i.fields for i in suggestions], [("pages", "title", "created_at")]
+        )
+        self.assertEqual(suggestions[0].count, 5)
+
+    def test_shape_queryset(self):
+        queryset = get_shape_queryset(QueryShape(Book, ["category__in"], ["-pages"]))
+        self.assertEqual(queryset.query.order_by, ("-pages",))
+        self.assertEqual(queryset.query.high_mark, 50)
+
+    @isolate_apps("utilitas")
+    def test_ordering_indexes_check(self):
+        class Indexed(BaseModel):
+            pass
+
+        class Unindexed(BaseModel):
+            rank = models.IntegerField(default=0)
+
+            class Meta:
+                ordering = ["-rank", "id"]
+
+        class WithIndex(BaseModel):
+            rank = models.IntegerField(default=0)
+
+            class Meta:
+                ordering = ["rank"]
+                indexes = [models.Index(fields=["rank", "id"], name="rank_idx")]
+
+        warnings = check_ordering_indexes(
+            [AppConfigStub(Indexed, Unindexed, WithIndex)]
+        )
+        self.assertEqual(
+            [(i.id, i.obj) for i in warnings], [("utilitas.W001", Unindexed)]
+        )
+
+    def add_meta_indexes(self, meta):
+        source = f"from django.db import models\n\n\nclass Book(models.Model):\n{meta}"
+        index = models.Index(fields=["pages", "id"], name="book_pages_idx")
+        source = add_meta_indexes(source, "Book", [index])
+        return source and source.split("models.Model):\n", 1)[1]
+
+    def test_add_meta_indexes(self):
+        added = (
+            '            models.Index(fields=["pages", "id"], name="book_pages_idx"),\n'
+        )
+        cases = [
+            (
+                "    class Meta:\n        ordering = ['id']\n",
+                "    class Meta:\n        ordering = ['id']\n"
+                f"        indexes = [\n{added}        ]\n",
+            ),
+            (
+                "    class Meta:\n        indexes = []  # kept\n",
+                f"    class Meta:\n        indexes = [\n{added}        ]  # kept\n",
+            ),
+            (
+                '    class Meta:\n        indexes = [models.Index(fields=["a"], name="a")]\n',
+                "    class Meta:\n        indexes = [\n"
+                '            models.Index(fields=["a"], name="a"),\n'
+                f"{added}        ]\n",
+            ),
+            (
+                "    class Meta:\n        indexes = [\n"
+                '            models.Index(fields=["a"], name="a")\n        ]\n',
+                "    class Meta:\n        indexes = [\n"
+                '            models.Index(fields=["a"], name="a"),\n'
+                f"{added}        ]\n",
+            ),
+            (
+                f"    class Meta:\n        indexes = [\n{added}        ]\n",
+                f"    class Meta:\n        indexes = [\n{added}        ]\n",
+            ),
+        ]
+        for meta, expected in cases:
+            with self.subTest(meta=meta):
+                self.assertEqual(self.add_meta_indexes(meta), expected)
+
+    def test_meta_indexes_that_cant_be_added(self):
+        for source in [
+            "    pass\n",
+            "    class Meta:\n        indexes = BaseModel.Meta.indexes\n",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(self.add_meta_indexes(source))
+        source = (
+            "from django.db.models import Model\n\n\n"
+            "class Book(Model):\n    class Meta:\n        pass\n"
+        )
+        self.assertIsNone(add_meta_indexes(source, "Book", []))
+
+
+class FilterExpressionTests(ViewTestCase):
+    def test_groups(self):
+        with self.assertNumQueries(2):
+            response = self.search(
+                {
+                    "filter_params": {
+                        "or": [
+                            {"field_name": "pages", "value": 0},
+                            {
+                                "and": [
+                                    {
+                                        "field_name": "pages",
+                                        "operator": "gte",
+                                        "value": 100,
+                                    },
+                                    {"not": {"field_name": "pages", "value": 110}},
+                                ]
+                            },
+                        ]
+                    }
+                }
+            )
+        self.assertEqual([i["pages"] for i in response.json()["data"]], [0, 100])
+
+    def test_exclude_expression(self):
+        response = self.search(
+            {
+                "exclude_params": {
+                    "or": [
+                        {"field_name": "pages", "operator": "lt", "value": 90},
+                        {"field_name": "featured", "value": True},
+                    ]
+                }
+            }
+        )
+        self.assertEqual([i["pages"] for i in response.json()["data"]], [90, 100, 110])
+
+    def test_errors_have_the_path_of_the_expression(self):
+        for expression, path in [
+            ({"or": [{"field_name": "pages", "value": 0}, {"and": []}]}, "or.1"),
+            ({"not": {"field_name": "nope", "value": 0}}, None),
+            ({"and": [{"field_name": "pages", "value": "x"}]}, "and.0"),
+            ({"or": [], "and": []}, ""),
+        ]:
+            with self.subTest(expression=expression):
+                response = self.search({"filter_params": expression})
+                self.assertEqual(response.status_code, 400)
+                if path is not None:
+                    self.assertIn(
+                        f"filter_params.{path}".rstrip("."), response.json()["details"]
+                    )
+
+    def test_limits(self):
+        deep = {"field_name": "pages", "value": 0}
+        for _ in range(10):
+            deep = {"not": deep}
+        wide = {"or": [{"field_name": "pages", "value": i} for i in range(101)]}
+        for expression in [deep, wide]:
+            with self.subTest(expression=expression):
+                response = self.search({"filter_params": expression})
+                self.assertEqual(response.status_code, 400)
+
+    def test_compile_filter_params(self):
+        q = compile_filter_params(
+            Book, {"not": {"field_name": "featured", "value": "true"}}
+        )
+        self.assertEqual(Book.objects.filter(q).count(), 12)
+
+
+class BatchTests(ViewTestCase):
+    def batch(self, requests, **kwargs):
+        return self.client.post(
+            "/batch", {"requests": requests, **kwargs}, format="json"
+        )
+
+    def test_batch(self):
+        book = self.books[0]
+        response = self.batch(
+            [
+                {"path": "/books/", "query": {"size": 2, "fields": ["id"]}},
+                {"path": f"/books/{book.pk}", "method": "PUT", "body": {"title": "x"}},
+                {"path": f"/books/{book.pk}", "query": {"fields": ["title"]}},
+                {
+                    "path": "/books/search",
+                    "method": "POST",
+                    "body": {"search": "dragon"},
+                },
+                {"path": "/books/999999"},
+                # not one of the batch's views
+                {"path": "/tags/"},
+            ]
+        )
+        data = response.json()["data"]
+        self.assertEqual([i["status"] for i in data], [200, 200, 200, 200, 404, 404])
+        self.assertEqual(data[2]["body"]["data"], {"title": "x"})
+        self.assertIn("/books/", data[0]["body"]["links"]["next"])
+
+    def test_conditional_headers_are_not_passed_on(self):
+        book = self.books[0]
+        etag = self.client.get(f"/books/{book.pk}")["ETag"]
+        response = self.batch(
+            [
+                {"path": f"/books/{book.pk}"},
+                {"path": f"/books/{book.pk}", "headers": {"If-None-Match": etag}},
+            ],
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual([i["status"] for i in response.json()["data"]], [200, 304])
+
+    def test_snapshot_only_reads(self):
+        response = self.batch(
+            [{"path": f"/books/{self.books[0].pk}", "method": "DELETE"}], snapshot=True
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(Book.objects.filter(pk=self.books[0].pk).exists())
+        response = self.batch([{"path": "/books/"}], snapshot=True)
+        self.assertEqual(response.json()["data"][0]["status"], 200)
+
+    def test_limits(self):
+        for requests in [[], [{"path": "/books/"}] * (Batch.batch_max_requests + 1)]:
+            with self.subTest(requests=len(requests)):
+                self.assertEqual(self.batch(requests).status_code, 400)
+
+    def test_failing_request(self):
+        with mock.patch.object(BookDetails, "get", side_effect=RuntimeError("boom")):
+            with self.assertLogs("utilitas", "ERROR"):
+                response = self.batch(
+                    [{"path": f"/books/{self.books[0].pk}"}, {"path": "/books/"}]
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([i["status"] for i in response.json()["data"]], [500, 200])
+
+
+class ExpandTests(ViewTestCase):
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for expand in [
+            ["category"],
+            ["category.parent"],
+            ["reviews"],
+            ["reviews.book.category"],
+            ["category.children", "reviews"],
+        ]:
+            with self.subTest(expand=expand):
+                small, _ = self.count_queries(f"/books/?size=2&expand={b64(expand)}")
+                large, _ = self.count_queries(f"/books/?size=12&expand={b64(expand)}")
+                self.assertEqual(small, large)
+
+    def test_nested_objects(self):
+        _, response = self.count_queries(
+            f"/books/?size=1&expand={b64(['category.parent', 'reviews.book'])}"
+        )
+        book = response["data"][0]
+        self.assertEqual(book["category"]["parent"]["name"], "root")
+        self.assertEqual(book["reviews"][0]["book"]["title"], "book 0")
+
+    def test_nested_fields_are_projected(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"/books/?size=2&expand={b64(['reviews'])}"
+                f"&fields={b64(['id', 'reviews.stars'])}"
+            )
+        self.assertEqual(response.json()["data"][0]["reviews"], [{"stars": 0}])
+        self.assertNotIn('"created_at"', queries.captured_queries[-1]["sql"])
+
+    def test_max_depth(self):
+        response = self.client.get(
+            f"/books/?expand={b64(['category.parent.parent.parent'])}"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_relations_are_ignored(self):
+        tree = build_expand_tree(Book, ["nope", "category.nope", "title"])
+        self.assertEqual(list(tree.children), ["category"])
+        self.assertEqual(tree.children["category"].children, {})
+
+    def test_details(self):
+        book = self.books[0]
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"/books/{book.pk}?expand={b64(['category.parent', 'reviews'])}"
+            )
+        data = response.json()["data"]
+        self.assertEqual(data["category"]["parent"]["name"], "root")
+        self.assertEqual([i["stars"] for i in data["reviews"]], [0])
@@ -1,12 +1,24 @@
+import asyncio
 import base64
+import contextlib
+import datetime
+import io
 import json
 import csv
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
-from django.core.exceptions import BadRequest
+from asgiref.sync import async_to_sync
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView, Request, Response, status
 from django.db.models import (
+    Q,
     QuerySet,
     CharField,
     TextField,
@@ -15,37 +27,69 @@ from django.db.models import (
     DateField,
     DateTimeField,
 )
-from django.http import HttpResponse
-
+from django.http import (
+    Http404,
+    HttpRequest,
+    HttpResponseNotModified,
+    QueryDict,
+    StreamingHttpResponse,
+)
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from django.utils.timezone import is_aware
+
+from utilitas.cache import (
+    RESPONSE_KEY_PREFIX,
+    bump_model_version,
+    dump_response,
+    get_response_cache,
+    load_response,
+    make_response_key,
+)
+from utilitas.compiled import CompiledSerializer, get_compiled_reader
+from utilitas.aggregation import compile_aggregation
+from utilitas.expand import (
+    MAX_EXPAND_DEPTH,
+    build_expand_tree,
+    get_related_lookups,
+    resolve_expand,
+)
+from utilitas.filters import as_q, compile_filter_params, get_lookups, validate_filters
+from utilitas.importing import IMPORT_PARSERS, ImportReport, chunked
 from utilitas.metadata import CustomMetadata
 from utilitas.pagination import CustomPagination
 from utilitas.renderer import CustomRenderer
-from utilitas.serializers import FilterParamSerializer
 from utilitas.swagger_serializers import FilterParamsSerializer
 from utilitas.swagger_query_params import *
 
 from utilitas.models import BaseModel
+from utilitas.schema import get_schema
+from utilitas.search import search
 from utilitas.serializers import BaseSerializer, BaseModelSerializer
 
-from django.db.models.base import ModelBase
+
+shape_logger = logging.getLogger("utilitas.shapes")
+logger = logging.getLogger("utilitas")
+
+# the conditional headers a batched request can send in its `headers`, with their META keys
+BATCH_CONDITIONAL_HEADERS = {
+    "if-match": "HTTP_IF_MATCH",
+    "if-none-match": "HTTP_IF_NONE_MATCH",
+    "if-modified-since": "HTTP_IF_MODIFIED_SINCE",
+    "if-unmodified-since": "HTTP_IF_UNMODIFIED_SINCE",
+}
+
+
+# a file-like object that just hands back whatever is written to it.
+# csv.writer needs somewhere to write, StreamingHttpResponse needs the written rows.
+class Echo:
+    def write(self, value):
+        return value
 
 
 def get_prefetchable_fields(instance):
-    opts = instance._meta
-    ret = []
-    for field in opts.get_fields():
-        if not isinstance(instance, ModelBase):
-            rel_obj_descriptor = getattr(instance.__class__, field.name, None)
-        else:
-            rel_obj_descriptor = getattr(instance, field.name, None)
-        if rel_obj_descriptor:
-            if hasattr(rel_obj_descriptor, "get_prefetch_queryset"):
-                ret.append(field.name)
-            else:
-                rel_obj = getattr(instance, field.name)
-                if hasattr(rel_obj, "get_prefetch_queryset"):
-                    ret.append(field.name)
-    return ret
+    return list(get_schema(instance).prefetchable_fields)
 
 
 class BaseView(APIView, CustomPagination):
@@ -61,18 +105,163 @@ class BaseView(APIView, CustomPagination):
     fields_param = "fields"
     sorts_param = "sorts"
     expand_param = "expand"
+    ids_param = "ids"
+    # number of rows fetched from the database per round trip when streaming a csv
+    csv_chunk_size = 2000
+    # number of rows written per statement by the bulk endpoints
+    bulk_batch_size = 1000
+    # number of rows validated and inserted at a time by streaming imports, and the number
+    # of rejected rows whose errors are reported
+    import_chunk_size = 1000
+    import_max_errors = 100
+    # maximum number of ids a multi-get may ask for
+    multi_get_max_ids = 1000
+    # deepest `expand` path, e.g. 3 allows "category.parent.parent"
+    expand_max_depth = MAX_EXPAND_DEPTH
+    # only select the columns needed for the `fields` the client asked for
+    project_fields = True
+    # caching of list and search responses (see utilitas.cache)
+    cache_responses = False
+    cache_timeout = 60
+    # authenticated users get their own cached responses
+    cache_vary_on_user = True
+    # serialize list and search pages straight from values_list() rows, without model
+    # instances or serializer fields per row (see utilitas.compiled)
+    compiled_reads = False
+    # log the filter and sort shape of list and search queries to the "utilitas.shapes"
+    # logger, for the index advisor (see utilitas.indexes)
+    log_query_shapes = False
     # customizing the response format
     renderer_classes = [CustomRenderer, BrowsableAPIRenderer]
 
-    # Some `expand` parameters cannot be present in the model's foreign keys (client's mistakes).
+    # sub-requests of a batch are authenticated once, by the batch view (see BaseBatchView)
+    def initialize_request(self, request, *args, **kwargs):
+        drf_request = super().initialize_request(request, *args, **kwargs)
+        batch_auth = getattr(request, "_batch_auth", None)
+        if batch_auth is not None:
+            drf_request.user, drf_request.auth = batch_auth
+        return drf_request
+
+    # Loads the relations of `expand`, nested ones included (see utilitas.expand): to-one
+    # relations are JOINed and to-many ones prefetched, limited to their nested `fields`.
+    # Some `expand` parameters cannot be present in the model's relations (client's mistakes).
     # To avoid being a chatty API, we will just quietly ignore thier mistakes.
+    def expand_queryset(self, queryset: QuerySet, expand=None, fields=None):
+        return resolve_expand(queryset, expand, fields, self.expand_max_depth)
+
+    # the ORM lookups (e.g. "category__parent") expand_queryset loads for `expand`
     def translate_expand_params(self, expand):
-        translated_expand = []
-        # Replacing dots with Django ORM's format.
-        for i in expand:
-            translated_expand.append(i.replace(".", "__"))
-        return set(translated_expand).intersection(
-            set(get_prefetchable_fields(self.model))
+        select, prefetch = get_related_lookups(
+            build_expand_tree(self.model, expand, self.expand_max_depth)
+        )
+        return [*select, *(getattr(i, "prefetch_to", i) for i in prefetch)]
+
+    # The columns to select for a response limited to `fields`, plus the ones needed by
+    # `expand` (foreign keys) and `sorts`. None means every column: either no fields were
+    # asked for, or one of them isn't a model field (e.g. a SerializerMethodField) and we
+    # can't know which columns it reads.
+    def get_projection(self, fields=None, expand=None, sorts=None):
+        if not self.project_fields or not fields:
+            return None
+
+        schema = get_schema(self.model)
+        if not schema.filterable_fields.issuperset(i.split(".")[0] for i in fields):
+            return None
+
+        columns = {schema.pk_name}
+        for i in [*fields, *(expand or []), *[j.lstrip("-") for j in sorts or []]]:
+            i = i.split(".")[0]
+            if i in schema.projectable_fields:
+                columns.add(i)
+        return columns
+
+    def project_queryset(self, queryset: QuerySet, fields=None, expand=None, sorts=None):
+        projection = self.get_projection(fields, expand, sorts)
+        if projection is None:
+            return queryset
+        return queryset.only(*projection)
+
+    # A compiled reader for list and search pages, when `compiled_reads` is on and the
+    # serializer only has plain column fields for this `fields`/`expand`. None means the
+    # regular serializer is used.
+    def get_compiled_reader(self, fields=None, expand=None):
+        if not self.compiled_reads or self.pagination_mode != "page":
+            return None
+        return get_compiled_reader(
+            self.get_serializer_class(), self.model, fields or [], expand or []
+        )
+
+    # the models whose data ends up in the response: the view's model and the expanded relations
+    def get_cache_models(self, expand=None):
+        models = [self.model]
+        for i in build_expand_tree(self.model, expand, self.expand_max_depth).walk():
+            if i.model is not None and i.model not in models:
+                models.append(i.model)
+        return models
+
+    def get_response_cache_key(self, request: Request, expand=None, body=None):
+        cache = get_response_cache()
+        user = getattr(request, "user", None)
+        user_id = None
+        if self.cache_vary_on_user and getattr(user, "is_authenticated", False):
+            user_id = user.pk
+        return make_response_key(
+            f"{self.__class__.__module__}.{self.__class__.__qualname__}",
+            request.method,
+            sorted(request.query_params.lists()),
+            body,
+            self.kwargs,
+            user_id,
+            [
+                (i._meta.label, cache.get_version(i._meta.label))
+                for i in self.get_cache_models(expand)
+            ],
+        )
+
+    # Sends the cached response for this request if there is one, otherwise builds and
+    # caches it. The cache key doubles as the ETag, so clients revalidating with
+    # If-None-Match get a 304 without running any query.
+    def send_cached_response(
+        self, request: Request, build_response, expand=None, body=None
+    ):
+        if not self.cache_responses:
+            return build_response()
+
+        key, etag, response = self.get_cached_response(request, expand, body)
+        if response is None:
+            response = build_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            self.cache_response(key, response)
+        response["ETag"] = etag
+        return response
+
+    # returns a (key, etag, response) tuple, where the response is a 304, the cached
+    # response or None when the response has to be built
+    def get_cached_response(self, request: Request, expand=None, body=None):
+        key = self.get_response_cache_key(request, expand, body)
+        etag = f'W/"{key[len(RESPONSE_KEY_PREFIX):]}"'
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match:
+            # weak comparison, the W/ prefix doesn't matter
+            etags = [
+                i[2:] if i.startswith("W/") else i for i in parse_etags(if_none_match)
+            ]
+            if "*" in etags or etag[2:] in etags:
+                return key, etag, HttpResponseNotModified()
+
+        cached = get_response_cache().get(key)
+        if cached is None:
+            return key, etag, None
+        data, status_code = load_response(cached)
+        return key, etag, Response(data, status=status_code)
+
+    def cache_response(self, key, response: Response):
+        get_response_cache().set(
+            key,
+            dump_response(response.data, response.status_code),
+            self.cache_timeout,
         )
 
     @classmethod
@@ -98,7 +287,7 @@ class BaseView(APIView, CustomPagination):
                 raise TypeError(
                     f"'{i['var']}' in {cls} must be a subclass {i['parent_class']} instead of a {type(getattr(cls,i['var']))}"
                 )
-        for i in ["sorts_param", "fields_param", "expand_param"]:
+        for i in ["sorts_param", "fields_param", "expand_param", "ids_param"]:
             if type(getattr(cls, i)) != str:
                 raise TypeError(f"Variable '{i}' in {cls} must be a string.")
 
@@ -123,25 +312,44 @@ class BaseView(APIView, CustomPagination):
             False, "metadata", {"data": data}, status=status.HTTP_200_OK
         )
 
-        # sending a csv file as response
+    # Csv columns are columns of the model's table: a foreign key holds the related pk, and
+    # to-many relations (which would repeat rows) can't be exported.
+    @staticmethod
+    def validate_csv_fields(model, fields):
+        invalid = [i for i in fields if i not in get_schema(model).projectable_fields]
+        if invalid:
+            raise BadRequest(
+                f"{invalid} can't be exported, csv files only hold {model.__name__}'s columns."
+            )
 
+    # sending a csv file as response.
+    # Rows are streamed to the client as they are read from the database, so neither
+    # the queryset nor the csv body is ever held in memory as a whole.
     def send_csv(self, request: Request, data: QuerySet, fields):
-        response = HttpResponse(
-            content_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename='data.csv'"},
-        )
-
         if len(fields) == 0:
             fields = data.model.get_fields(data.model)
+        # checked before the response starts, errors can't be reported once rows are sent
+        try:
+            self.validate_csv_fields(data.model, fields)
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
 
-        writer = csv.writer(response)
-        writer.writerow(data.model.get_user_friendly_fields(data.model, fields))
-        for i in data:
-            lst = []
-            for j in fields:
-                lst.append(getattr(i, j))
-            writer.writerow(lst)
-        return response
+        writer = csv.writer(Echo())
+
+        def rows():
+            yield writer.writerow(data.model.get_user_friendly_fields(data.model, fields))
+            # values_list + iterator() uses a server-side cursor (where the backend supports it)
+            # and only pulls the requested columns, without building model instances.
+            for row in data.values_list(*fields).iterator(chunk_size=self.csv_chunk_size):
+                yield writer.writerow(row)
+
+        return StreamingHttpResponse(
+            rows(),
+            content_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename='data.csv'"},
+        )
 
     def prepare_queryset(
         self,
@@ -165,15 +373,40 @@ class BaseView(APIView, CustomPagination):
             expand = []
         # query from the database
 
-        translated_expand = self.translate_expand_params(expand)
+        self.log_query_shape(filter_params, sorts)
 
-        queryset = (
-            self.model.objects.filter(**filter_params)
-            .exclude(**exclude_params)
-            .prefetch_related(*translated_expand)
-            .all()
-            .order_by(*sorts)
+        queryset = self.expand_queryset(
+            self.filter_queryset(self.model.objects, filter_params, exclude_params),
+            expand,
+            fields,
         )
+        # unsorted pages keep the model's Meta.ordering, pages need a stable order
+        if sorts:
+            queryset = queryset.order_by(*sorts)
+        queryset = self.search_queryset(request, queryset, rank=not sorts)
+        return self.project_queryset(queryset, fields, expand, sorts)
+
+    # filter_params and exclude_params are dicts of lookups, or Q objects compiled from
+    # filter expressions (see utilitas.filters)
+    @staticmethod
+    def filter_queryset(queryset, filter_params=None, exclude_params=None):
+        return queryset.filter(as_q(filter_params)).exclude(as_q(exclude_params))
+
+    def log_query_shape(self, filter_params, sorts):
+        if self.log_query_shapes:
+            shape_logger.info(
+                json.dumps(
+                    {
+                        "model": self.model._meta.label,
+                        "filters": sorted(get_lookups(filter_params)),
+                        "sorts": list(sorts),
+                    }
+                )
+            )
+
+    # Narrows `queryset` down to the rows matching the full-text search of the request,
+    # if any (see BaseSearchView). With `rank`, the best matches come first.
+    def search_queryset(self, request: Request, queryset: QuerySet, rank=False):
         return queryset
 
     # querying data
@@ -201,15 +434,24 @@ class BaseView(APIView, CustomPagination):
         if not is_csv:
             # query from the database
 
-            translated_expand = self.translate_expand_params(expand)
+            self.log_query_shape(filter_params, sorts)
 
-            queryset = (
-                self.model.objects.filter(**filter_params)
-                .exclude(**exclude_params)
-                .prefetch_related(*translated_expand)
-                .all()
-                .order_by(*sorts)
+            queryset = self.expand_queryset(
+                self.filter_queryset(self.model.objects, filter_params, exclude_params),
+                expand,
+                fields,
             )
+            if sorts:
+                queryset = queryset.order_by(*sorts)
+            queryset = self.search_queryset(request, queryset, rank=not sorts)
+            reader = self.get_compiled_reader(fields, expand)
+            if reader is not None:
+                rows = self.paginate_queryset(
+                    queryset.values_list(*reader.columns), request
+                )
+                return CompiledSerializer(reader, rows)
+
+            queryset = self.project_queryset(queryset, fields, expand, sorts)
 
             # paginate the queryset
             paginated_data = self.paginate_queryset(queryset, request)
@@ -225,15 +467,20 @@ class BaseView(APIView, CustomPagination):
 
             return serialized_data
         else:
-            return (
-                self.model.objects.filter(**filter_params)
-                .exclude(**exclude_params)
-                .all()
+            queryset = self.filter_queryset(
+                self.model.objects, filter_params, exclude_params
             )
+            if sorts:
+                queryset = queryset.order_by(*sorts)
+            return self.search_queryset(request, queryset, rank=not sorts)
 
     # make sure the fields are actually present in the model
     def fields_are_valid(self, fields: list) -> bool:
-        return set(fields).issubset(self.model.get_filterable_fields(self.model))
+        return self.model.get_filterable_fields(self.model).issuperset(fields)
+
+    # make sure the fields can be sorted on
+    def sorts_are_valid(self, sorts: list) -> bool:
+        return self.model.get_sortable_fields(self.model).issuperset(sorts)
 
     # get the "field" parameter form the request's body
     def get_fields_param(self, request: Request):
@@ -252,7 +499,7 @@ class BaseView(APIView, CustomPagination):
                 sorts, self.sorts_param
             )  # decode base64 string
             rmv_sign_sort = [sort.replace("-", "") for sort in sorts]
-            if not self.fields_are_valid(rmv_sign_sort):
+            if not self.sorts_are_valid(rmv_sign_sort):
                 raise BadRequest(
                     f"{sorts} is not present in {self.model.__name__}'s sortable fields"
                 )
@@ -264,6 +511,10 @@ class BaseView(APIView, CustomPagination):
         expand = request.query_params.get(self.expand_param, [])
         if expand:
             expand = self.decode_query_param(expand, self.expand_param)
+            if not isinstance(expand, list):
+                raise BadRequest(f"'{self.expand_param}' must be a list.")
+            # refuses paths deeper than expand_max_depth
+            build_expand_tree(self.model, expand, self.expand_max_depth)
 
         return expand
 
@@ -299,7 +550,9 @@ class BaseListView(BaseView):
     metadata_class = CustomMetadata
 
     def __init_subclass__(cls, **kwargs):
-        cls._validate_attributes(**kwargs)
+        # internal base classes (e.g. the async views) don't have a model yet
+        if not cls.__dict__.get("_is_internal", False):
+            cls._validate_attributes(**kwargs)
         return super().__init_subclass__(**kwargs)
 
     # @swagger_auto_schema(
@@ -319,6 +572,16 @@ class BaseListView(BaseView):
                 True, "bad_request", {"details": str(e)}, status=400
             )
 
+        ids = request.query_params.get(self.ids_param)
+        if ids:
+            try:
+                ids = self.decode_query_param(ids, self.ids_param)
+            except BadRequest as e:
+                return self.send_response(
+                    True, "bad_request", {"details": str(e)}, status=400
+                )
+            return self.send_multi_get(request, ids, query_params)
+
         if request.query_params.get("csv"):
             return self.send_csv(
                 request,
@@ -330,19 +593,39 @@ class BaseListView(BaseView):
 
 
 
-        serialized_data = self.get_queryset(request, **query_params)
+        def build_response():
+            serialized_data = self.get_queryset(request, **query_params)
 
-        # return the serialized queryset in a standardized manner
-        return self.send_response(
-            False,
-            "success",
-            {**self.get_paginated_response(), "data": serialized_data.data},
-            status=status.HTTP_200_OK,
+            # return the serialized queryset in a standardized manner
+            return self.send_response(
+                False,
+                "success",
+                {**self.get_paginated_response(), "data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            )
+
+        return self.send_cached_response(
+            request, build_response, query_params["expand"]
         )
     
 
     # create
     def post(self, request: Request):
+        if request.query_params.get("import", None):
+            return self.import_objects(request)
+
+        # multi-get with the ids in the body, for lists too long for a query string
+        if request.query_params.get(self.ids_param, None):
+            try:
+                query_params = self.get_query_params(request)
+            except BadRequest as e:
+                return self.send_response(
+                    True, "bad_request", {"details": str(e)}, status=400
+                )
+            return self.send_multi_get(
+                request, request.data.get(self.ids_param, None), query_params
+            )
+
         if request.query_params.get("bulk", None):
             objs = request.data.get("objects", None)
 
@@ -350,15 +633,36 @@ class BaseListView(BaseView):
                 return self.send_response(
                     True, "Missing 'objects' parameter in request body.", {}
                 )
+
+            context = self.get_serializer_context()
+            if request.query_params.get("upsert", None):
+                try:
+                    context["upsert"] = self.get_upsert_options(request, objs)
+                except BadRequest as e:
+                    return self.send_response(
+                        True, "bad_request", {"details": str(e)}, status=400
+                    )
+
             serialized_data = self.get_serializer(
-                data=request.data["objects"], many=True
+                data=request.data["objects"], many=True, context=context
             )
+            if "upsert" in context:
+                serialized_data.drop_unique_validators()
 
             if serialized_data.is_valid():
-                serialized_data.save()
+                try:
+                    with transaction.atomic():
+                        serialized_data.save()
+                except DatabaseError as e:
+                    return self.send_response(
+                        True,
+                        "creation failed because of a database error. 0 objects were created.",
+                        {"details": str(e)},
+                        status=status.HTTP_400_BAD_REQUEST,
+                    )
                 return self.send_response(
                     False,
-                    "bulk-created",
+                    "bulk-upserted" if "upsert" in context else "bulk-created",
                     {"data": serialized_data.data},
                     status=status.HTTP_201_CREATED,
                 )
@@ -390,14 +694,364 @@ class BaseListView(BaseView):
             status=status.HTTP_400_BAD_REQUEST,
         )
 
+    # Sends the objects with the given ids, fetched with one query (plus the prefetches of
+    # `expand`), in the order of `ids`. Ids without an object are listed in "missing".
+    def send_multi_get(self, request: Request, ids, query_params):
+        if not isinstance(ids, list):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": f"'{self.ids_param}' must be a list of ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(ids) > self.multi_get_max_ids:
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": f"At most {self.multi_get_max_ids} ids can be fetched at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        pk_field = self.model._meta.pk
+        try:
+            # duplicates are only sent once
+            ids = list(dict.fromkeys(pk_field.to_python(i) for i in ids))
+        except (TypeError, ValidationError):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": f"'{self.ids_param}' must be a list of valid ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fields, expand = query_params["fields"], query_params["expand"]
+
+        def build_response():
+            queryset = self.project_queryset(
+                self.expand_queryset(self.model.objects.order_by(), expand, fields),
+                fields,
+                expand,
+            )
+            objects = queryset.in_bulk(ids)
+            serialized_data = self.get_serializer(
+                [objects[i] for i in ids if i in objects],
+                many=True,
+                fields=fields,
+                expand=expand,
+                context={"model": self.model},
+            )
+            return self.send_response(
+                False,
+                "success",
+                {
+                    "missing": [i for i in ids if i not in objects],
+                    "data": serialized_data.data,
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        return self.send_cached_response(request, build_response, expand, ids)
+
+    # Streaming import of an NDJSON or CSV body (see utilitas.importing). Rows are parsed
+    # as they are read, validated and inserted `import_chunk_size` at a time with one
+    # transaction per chunk, so invalid rows are rejected and the others kept. With the
+    # `atomic` query parameter, any rejected row rolls the whole import back.
+    def import_objects(self, request: Request):
+        parse = IMPORT_PARSERS.get(request.content_type.split(";")[0].strip())
+        if parse is None:
+            return self.send_response(
+                True,
+                "unsupported_media_type",
+                {"details": f"Imports accept these content types: {list(IMPORT_PARSERS)}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+
+        atomic = bool(request.query_params.get("atomic", None))
+        report = ImportReport(self.import_max_errors)
+        rows = parse(request.stream or [])
+        with transaction.atomic() if atomic else contextlib.nullcontext():
+            for chunk in chunked(rows, self.import_chunk_size):
+                self.import_chunk(chunk, report, insert=not (atomic and report.rejected))
+            if atomic and report.rejected:
+                transaction.set_rollback(True)
+                report.accepted = 0
+                report.rolled_back = True
+
+        if report.rejected == 0:
+            message = "imported"
+        elif report.accepted:
+            message = f"imported with some errors. {report.rejected} rows were rejected."
+        else:
+            message = "import failed because of some errors. 0 objects were created."
+        return self.send_response(
+            report.accepted == 0 and report.rejected > 0,
+            message,
+            {"data": report.as_dict()},
+            status=(
+                status.HTTP_201_CREATED
+                if report.accepted or not report.rejected
+                else status.HTTP_400_BAD_REQUEST
+            ),
+        )
+
+    # validates the (line, data, error) rows of a chunk and inserts the valid ones
+    def import_chunk(self, chunk, report: ImportReport, insert=True):
+        parsed = []
+        for line, data, error in chunk:
+            if error is not None:
+                report.reject(line, error)
+            else:
+                parsed.append((line, data))
+
+        serializer = self.get_serializer(data=[], many=True)
+        # one query per row and unique field otherwise, the database's constraints still apply
+        serializer.drop_unique_validators()
+        valid = []
+        for (line, _), (validated, errors) in zip(
+            parsed, serializer.validate_each([i for _, i in parsed])
+        ):
+            if errors is not None:
+                report.reject(line, errors)
+            else:
+                valid.append((line, validated))
+
+        if not valid or not insert:
+            return
+        self.insert_rows(serializer, valid, report)
+
+    # Inserts (line, validated data) rows in one savepoint. When the database refuses the
+    # insert, each half is retried in its own, down to the rows that fail: they are rejected
+    # with their own error and the others are kept.
+    def insert_rows(self, serializer, rows, report: ImportReport):
+        try:
+            with transaction.atomic():
+                serializer.create([i for _, i in rows])
+        except DatabaseError as e:
+            if len(rows) == 1:
+                report.reject(rows[0][0], {"non_field_errors": [str(e)]})
+                return
+            middle = len(rows) // 2
+            self.insert_rows(serializer, rows[:middle], report)
+            self.insert_rows(serializer, rows[middle:], report)
+            return
+        report.accepted += len(rows)
+
+    # `unique_fields` (required) and `update_fields` (defaults to every other field sent)
+    # of an upsert, from the request body
+    def get_upsert_options(self, request: Request, objs):
+        schema = get_schema(self.model)
+        unique_fields = request.data.get("unique_fields", None)
+        if not isinstance(unique_fields, list) or not unique_fields:
+            raise BadRequest("Missing 'unique_fields' parameter in request body.")
+
+        update_fields = request.data.get("update_fields", None)
+        if update_fields is None:
+            update_fields = []
+            for i in objs if isinstance(objs, list) else []:
+                for j in i if isinstance(i, dict) else []:
+                    if j not in unique_fields and j not in update_fields:
+                        update_fields.append(j)
+        if not isinstance(update_fields, list):
+            raise BadRequest("'update_fields' must be a list.")
+
+        for i in [*unique_fields, *update_fields]:
+            if i not in schema.projectable_fields:
+                raise BadRequest(
+                    f"{i} is not present in {self.model.__name__}'s fields"
+                )
+        if "updated_at" in schema.projectable_fields and "updated_at" not in update_fields:
+            update_fields.append("updated_at")
+        if not update_fields:
+            raise BadRequest("Missing 'update_fields' parameter in request body.")
+        return {"unique_fields": unique_fields, "update_fields": update_fields}
+
+    # bulk update. Each object needs its pk, only the fields that were sent are validated and
+    # only the columns that actually changed are written, with one UPDATE per batch.
+    def patch(self, request: Request):
+        if not request.query_params.get("bulk", None):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": "List endpoints only support PATCH with the 'bulk' query parameter."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        objs = request.data.get("objects", None)
+        if not isinstance(objs, list):
+            return self.send_response(
+                True, "Missing 'objects' parameter in request body.", {}, status=400
+            )
+
+        pk_field = self.model._meta.pk
+        try:
+            ids = [pk_field.to_python(i[pk_field.name]) for i in objs]
+        except (KeyError, TypeError, ValidationError):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": f"Every object needs a valid '{pk_field.name}'."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            instances = self.model.objects.select_for_update().in_bulk(ids)
+            missing = [i for i in ids if i not in instances]
+            if missing:
+                return self.send_response(
+                    True,
+                    "update failed because some objects do not exist. 0 objects were updated.",
+                    {"details": {"missing": missing}},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
+
+            validated = []
+            errors = {}
+            for index, (obj_id, data) in enumerate(zip(ids, objs)):
+                serialized_data = self.get_serializer(
+                    instances[obj_id], data=data, partial=True
+                )
+                if serialized_data.is_valid():
+                    validated.append((instances[obj_id], serialized_data.validated_data))
+                else:
+                    errors[index] = serialized_data.errors
+
+            if errors:
+                return self.send_response(
+                    True,
+                    "update failed because of some errors. 0 objects were updated.",
+                    {"details": errors},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+            try:
+                self.bulk_update(validated)
+            except (BadRequest, DatabaseError) as e:
+                transaction.set_rollback(True)
+                return self.send_response(
+                    True, "bad_request", {"details": str(e)}, status=400
+                )
+
+        instances = [instances[i] for i in dict.fromkeys(ids)]
+        return self.send_response(
+            False,
+            "bulk-updated",
+            {"data": self.get_serializer(instances, many=True).data},
+            status=status.HTTP_200_OK,
+        )
+
+    # writes the changed columns of (instance, validated_data) pairs with bulk_update
+    def bulk_update(self, validated):
+        schema = get_schema(self.model)
+        changed_objs = {}
+        changed_fields = set()
+        for obj, data in validated:
+            for name, value in data.items():
+                # serializer fields that aren't columns (e.g. write-only ones) have
+                # nothing to write in a bulk UPDATE
+                if name not in schema.fields:
+                    raise BadRequest(f"{name} isn't a field of {self.model.__name__}.")
+                if name not in schema.projectable_fields:
+                    raise BadRequest(f"{name} can't be updated in bulk.")
+                field = schema.fields[name]
+                if field.is_relation:
+                    old = getattr(obj, field.attname)
+                    new = getattr(value, "pk", value)
+                else:
+                    old = getattr(obj, name)
+                    new = value
+                if old != new:
+                    setattr(obj, name, value)
+                    changed_objs[id(obj)] = obj
+                    changed_fields.add(name)
+
+        if not changed_objs:
+            return 0
+        # bulk_update doesn't run pre_save, so auto_now fields are set here
+        now = timezone.now()
+        for field in self.model._meta.concrete_fields:
+            if getattr(field, "auto_now", False):
+                changed_fields.add(field.name)
+                for obj in changed_objs.values():
+                    setattr(obj, field.attname, now)
+
+        self.model.release_chosen_one_fields(
+            list(changed_objs.values()),
+            [i for i in self.model.chosen_one_fields if i in changed_fields],
+        )
+        count = self.model.objects.bulk_update(
+            list(changed_objs.values()),
+            list(changed_fields),
+            batch_size=self.bulk_batch_size,
+        )
+        bump_model_version(self.model)
+        return count
+
+    # bulk delete, by `ids` or by the filter grammar of BaseSearchView
+    # (`filter_params` and `exclude_params`), as one set-based DELETE.
+    def delete(self, request: Request):
+        if not request.query_params.get("bulk", None):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": "List endpoints only support DELETE with the 'bulk' query parameter."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        ids = request.data.get("ids", None)
+        try:
+            filter_params = compile_filter_params(
+                self.model, request.data.get("filter_params", []), "filter_params"
+            )
+            exclude_params = compile_filter_params(
+                self.model, request.data.get("exclude_params", []), "exclude_params"
+            )
+            if ids is not None:
+                if not isinstance(ids, list):
+                    raise BadRequest("'ids' must be a list.")
+                pk_field = self.model._meta.pk
+                try:
+                    filter_params = as_q(filter_params) & Q(
+                        pk__in=[pk_field.to_python(i) for i in ids]
+                    )
+                except ValidationError as e:
+                    raise BadRequest(e.messages)
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
+
+        # deleting the whole table has to be asked for explicitly
+        if not filter_params and not request.data.get("all", False):
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": "Provide 'ids' or 'filter_params' (or 'all': true) to delete objects."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            count, deleted = self.filter_queryset(
+                self.model.objects, filter_params, exclude_params
+            ).delete()
+        # cascades may have deleted rows of other models too
+        for label in deleted:
+            get_response_cache().bump_version(label)
+        return self.send_response(
+            False, "bulk-deleted", {"data": {"count": count}}, status=status.HTTP_200_OK
+        )
+
 
 class BaseDetailsView(BaseView):
     _is_internal = True
     name = "Base details view"
     metadata_class = CustomMetadata
+    # the ETag and Last-Modified of an object are derived from this field
+    version_field = "updated_at"
 
     def __init_subclass__(cls, **kwargs):
-        cls._validate_attributes(**kwargs)
+        # internal base classes (e.g. the async views) don't have a model yet
+        if not cls.__dict__.get("_is_internal", False):
+            cls._validate_attributes(**kwargs)
         return super().__init_subclass__(**kwargs)
 
     def _send_not_found(self, obj_id: int):
@@ -408,9 +1062,67 @@ class BaseDetailsView(BaseView):
             status=status.HTTP_404_NOT_FOUND,
         )
 
-    def _get_object(self, obj_id: int):
-        obj = self.model.objects.filter(pk=obj_id).first()
-        return obj
+    # the columns of a projected object always include the version field
+    def get_projection(self, fields=None, expand=None, sorts=None):
+        projection = super().get_projection(fields, expand, sorts)
+        if (
+            projection is not None
+            and self.version_field in get_schema(self.model).projectable_fields
+        ):
+            projection.add(self.version_field)
+        return projection
+
+    def _get_object(self, obj_id: int, fields=None, expand=None, for_update=False):
+        queryset = self.model.objects.filter(pk=obj_id)
+        if for_update:
+            queryset = queryset.select_for_update()
+        queryset = self.project_queryset(
+            self.expand_queryset(queryset, expand, fields), fields, expand
+        )
+        # the pk matches one row at most, no need for the ORDER BY of first()
+        return next(iter(queryset.order_by()[:1]), None)
+
+    # (etag, last_modified) of an object, derived from its `version_field`.
+    # (None, None) when the model doesn't have one.
+    def get_object_version(self, obj):
+        value = getattr(obj, self.version_field, None) if self.version_field else None
+        if value is None:
+            return None, None
+        epoch = datetime.datetime(
+            1970, 1, 1, tzinfo=datetime.timezone.utc if is_aware(value) else None
+        )
+        version = (value - epoch) // datetime.timedelta(microseconds=1)
+        return f'"{obj.pk}-{version:x}"', value
+
+    def set_version_headers(self, response, obj):
+        etag, last_modified = self.get_object_version(obj)
+        if etag is not None:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        return response
+
+    # Evaluates the conditional headers of the request (If-Match, If-Unmodified-Since,
+    # If-None-Match, If-Modified-Since) against the object's version. Returns a 304 or 412
+    # response, or None when the request should go on.
+    def get_conditional_response(self, request: Request, obj):
+        etag, last_modified = self.get_object_version(obj)
+        if etag is None:
+            return None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp())
+        )
+        if response is None:
+            return None
+        if response.status_code == status.HTTP_412_PRECONDITION_FAILED:
+            response = self.send_response(
+                True,
+                "precondition_failed",
+                {
+                    "details": f"{str(self.model)} with id {obj.pk} was modified since the version you have."
+                },
+                status=status.HTTP_412_PRECONDITION_FAILED,
+            )
+        return self.set_version_headers(response, obj)
 
     # get-one
     # @swagger_auto_schema(
@@ -421,24 +1133,48 @@ class BaseDetailsView(BaseView):
 
         query_params = self.get_query_params(request)
         query_params.pop("sorts")
-        obj = self._get_object(obj_id)
+        obj = self._get_object(obj_id, **query_params)
         if obj is None:
             return self._send_not_found(obj_id)
+        conditional_response = self.get_conditional_response(request, obj)
+        if conditional_response is not None:
+            return conditional_response
         serialized_data = self.get_serializer(obj, **query_params)
-        return self.send_response(
-            False, "success", {"data": serialized_data.data}, status=status.HTTP_200_OK
+        return self.set_version_headers(
+            self.send_response(
+                False,
+                "success",
+                {"data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            ),
+            obj,
         )
 
-    # update
+    # update. Only the columns that changed are written (see BaseModelSerializer.update).
+    # With If-Match or If-Unmodified-Since, the row is locked while the precondition is
+    # checked, and a client holding an outdated version gets a 412.
     def put(self, request: Request, obj_id: int):
-        obj = self._get_object(obj_id)
-        if obj is None:
-            return self._send_not_found(obj_id)
-        serialized_data = self.get_serializer(obj, data=request.data, partial=True)
-        serialized_data.is_valid(raise_exception=True)
-        serialized_data.save()
-        return self.send_response(
-            False, "updated", {"data": serialized_data.data}, status=status.HTTP_200_OK
+        conditional = "If-Match" in request.headers or (
+            "If-Unmodified-Since" in request.headers
+        )
+        with transaction.atomic():
+            obj = self._get_object(obj_id, for_update=conditional)
+            if obj is None:
+                return self._send_not_found(obj_id)
+            conditional_response = self.get_conditional_response(request, obj)
+            if conditional_response is not None:
+                return conditional_response
+            serialized_data = self.get_serializer(obj, data=request.data, partial=True)
+            serialized_data.is_valid(raise_exception=True)
+            serialized_data.save()
+        return self.set_version_headers(
+            self.send_response(
+                False,
+                "updated",
+                {"data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            ),
+            obj,
         )
 
     def delete(self, request: Request, obj_id: int):
@@ -455,59 +1191,116 @@ class BaseDetailsView(BaseView):
 class BaseSearchView(BaseView):
     _is_internal = True
     name = "Base search view"
+    # groups sent back by aggregated searches
+    aggregation_max_groups = 1000
+    # the full-text search query of the request's body (see utilitas.search)
+    search_param = "search"
+    search_max_length = 256
 
     def __init_subclass__(cls, **kwargs):
-        cls._validate_attributes(**kwargs)
+        # internal base classes (e.g. the async views) don't have a model yet
+        if not cls.__dict__.get("_is_internal", False):
+            cls._validate_attributes(**kwargs)
         return super().__init_subclass__(**kwargs)
 
+    # validates a list of clauses against the model's fields in one pass (see
+    # utilitas.filters). They are returned with their default operator and with values of
+    # the fields' python types.
     def validate_body_params(self, to_be_validated):
-        validated_data = []
-        for i in to_be_validated:
-            x = FilterParamSerializer(data=i, context={"model": self.model})
-            if not x.is_valid(raise_exception=True):
-                raise BadRequest(x.errors)
-            validated_data.append(x.data)
-
-        return validated_data
+        return [
+            {"field_name": i, "operator": j, "value": k}
+            for i, j, k in validate_filters(self.model, to_be_validated)
+        ]
 
+    # building a dict of lookups from validated clauses
     @staticmethod
     def build_body_params(body_params):
         params_dict = {}
         for i in body_params:
             params_dict[i["field_name"] + "__" + i["operator"]] = (
-                i["value"].split(",") if i["operator"] == "in" else i["value"]
+                i["value"].split(",")
+                if i["operator"] == "in" and isinstance(i["value"], str)
+                else i["value"]
             )
 
         return params_dict
 
-    # validating with FilterParamSerializer to make sure the filter_params object is of the right format
-    def get_filter_params(self, request: Request):
-        filter_params = request.data.get("filter_params", {})
-        validated_filter_params = self.validate_body_params(filter_params)
-        return self.build_body_params(validated_filter_params)
-
     # building a filter_params dict to be used in querying
     @staticmethod
     def build_filter_params(filter_params):
-        filter_dict = {}
-        for i in filter_params:
-            filter_dict[i["field_name"] + "__" + i["operator"]] = (
-                i["value"].split(",") if i["operator"] == "in" else i["value"]
-            )
-
-        return filter_dict
+        return BaseSearchView.build_body_params(filter_params)
 
-    # get filter_params from the request
+    # get filter_params from the request: a dict of lookups for a list of clauses, a Q for
+    # a filter expression
     def get_filter_params(self, request: Request):
-        filter_params = request.data.get("filter_params", {})
-        validated_filter_params = self.validate_body_params(filter_params)
-        return self.build_body_params(validated_filter_params)
+        filter_params = request.data.get("filter_params", [])
+        return compile_filter_params(self.model, filter_params, "filter_params")
 
     # get exclude_params from the request
     def get_exclude_params(self, request: Request):
-        exclude_params = request.data.get("exclude_params", {})
-        validated_exclude_params = self.validate_body_params(exclude_params)
-        return self.build_body_params(validated_exclude_params)
+        exclude_params = request.data.get("exclude_params", [])
+        return compile_filter_params(self.model, exclude_params, "exclude_params")
+
+    # get the full-text search query from the request's body, None when there is none
+    def get_search_query(self, request: Request):
+        query = request.data.get(self.search_param, None)
+        if query is None or query == "":
+            return None
+        if not isinstance(query, str) or len(query) > self.search_max_length:
+            raise BadRequest(
+                f"'{self.search_param}' must be a string of at most {self.search_max_length} characters."
+            )
+        if not self.model.searchable_fields:
+            raise BadRequest(f"{self.model.__name__} doesn't have searchable fields.")
+        return query
+
+    # Full-text search over the model's searchable_fields, on the backend's index.
+    # Results are ranked by relevance unless the request sorts them (or uses cursor
+    # pagination, which can only seek on columns).
+    def search_queryset(self, request: Request, queryset: QuerySet, rank=False):
+        query = self.get_search_query(request)
+        if query is None:
+            return queryset
+        return search(queryset, query, rank and self.pagination_mode == "page")
+
+    # Aggregated search: `group_by`, `aggregates` and `order_by` from the request's body
+    # (see utilitas.aggregation) are computed by the database with values().annotate(),
+    # only the groups are sent back.
+    def send_aggregation(self, request: Request, filter_params, exclude_params):
+        try:
+            aggregation = compile_aggregation(
+                self.model,
+                request.data.get("group_by", None),
+                request.data.get("aggregates", None),
+                request.data.get("order_by", None),
+            )
+        except BadRequest as e:
+            return self.send_response(
+                True, "bad_request", {"details": str(e)}, status=400
+            )
+
+        def build_response():
+            queryset = self.search_queryset(
+                request,
+                self.filter_queryset(self.model.objects, filter_params, exclude_params),
+            )
+            # one extra group tells whether the groups were cut
+            rows = aggregation.apply(queryset, self.aggregation_max_groups + 1)
+            return self.send_response(
+                False,
+                "success",
+                {
+                    "has_more": len(rows) > self.aggregation_max_groups,
+                    "data": rows[: self.aggregation_max_groups],
+                },
+                status=status.HTTP_200_OK,
+            )
+
+        return self.send_cached_response(
+            request,
+            build_response,
+            body=[filter_params, exclude_params, request.data],
+        )
 
     # @swagger_auto_schema(
     #     request_body=FilterParamsSerializer,
@@ -521,11 +1314,15 @@ class BaseSearchView(BaseView):
             query_params = self.get_query_params(request)
             filter_params = self.get_filter_params(request)
             exclude_params = self.get_exclude_params(request)
+            self.get_search_query(request)
         except BadRequest as e:
             return self.send_response(
                 True, "bad_request", {"details": str(e)}, status=400
             )
 
+        if request.query_params.get("aggregate"):
+            return self.send_aggregation(request, filter_params, exclude_params)
+
         if request.query_params.get("csv"):
             return self.send_csv(
                 request,
@@ -535,14 +1332,297 @@ class BaseSearchView(BaseView):
                 fields=query_params["fields"],
             )
 
-        serialized_data = self.get_queryset(
-            request, filter_params, exclude_params, **query_params
+        def build_response():
+            serialized_data = self.get_queryset(
+                request, filter_params, exclude_params, **query_params
+            )
+
+            # return the serialized queryset in a standardized manner
+            return self.send_response(
+                False,
+                "success",
+                {**self.get_paginated_response(), "data": serialized_data.data},
+                status=status.HTTP_200_OK,
+            )
+
+        return self.send_cached_response(
+            request,
+            build_response,
+            query_params["expand"],
+            [filter_params, exclude_params, request.data],
+        )
+
+
+# Runs several requests against the list, details and search views of `views` in one round
+# trip. The body holds the sub-requests, answered in order with their status and body:
+#   {"requests": [{"method": "GET", "path": "/books/1", "query": {...}, "body": {...}}],
+#    "snapshot": false}
+# Sub-requests are resolved with the project's urls and dispatched in-process, with the user
+# the batch request was authenticated with (the views' permissions and throttles still apply).
+# With `snapshot`, they only read and run in one transaction, so that they all see the same
+# state of the database.
+class BaseBatchView(BaseView):
+    name = "Base batch view"
+    # the views sub-requests can call
+    views = []
+    batch_max_requests = 20
+    # threads running consecutive reads concurrently, each with its own database connection.
+    # 1 runs every sub-request on the batch request's connection.
+    batch_max_workers = 1
+
+    def __init_subclass__(cls, **kwargs):
+        for view in cls.views:
+            if not (
+                isinstance(view, type)
+                and issubclass(view, (BaseListView, BaseDetailsView, BaseSearchView))
+            ):
+                raise TypeError(
+                    f"{view} in {cls}.views must be a list, details or search view."
+                )
+        return super().__init_subclass__(**kwargs)
+
+    # query params can be sent as they'd be in a query string, or as lists and objects
+    # that are base64-encoded like the utilitas views expect them
+    @staticmethod
+    def encode_query(query):
+        if isinstance(query, str):
+            return query
+        params = {}
+        for key, value in (query or {}).items():
+            if isinstance(value, (list, dict)):
+                value = (
+                    base64.urlsafe_b64encode(json.dumps(value).encode())
+                    .decode()
+                    .rstrip("=")
+                )
+            params[key] = str(value).lower() if isinstance(value, bool) else str(value)
+        return urlencode(params)
+
+    # Resolves a sub-request to (method, path, query string, resolver match). Raises
+    # BadRequest or Http404 when it can't be run.
+    def resolve_request(self, item):
+        if not isinstance(item, dict):
+            raise BadRequest("Each request must be an object.")
+        method = item.get("method", "GET")
+        path = item.get("path", None)
+        if not isinstance(method, str) or not isinstance(path, str):
+            raise BadRequest("Each request needs a 'path' and a 'method'.")
+        headers = item.get("headers", None) or {}
+        if not isinstance(headers, dict) or any(
+            not isinstance(i, str)
+            or i.lower() not in BATCH_CONDITIONAL_HEADERS
+            or not isinstance(j, str)
+            for i, j in headers.items()
+        ):
+            raise BadRequest(
+                f"'headers' can only hold these headers: {list(BATCH_CONDITIONAL_HEADERS)}"
+            )
+        path, _, query = path.partition("?")
+        extra_query = self.encode_query(item.get("query", None))
+        query = "&".join(i for i in [query, extra_query] if i)
+
+        try:
+            match = resolve(path)
+        except Resolver404:
+            match = None
+        if match is None or getattr(match.func, "view_class", None) not in self.views:
+            raise Http404(f"{path} is not a view that can be batched.")
+        return method.upper(), path, query, match
+
+    @staticmethod
+    def is_read(method: str, match) -> bool:
+        return method in ("GET", "HEAD") or (
+            method == "POST" and issubclass(match.func.view_class, BaseSearchView)
+        )
+
+    # The conditional headers of the batch request are about the batch, a sub-request only
+    # gets the ones of its own `headers`
+    def build_request(
+        self, request: Request, method: str, path: str, query: str, body, headers=None
+    ):
+        outer = request._request
+        sub = HttpRequest()
+        sub.method = method
+        sub.path = sub.path_info = path
+        raw = b"" if body is None else json.dumps(body).encode()
+        sub.META = {
+            **{
+                i: j
+                for i, j in outer.META.items()
+                if i not in BATCH_CONDITIONAL_HEADERS.values()
+            },
+            **{
+                BATCH_CONDITIONAL_HEADERS[i.lower()]: j
+                for i, j in (headers or {}).items()
+            },
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(raw)),
+        }
+        sub.GET = QueryDict(query)
+        sub.COOKIES = outer.COOKIES
+        sub._stream = io.BytesIO(raw)
+        sub._read_started = False
+        sub.user = request.user
+        sub._batch_auth = (request.user, request.auth)
+        return sub
+
+    def run_request(self, request: Request, item, resolved):
+        if isinstance(resolved, Exception):
+            return {
+                "status": (
+                    status.HTTP_404_NOT_FOUND
+                    if isinstance(resolved, Http404)
+                    else status.HTTP_400_BAD_REQUEST
+                ),
+                "body": {
+                    "isError": True,
+                    "message": (
+                        "not_found" if isinstance(resolved, Http404) else "bad_request"
+                    ),
+                    "details": str(resolved),
+                },
+            }
+
+        method, path, query, match = resolved
+        sub = self.build_request(
+            request,
+            method,
+            path,
+            query,
+            item.get("body", None),
+            item.get("headers", None),
         )
+        sub.resolver_match = match
+        try:
+            # inside a transaction (snapshots, ATOMIC_REQUESTS), a failed sub-request
+            # rolls back to its savepoint so that the next ones can still query
+            with (
+                transaction.atomic()
+                if connections[DEFAULT_DB_ALIAS].in_atomic_block
+                else contextlib.nullcontext()
+            ):
+                response = match.func(sub, *match.args, **match.kwargs)
+                if asyncio.iscoroutine(response):
+                    coroutine = response
+
+                    async def wait():
+                        return await coroutine
+
+                    response = async_to_sync(wait)()
+        except Exception:
+            # the error of one sub-request doesn't fail the others
+            logger.exception("Batched request %s %s failed", method, path)
+            return {
+                "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "body": {
+                    "isError": True,
+                    "message": "server_error",
+                    "details": "The request failed because of a server error.",
+                },
+            }
+        if isinstance(response, StreamingHttpResponse):
+            response.close()
+            return {
+                "status": status.HTTP_400_BAD_REQUEST,
+                "body": {
+                    "isError": True,
+                    "message": "bad_request",
+                    "details": "Streaming responses (csv) can't be batched.",
+                },
+            }
+        return {"status": response.status_code, "body": getattr(response, "data", None)}
+
+    # worker threads open their own connection, which is closed with the sub-request
+    def run_request_in_thread(self, request: Request, item, resolved):
+        try:
+            return self.run_request(request, item, resolved)
+        finally:
+            connections.close_all()
+
+    def run_requests(self, request: Request, items, resolved, concurrent=False):
+        if not concurrent:
+            return [self.run_request(request, i, j) for i, j in zip(items, resolved)]
+
+        results = [None] * len(items)
+        with ThreadPoolExecutor(self.batch_max_workers) as executor:
+            pending = []
+            for index, (item, i) in enumerate(zip(items, resolved)):
+                if not isinstance(i, Exception) and self.is_read(i[0], i[3]):
+                    pending.append(
+                        (
+                            index,
+                            executor.submit(self.run_request_in_thread, request, item, i),
+                        )
+                    )
+                    continue
+                # a write waits for the reads before it, and runs alone
+                for j, future in pending:
+                    results[j] = future.result()
+                pending = []
+                results[index] = self.run_request(request, item, i)
+            for j, future in pending:
+                results[j] = future.result()
+        return results
+
+    # one transaction where every sub-request sees the same snapshot of the database
+    @contextlib.contextmanager
+    def snapshot(self):
+        connection = connections[DEFAULT_DB_ALIAS]
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+                    )
+            yield
+
+    def post(self, request: Request):
+        items = request.data.get("requests", None)
+        if not isinstance(items, list) or not items:
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": "'requests' must be a non-empty list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > self.batch_max_requests:
+            return self.send_response(
+                True,
+                "bad_request",
+                {"details": f"At most {self.batch_max_requests} requests can be batched."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        resolved = []
+        for item in items:
+            try:
+                resolved.append(self.resolve_request(item))
+            except (BadRequest, Http404) as e:
+                resolved.append(e)
+
+        if request.data.get("snapshot", False):
+            if any(
+                not isinstance(i, Exception) and not self.is_read(i[0], i[3])
+                for i in resolved
+            ):
+                return self.send_response(
+                    True,
+                    "bad_request",
+                    {"details": "Snapshot batches can only read."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            with self.snapshot():
+                results = self.run_requests(request, items, resolved)
+        else:
+            concurrent = (
+                self.batch_max_workers > 1
+                and connections[DEFAULT_DB_ALIAS].vendor != "sqlite"
+            )
+            results = self.run_requests(request, items, resolved, concurrent)
 
-        # return the serialized queryset in a standardized manner
         return self.send_response(
-            False,
-            "success",
-            {**self.get_paginated_response(), "data": serialized_data.data},
-            status=status.HTTP_200_OK,
+            False, "success", {"data": results}, status=status.HTTP_200_OK
         )